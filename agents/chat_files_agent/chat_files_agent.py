@@ -37,6 +37,7 @@ websocket_platform = chat_files_agent.use_websocket_platform(use_ui=False)
 
 llm_name = chat_files_agent.get_property(OLLAMA_MODEL)
 max_tokens = chat_files_agent.get_property(OLLAMA_MAX_TOKENS)
+progress_max_rate = chat_files_agent.get_property(PROGRESS_MAX_RATE)
 
 # Create the LLM
 llm = LLMOllama(
@@ -154,7 +155,8 @@ def find_topic_body(session: Session):
         tokenizer=tokenizer,
         chunk_prompt=f'Your will receive a WhatsApp conversation (it can be in any language, or combining some languages). Your job is to identify those messages talking about "{topic}". This is the original user query: "{session.event.message}"\nReturn ONLY a list of integers containing the message indexes (The numbers preceding the messages indicate their indexes, so use that numbers in your answer)',
         final_prompt=None,
-        overlap=0
+        overlap=0,
+        progress_max_rate=progress_max_rate
     )
     message_ids = []
     for answer in answers:
@@ -189,7 +191,8 @@ def clean_chat_body(session: Session):
         tokenizer=tokenizer,
         chunk_prompt=f'Your will receive a WhatsApp conversation (it can be in any language, or combining some languages). Your job is to identify those messages talking about "{topic}". This is the original user query: "{session.event.message}"\nReturn ONLY a list of integers containing the message indexes (The numbers preceding the messages indicate their indexes, so use that numbers in your answer)',
         final_prompt=None,
-        overlap=0
+        overlap=0,
+        progress_max_rate=progress_max_rate
     )
     message_ids = []
     for answer in answers:
@@ -219,7 +222,8 @@ def fallback_body(session: Session):
         tokenizer=tokenizer,
         chunk_prompt=f"Your will receive a WhatsApp conversation (it can be in any language, or combining some languages). Do the following task based on the conversation content: {message}",
         final_prompt="You job is to combine the following LLM-generated answers. The original prompt was too big for the context length and was divided into chunks. Now, you must combine the answer the LLM gave on each chunk into a single one, keeping it coherent and avoiding duplicated content in your final answer. Don't mention the chunk partitions in your answer.",
-        overlap=3
+        overlap=3,
+        progress_max_rate=progress_max_rate
     )
     session.reply(answer)
 
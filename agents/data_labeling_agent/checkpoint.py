@@ -0,0 +1,70 @@
+import json
+import os
+
+
+def get_checkpoint_path(directory: str, request_id: int) -> str:
+    """
+    Returns the path of the checkpoint file of a labeling request.
+
+    :param directory: Directory where the checkpoints are stored.
+    :param request_id: The request ID.
+    :return: The checkpoint file path.
+    """
+    return os.path.join(directory, f'request_{request_id}.json')
+
+
+def save_checkpoint(directory: str, request_id: int, checkpoint: dict) -> None:
+    """
+    Stores the checkpoint of a labeling request, replacing the previous one.
+
+    The file is replaced atomically, so a crash while saving never leaves a corrupted checkpoint.
+
+    :param directory: Directory where the checkpoints are stored.
+    :param request_id: The request ID.
+    :param checkpoint: The checkpoint data.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = get_checkpoint_path(directory, request_id)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(directory: str, request_id: int) -> dict or None:
+    """
+    Loads the checkpoint of a labeling request.
+
+    :param directory: Directory where the checkpoints are stored.
+    :param request_id: The request ID.
+    :return: The checkpoint data, or None if the request has no (valid) checkpoint.
+    """
+    try:
+        with open(get_checkpoint_path(directory, request_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def has_checkpoint(directory: str, request_id: int) -> bool:
+    """
+    Checks whether a labeling request has a checkpoint, i.e. it was interrupted and can be resumed.
+
+    :param directory: Directory where the checkpoints are stored.
+    :param request_id: The request ID.
+    :return: True if the checkpoint exists, False otherwise.
+    """
+    return os.path.exists(get_checkpoint_path(directory, request_id))
+
+
+def delete_checkpoint(directory: str, request_id: int) -> None:
+    """
+    Deletes the checkpoint of a labeling request (if it exists).
+
+    :param directory: Directory where the checkpoints are stored.
+    :param request_id: The request ID.
+    """
+    try:
+        os.remove(get_checkpoint_path(directory, request_id))
+    except FileNotFoundError:
+        pass
@@ -4,18 +4,36 @@
 import json
 import logging
 import operator
+from functools import partial
 
 import elastic_transport
+from besser.agent import nlp
 from besser.agent.core.agent import Agent
 from besser.agent.core.session import Session
 from besser.agent.exceptions.logger import logger
 from besser.agent.library.transition.events.base_events import ReceiveJSONEvent, ReceiveTextEvent
 from besser.agent.nlp.intent_classifier.intent_classifier_configuration import LLMIntentClassifierConfiguration
 from elasticsearch import Elasticsearch
-
+from huggingface_hub import login
+from transformers import AutoTokenizer
+
+from agents.data_labeling_agent.document_chunker import DocumentChunker
+from agents.data_labeling_agent.email_preprocessor import EmailPreprocessor
+from agents.data_labeling_agent.embedding_prefilter import EmbeddingPrefilter, EmbeddingStore
+from agents.data_labeling_agent.job_manager import JobManager, LabelingJob
+from agents.data_labeling_agent.labeling_estimator import estimate_labeling
+from agents.data_labeling_agent.labeling_pipeline import LabelingPipeline, LabelingCancelled
+from agents.data_labeling_agent.model_cascade import ModelCascade
+from agents.data_labeling_agent.verdict_cache import VerdictCache
+from agents.elasticsearch.elasticsearch_client import ElasticsearchClientManager
+from agents.elasticsearch.query_cache import QueryCache
+from agents.elasticsearch.query_planner import get_field_mappings, plan_filters, explain_query_plan
+from agents.elasticsearch.update_by_query_task import UpdateByQueryTask
 from agents.elasticsearch.elasticsearch_query import build_query, get_num_docs, update_document_relevance_query, \
-    append_document_label_query, scroll_docs
-from agents.utils.llm_ollama import LLMOllama, OLLAMA_MODEL
+    append_document_label_query, count_labeled_docs
+from agents.utils.progress_reporter import ProgressReporter
+from agents.utils.llm_ollama import LLMOllama, OLLAMA_MODEL, HF_TOKENIZER, OLLAMA_MAX_TOKENS, PRIORITY_BATCH, \
+    llm_request_context
 from app.vars import *
 
 # Configure the logging module (optional)
@@ -29,6 +47,7 @@ data_labeling_agent.load_properties('data/config.ini')
 websocket_platform = data_labeling_agent.use_websocket_platform(use_ui=False)
 
 llm_name = data_labeling_agent.get_property(OLLAMA_MODEL)
+max_tokens = data_labeling_agent.get_property(OLLAMA_MAX_TOKENS)
 
 # Create the LLM
 llm = LLMOllama(
@@ -37,7 +56,115 @@ llm = LLMOllama(
     parameters={
         # 'max_completion_tokens': 1,
         # 'response_format': {"type": "json_object"}
-    }
+    },
+    # The labeling calls (without session) wait behind the interactive ones of both agents
+    priority=PRIORITY_BATCH
+)
+
+# Optional cascade: a small model classifies the documents first, and only the ones it is not confident about are
+# classified by the large model (llm)
+if data_labeling_agent.get_property(CASCADE_SMALL_MODEL):
+    cascade = ModelCascade(
+        small_llm=LLMOllama(
+            agent=data_labeling_agent,
+            name=data_labeling_agent.get_property(CASCADE_SMALL_MODEL),
+            parameters={},
+            priority=PRIORITY_BATCH
+        ),
+        large_llm=llm,
+        min_confidence=data_labeling_agent.get_property(CASCADE_MIN_CONFIDENCE)
+    )
+else:
+    cascade = None
+
+
+def load_tokenizer():
+    """Load the tokenizer used to measure the prompts (e.g. to fit several documents in a single LLM prompt).
+
+    The labeling also works without it (batches are only limited by their number of documents, and long documents are
+    neither truncated nor split), so if it cannot be loaded (e.g. HuggingFace is not reachable) the agent starts
+    anyway, without tokenizer.
+    """
+    try:
+        if data_labeling_agent.get_property(nlp.HF_API_KEY):
+            login(data_labeling_agent.get_property(nlp.HF_API_KEY))
+        return AutoTokenizer.from_pretrained(data_labeling_agent.get_property(HF_TOKENIZER))
+    except Exception as e:
+        logger.warning(f'The tokenizer {data_labeling_agent.get_property(HF_TOKENIZER)} could not be loaded, the '
+                       f'documents will be labeled without measuring their tokens: {e}')
+        return None
+
+
+# Tokenizer used to fit several documents in a single LLM prompt
+tokenizer = load_tokenizer()
+
+# Preprocessing of the email documents before sending them to the LLM, to shrink the prompts
+preprocessor = EmailPreprocessor(
+    html_to_text=data_labeling_agent.get_property(PREPROCESSING_HTML_TO_TEXT),
+    strip_quotes=data_labeling_agent.get_property(PREPROCESSING_STRIP_QUOTES),
+    strip_signatures=data_labeling_agent.get_property(PREPROCESSING_STRIP_SIGNATURES),
+    collapse_whitespace=data_labeling_agent.get_property(PREPROCESSING_COLLAPSE_WHITESPACE),
+    max_doc_tokens=data_labeling_agent.get_property(PREPROCESSING_MAX_DOC_TOKENS),
+    tokenizer=tokenizer
+)
+
+# Map-reduce classification of the documents that do not fit in the LLM context, shared by all sessions (it needs the
+# tokenizer to measure the documents)
+if tokenizer:
+    chunker = DocumentChunker(
+        tokenizer=tokenizer,
+        max_tokens=max_tokens,
+        overlap_tokens=data_labeling_agent.get_property(CHUNKING_OVERLAP_TOKENS),
+        combine=data_labeling_agent.get_property(CHUNKING_COMBINE),
+        max_workers=data_labeling_agent.get_property(PIPELINE_LLM_WORKERS)
+    )
+else:
+    chunker = None
+
+# Optional embedding prefilter, to skip the LLM for the documents unrelated to the instructions
+if data_labeling_agent.get_property(PREFILTER_MODEL):
+    prefilter = EmbeddingPrefilter(
+        llm=llm,
+        model=data_labeling_agent.get_property(PREFILTER_MODEL),
+        threshold=data_labeling_agent.get_property(PREFILTER_THRESHOLD),
+        store=EmbeddingStore(
+            path=data_labeling_agent.get_property(PREFILTER_STORE_PATH),
+            max_entries=data_labeling_agent.get_property(PREFILTER_STORE_MAX_ENTRIES)
+        )
+    )
+else:
+    prefilter = None
+
+# Persistent cache of LLM verdicts, shared by all sessions
+if data_labeling_agent.get_property(CACHE_MAX_ENTRIES) > 0:
+    verdict_cache = VerdictCache(
+        path=data_labeling_agent.get_property(CACHE_PATH),
+        max_entries=data_labeling_agent.get_property(CACHE_MAX_ENTRIES)
+    )
+else:
+    verdict_cache = None
+
+# Elasticsearch client (and connection pool), shared by all sessions
+es_manager = ElasticsearchClientManager(
+    host=data_labeling_agent.get_property(ELASTICSEARCH_HOST),
+    port=data_labeling_agent.get_property(ELASTICSEARCH_PORT),
+    connections_per_node=data_labeling_agent.get_property(ELASTICSEARCH_CONNECTIONS_PER_NODE),
+    request_timeout=data_labeling_agent.get_property(ELASTICSEARCH_REQUEST_TIMEOUT),
+    max_retries=data_labeling_agent.get_property(ELASTICSEARCH_MAX_RETRIES),
+    retry_backoff=data_labeling_agent.get_property(ELASTICSEARCH_RETRY_BACKOFF),
+    health_check_interval=data_labeling_agent.get_property(ELASTICSEARCH_HEALTH_CHECK_INTERVAL)
+)
+
+# Cache of query results (hit counts), shared by all sessions
+query_cache = QueryCache(
+    max_entries=data_labeling_agent.get_property(QUERY_CACHE_MAX_ENTRIES),
+    ttl=data_labeling_agent.get_property(QUERY_CACHE_TTL)
+)
+
+# Labeling requests run as background jobs, shared by all sessions
+job_manager = JobManager(
+    max_concurrent_jobs=data_labeling_agent.get_property(JOBS_MAX_CONCURRENT),
+    max_finished_jobs=data_labeling_agent.get_property(JOBS_MAX_FINISHED)
 )
 
 llm_ic_config = LLMIntentClassifierConfiguration(
@@ -67,23 +194,40 @@ no_intent = data_labeling_agent.new_intent('no_intent', ['no'])
 initialization_state = data_labeling_agent.new_state('initialization_state', initial=True)
 initial_state = data_labeling_agent.new_state('initial_state')
 build_query_state = data_labeling_agent.new_state('build_query_state')
+confirmation_state = data_labeling_agent.new_state('confirmation_state')
 run_query_state = data_labeling_agent.new_state('run_query_state')
+job_control_state = data_labeling_agent.new_state('job_control_state')
+query_plan_state = data_labeling_agent.new_state('query_plan_state')
 fallback_state = data_labeling_agent.new_state('fallback_state')
 
 
 # STATES BODIES' DEFINITION + TRANSITIONS
 
+ELASTICSEARCH_UNAVAILABLE_MESSAGE = 'I could not connect to your Elasticsearch database. Please, make sure the database is running and check the connection parameters.'
+
+
+def is_job_action(session: Session) -> bool:
+    """Check whether the received JSON message is a job control action (instead of a labeling request)."""
+    return JOB_ACTION in json.loads(session.event.message)
+
+
+def is_query_plan(session: Session) -> bool:
+    """Check whether the received JSON message asks for the query plan of some filters (instead of being a labeling
+    request)."""
+    return QUERY_PLAN in json.loads(session.event.message)
+
+
+def is_request(session: Session) -> bool:
+    return not is_job_action(session) and not is_query_plan(session)
+
 
 def initialization_body(session: Session):
-    # Establish connection to elasticsearch
-    es_host = data_labeling_agent.get_property(ELASTICSEARCH_HOST)
-    es_port = data_labeling_agent.get_property(ELASTICSEARCH_PORT)
+    # All sessions share the same elasticsearch client
     es_index = data_labeling_agent.get_property(ELASTICSEARCH_INDEX)
-    es_url = f'http://{es_host}:{es_port}'
-    es = Elasticsearch([es_url])
-    session.set(ELASTICSEARCH, es)
+    session.set(ELASTICSEARCH, es_manager.client)
     session.set(INDEX, es_index)
     session.set(YES_TO_ALL, False)
+    session.set(AWAITING_CONFIRMATION, False)
     session.reply('Hello! I am the Data Labeling agent. You can send me requests through the form on the left side, or ask any doubt through the chat input box.')
 
 
@@ -92,102 +236,329 @@ initialization_state.go_to(initial_state)
 
 
 def initial_body(session: Session):
-    pass
+    # Any pending request was either run or discarded
+    session.set(AWAITING_CONFIRMATION, False)
 
 
 initial_state.set_body(initial_body)
-initial_state.when_event(ReceiveJSONEvent()).go_to(build_query_state)
+initial_state.when_event(ReceiveJSONEvent()).with_condition(is_job_action).go_to(job_control_state)
+initial_state.when_event(ReceiveJSONEvent()).with_condition(is_query_plan).go_to(query_plan_state)
+initial_state.when_event(ReceiveJSONEvent()).with_condition(is_request).go_to(build_query_state)
 initial_state.when_no_intent_matched().go_to(fallback_state)
 
 
 def build_query_body(session: Session):
-    session.reply('Request received. First, I am going to select the documents that match your filters...')
     request = json.loads(session.event.message)
+    if request.get(RESUME, False):
+        session.reply(f'Request received. I will resume request #{request[REQUEST_ID]} from its last checkpoint. First, I am going to select the documents that match your filters...')
+    else:
+        session.reply('Request received. First, I am going to select the documents that match your filters...')
     es: Elasticsearch = session.get(ELASTICSEARCH)
     index: str = session.get(INDEX)
-    query = build_query(
-        date_from=request[DATE_FROM],
-        date_to=request[DATE_TO],
-        filters=request[FILTERS]
-    )
     session.set(REQUEST, request)
-    session.set(QUERY, query)
     session.set(ELASTICSEARCH_CONNECTION_ERROR, False)
+    session.set(AWAITING_CONFIRMATION, False)
+    if not es_manager.is_available():
+        session.reply(ELASTICSEARCH_UNAVAILABLE_MESSAGE)
+        session.set(ELASTICSEARCH_CONNECTION_ERROR, True)
+        return
     try:
+        query = build_query(
+            date_from=request[DATE_FROM],
+            date_to=request[DATE_TO],
+            filters=request[FILTERS],
+            mappings=get_field_mappings(es, index)
+        )
+        session.set(QUERY, query)
         num_docs = get_num_docs(
             es_client=es,
             index_name=index,
-            query=query
+            query=query,
+            query_cache=query_cache
         )
         message = f'There are {num_docs} documents matching your filters. '
         if request[INSTRUCTIONS]:
             message += f'The next step is to determine whether these documents satisfy the instructions you defined. This may take some time since each document is analyzed with an LLM.'
             if not session.get(YES_TO_ALL):
+                sample_size = data_labeling_agent.get_property(ESTIMATION_SAMPLE_SIZE)
+                if sample_size > 0 and num_docs > 0:
+                    session.reply(message)
+                    message = estimate_body(session, request, num_docs, sample_size)
                 message += " Do you want to proceed?"
         elif not session.get(YES_TO_ALL):
             message += f'Do you want to proceed assigning them the score/label you selected?'
         session.reply(message)
         if not session.get(YES_TO_ALL):
             websocket_platform.reply_options(session, ['Yes', 'No', 'Yes to all'])
-    except elastic_transport.ConnectionError as e:
-        session.reply('I could not connect to your Elasticsearch database. Please, make sure the database is running and check the connection parameters.')
+            session.set(AWAITING_CONFIRMATION, True)
+    except elastic_transport.TransportError:
+        # The database went down (or timed out) after the health check
+        session.reply(ELASTICSEARCH_UNAVAILABLE_MESSAGE)
         session.set(ELASTICSEARCH_CONNECTION_ERROR, True)
 
 
+def estimate_body(session: Session, request: dict, num_docs: int, sample_size: int) -> str:
+    """Estimate the cost and match rate of a request with instructions on a random sample (dry run), before the user
+    confirms it. Returns the message with the estimation."""
+    es: Elasticsearch = session.get(ELASTICSEARCH)
+    index: str = session.get(INDEX)
+    # Only the documents without the target score/label would be analyzed
+    num_docs -= count_labeled_docs(
+        es_client=es,
+        index_name=index,
+        query=session.get(QUERY),
+        action=request[ACTION],
+        target_value=request[TARGET_VALUE],
+        query_cache=query_cache
+    )
+    if num_docs == 0:
+        return 'All of them already have the score/label you selected, so none will be analyzed.'
+    session.reply(f'Let me analyze a random sample of {min(sample_size, num_docs)} documents to estimate the time and the number of matching documents...')
+    try:
+        # The sample is classified with the priority of the labeling jobs, sharing the LLM fairly with them
+        with llm_request_context(PRIORITY_BATCH, session.id):
+            estimate = estimate_labeling(
+                es_client=es,
+                index_name=index,
+                query=build_query(
+                    date_from=request[DATE_FROM],
+                    date_to=request[DATE_TO],
+                    filters=request[FILTERS],
+                    exclude_action=request[ACTION],
+                    exclude_target_value=request[TARGET_VALUE],
+                    mappings=get_field_mappings(es, index)
+                ),
+                request=request,
+                llm=llm,
+                num_docs=num_docs,
+                sample_size=sample_size,
+                llm_workers=data_labeling_agent.get_property(PIPELINE_LLM_WORKERS),
+                batch_max_docs=data_labeling_agent.get_property(BATCH_MAX_DOCS),
+                verdict_cache=verdict_cache,
+                preprocessor=preprocessor,
+                chunker=chunker,
+                prefilter=prefilter,
+                cascade=cascade
+            )
+    except elastic_transport.TransportError:
+        raise
+    except Exception as e:
+        logger.error(f'The estimation of request #{request[REQUEST_ID]} failed: {e}')
+        return 'I could not estimate the cost of the analysis (the LLM may not be available).'
+    if estimate is None:
+        return 'No documents could be sampled for the estimation.'
+    return estimate.to_str()
+
+
 build_query_state.set_body(build_query_body)
 build_query_state.when_variable_matches_operation(ELASTICSEARCH_CONNECTION_ERROR, operator.eq, True).go_to(initial_state)
 build_query_state.when_variable_matches_operation(YES_TO_ALL, operator.eq, True).go_to(run_query_state)
-build_query_state.when_intent_matched(yes_intent).go_to(run_query_state)
-build_query_state.when_intent_matched(yes_to_all_intent).go_to(run_query_state)
-build_query_state.when_intent_matched(no_intent).go_to(initial_state)
-build_query_state.when_event(ReceiveJSONEvent()).go_to(build_query_state)
+build_query_state.when_variable_matches_operation(AWAITING_CONFIRMATION, operator.eq, True).go_to(confirmation_state)
+build_query_state.when_variable_matches_operation(AWAITING_CONFIRMATION, operator.eq, False).go_to(initial_state)
+
+
+def confirmation_body(session: Session):
+    # The request is waiting for the user's answer. The job actions (and query plans) received meanwhile come back to
+    # this state, so the request is not discarded
+    pass
+
+
+confirmation_state.set_body(confirmation_body)
+confirmation_state.when_intent_matched(yes_intent).go_to(run_query_state)
+confirmation_state.when_intent_matched(yes_to_all_intent).go_to(run_query_state)
+confirmation_state.when_intent_matched(no_intent).go_to(initial_state)
+confirmation_state.when_event(ReceiveJSONEvent()).with_condition(is_job_action).go_to(job_control_state)
+confirmation_state.when_event(ReceiveJSONEvent()).with_condition(is_query_plan).go_to(query_plan_state)
+confirmation_state.when_event(ReceiveJSONEvent()).with_condition(is_request).go_to(build_query_state)
 
 
 def run_query_body(session: Session):
+    session.set(AWAITING_CONFIRMATION, False)
     if isinstance(session.event, ReceiveTextEvent) and session.event.predicted_intent.intent == yes_to_all_intent:
         session.set(YES_TO_ALL, True)
-    es: Elasticsearch = session.get(ELASTICSEARCH)
-    index: str = session.get(INDEX)
-    query = session.get(QUERY)
     request = session.get(REQUEST)
-    if request[INSTRUCTIONS]:
-        session.reply('Proceeding with the document analysis...')
-        scroll_docs(
-            session=session,
-            es_client=es,
-            index_name=index,
-            query=query,
-            request=request,
-            llm=llm,
-            batch_size=1
-        )
-    else:
-        if request[ACTION] == DOCUMENT_RELEVANCE:
-            update_document_relevance_query(
+    job = job_manager.submit(
+        session=session,
+        request=request,
+        target=partial(run_labeling_job, es=session.get(ELASTICSEARCH), index=session.get(INDEX), query=session.get(QUERY))
+    )
+    message = f'Request #{request[REQUEST_ID]} added to the job queue (job #{job.id}).'
+    if job_manager.count_active_jobs() > data_labeling_agent.get_property(JOBS_MAX_CONCURRENT):
+        message += ' It will start when one of the running jobs finishes.'
+    session.reply(message + ' You can follow its progress, pause it or cancel it from the job list. Ready to listen to your next request.')
+
+
+def run_labeling_job(job: LabelingJob, es: Elasticsearch, index: str, query: dict):
+    session = job.session
+    request = job.request
+    try:
+        if request[INSTRUCTIONS]:
+            session.reply(f'Proceeding with the document analysis of request #{request[REQUEST_ID]} (job #{job.id})...')
+            # Documents that already have the target score/label are counted, but not analyzed again
+            labeled_docs = count_labeled_docs(
                 es_client=es,
                 index_name=index,
                 query=query,
-                document_relevance=request[TARGET_VALUE]
+                action=request[ACTION],
+                target_value=request[TARGET_VALUE],
+                query_cache=query_cache
+            )
+            unlabeled_query = build_query(
+                date_from=request[DATE_FROM],
+                date_to=request[DATE_TO],
+                filters=request[FILTERS],
+                exclude_action=request[ACTION],
+                exclude_target_value=request[TARGET_VALUE],
+                mappings=get_field_mappings(es, index)
             )
-        elif request[ACTION] == DOCUMENT_LABELS:
-            append_document_label_query(
+            pipeline = LabelingPipeline(
+                session=session,
                 es_client=es,
                 index_name=index,
-                query=query,
-                new_label=request[TARGET_VALUE]
+                query=unlabeled_query,
+                request=request,
+                llm=llm,
+                labeled_docs=labeled_docs,
+                page_size=data_labeling_agent.get_property(PIPELINE_PAGE_SIZE),
+                llm_workers=data_labeling_agent.get_property(PIPELINE_LLM_WORKERS),
+                prefetch_pages=data_labeling_agent.get_property(PIPELINE_PREFETCH_PAGES),
+                write_queue_size=data_labeling_agent.get_property(PIPELINE_WRITE_QUEUE_SIZE),
+                slices=data_labeling_agent.get_property(PIPELINE_SLICES),
+                keep_alive=data_labeling_agent.get_property(PIPELINE_KEEP_ALIVE),
+                bulk_max_actions=data_labeling_agent.get_property(BULK_MAX_ACTIONS),
+                bulk_flush_interval=data_labeling_agent.get_property(BULK_FLUSH_INTERVAL),
+                bulk_max_retries=data_labeling_agent.get_property(BULK_MAX_RETRIES),
+                batch_max_docs=data_labeling_agent.get_property(BATCH_MAX_DOCS),
+                batch_max_tokens=max_tokens,
+                tokenizer=tokenizer,
+                preprocessor=preprocessor,
+                chunker=chunker,
+                prefilter=prefilter,
+                cascade=cascade,
+                verdict_cache=verdict_cache,
+                query_cache=query_cache,
+                checkpoint_directory=data_labeling_agent.get_property(CHECKPOINT_DIRECTORY),
+                checkpoint_interval=data_labeling_agent.get_property(CHECKPOINT_INTERVAL),
+                resume=request.get(RESUME, False),
+                progress_max_rate=data_labeling_agent.get_property(PROGRESS_MAX_RATE),
+                job_id=job.id
             )
-        num_docs = get_num_docs(
+            job.set_task(pipeline)
+            pipeline.run()
+            session.reply(pipeline.summary())
+        else:
+            # The update runs in the background (in parallel slices) as an elasticsearch task, which is polled
+            if request[ACTION] == DOCUMENT_RELEVANCE:
+                response = update_document_relevance_query(
+                    es_client=es,
+                    index_name=index,
+                    query=query,
+                    document_relevance=request[TARGET_VALUE],
+                    wait_for_completion=False
+                )
+            else:
+                response = append_document_label_query(
+                    es_client=es,
+                    index_name=index,
+                    query=query,
+                    new_label=request[TARGET_VALUE],
+                    wait_for_completion=False
+                )
+            task = UpdateByQueryTask(
+                es_client=es,
+                task_id=response['task'],
+                poll_interval=data_labeling_agent.get_property(UPDATE_BY_QUERY_POLL_INTERVAL)
+            )
+            job.set_task(task)
+            progress = ProgressReporter(session, data_labeling_agent.get_property(PROGRESS_MAX_RATE))
+
+            def task_progress(status: dict) -> dict:
+                return {
+                    JOB_ID: job.id,
+                    REQUEST_ID: request[REQUEST_ID],
+                    UPDATED_DOCS: status.get('updated', 0) + status.get('noops', 0),
+                    IGNORED_DOCS: status.get('version_conflicts', 0),
+                    TOTAL_DOCS: status.get('total', 0)
+                }
+
+            try:
+                result = task.wait(on_progress=lambda status: progress.update(task_progress(status)))
+            finally:
+                # The counts of the index changed (also if the task failed or was cancelled halfway)
+                query_cache.invalidate(index)
+            # The final counts come from the task result
+            progress.finish(task_progress(result))
+            if task.cancelled:
+                raise LabelingCancelled(f'Request #{request[REQUEST_ID]} was cancelled')
+    except elastic_transport.TransportError:
+        # Connection errors and timeouts (after the client retries)
+        session.reply(f'Request #{request[REQUEST_ID]} failed: {ELASTICSEARCH_UNAVAILABLE_MESSAGE}')
+        raise
+    except LabelingCancelled:
+        if request[INSTRUCTIONS]:
+            session.reply(f'🚫 Request #{request[REQUEST_ID]} was cancelled. You can resume it from the History tab.')
+        else:
+            session.reply(f'🚫 Request #{request[REQUEST_ID]} was cancelled. The documents updated before cancelling keep the score/label.')
+        raise
+    session.reply(f'✅ Request #{request[REQUEST_ID]} completed!')
+
+
+run_query_state.set_body(run_query_body)
+run_query_state.go_to(initial_state)
+
+
+def job_control_body(session: Session):
+    message = json.loads(session.event.message)
+    job = job_manager.get_job(message[JOB_ID], session)
+    if job is None:
+        session.reply(f'Job #{message[JOB_ID]} does not exist.')
+        return
+    if message[JOB_ACTION] == PAUSE_JOB:
+        done = job.pause()
+    elif message[JOB_ACTION] == UNPAUSE_JOB:
+        done = job.unpause()
+    elif message[JOB_ACTION] == CANCEL_JOB:
+        done = job.cancel()
+    else:
+        done = False
+    if not done:
+        session.reply(f'The action "{message[JOB_ACTION]}" cannot be applied to job #{job.id} now (it is {job.status}).')
+
+
+job_control_state.set_body(job_control_body)
+# Back to the pending request, if any
+job_control_state.when_variable_matches_operation(AWAITING_CONFIRMATION, operator.eq, True).go_to(confirmation_state)
+job_control_state.when_variable_matches_operation(AWAITING_CONFIRMATION, operator.eq, False).go_to(initial_state)
+
+
+def query_plan_body(session: Session):
+    message = json.loads(session.event.message)
+    es: Elasticsearch = session.get(ELASTICSEARCH)
+    index: str = session.get(INDEX)
+    if not es_manager.is_available():
+        return
+    try:
+        mappings = get_field_mappings(es, index)
+        query = build_query(filters=message[FILTERS], mappings=mappings)
+        report = explain_query_plan(
             es_client=es,
             index_name=index,
-            query=query
+            query=query,
+            planned_filters=plan_filters(message[FILTERS], mappings),
+            profile_timeout=data_labeling_agent.get_property(QUERY_PLANNER_PROFILE_TIMEOUT),
+            slow_query_time=data_labeling_agent.get_property(QUERY_PLANNER_SLOW_QUERY_TIME)
         )
-        session.reply(json.dumps({REQUEST_ID: session.get(REQUEST)[REQUEST_ID], UPDATED_DOCS: num_docs, IGNORED_DOCS: 0, TOTAL_DOCS: num_docs, FINISHED: True}))
-
-    session.reply('✅ Process completed! Ready to listen to your next request.')
+    except Exception as e:
+        logger.error(f'The query plan could not be computed: {e}')
+        return
+    # The plan is shown in the Filters tab, not in the chat
+    session.reply(json.dumps({QUERY_PLAN: message[QUERY_PLAN], **report}))
 
 
-run_query_state.set_body(run_query_body)
-run_query_state.go_to(initial_state)
+query_plan_state.set_body(query_plan_body)
+# The UI asks for plans on its own (when the filters change), so the pending request, if any, must not be discarded
+query_plan_state.when_variable_matches_operation(AWAITING_CONFIRMATION, operator.eq, True).go_to(confirmation_state)
+query_plan_state.when_variable_matches_operation(AWAITING_CONFIRMATION, operator.eq, False).go_to(initial_state)
 
 
 def fallback_body(session: Session):
@@ -204,7 +575,8 @@ or assigning a custom label to a document. The user can set filters to filter th
 The user can also set 'Instructions', which are natural language prompts that can be used by an LLM to try to find those documents that match
 the instructions. The chat messages (like the one that made this interaction happen) are only used to guide the user on how to use the form.
 This is the user message: '{session.event.message}'.
-"""
+""",
+        session=session
     )
     session.reply(response)
 
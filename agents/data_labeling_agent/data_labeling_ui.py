@@ -7,6 +7,8 @@ from besser.agent.core.message import Message, MessageType
 from besser.agent.platforms.payload import PayloadAction, Payload, PayloadEncoder
 from dateutil.relativedelta import relativedelta
 
+from agents.data_labeling_agent.checkpoint import has_checkpoint
+from agents.data_labeling_agent.data_labeling_agent import data_labeling_agent
 from agents.utils.json_utils import iterate_json_file, update_entry_by_id, update_json_file
 from agents.utils.chat import load_chat
 from agents.data_labeling_agent.request import Request, Instruction, Filter
@@ -107,6 +109,41 @@ def filters():
             st.session_state[AGENT_DATA_LABELING][FILTERS].append(filter)
             st.session_state[AGENT_DATA_LABELING][FILTERS_CHECKBOXES].append(False)
     checkboxes(FILTERS, FILTERS_CHECKBOXES)
+    query_plan()
+
+
+def query_plan():
+    """Show the estimated cost of the filters, computed by the agent every time the filters change."""
+    filters = [f.to_json() for f in st.session_state[AGENT_DATA_LABELING][FILTERS]]
+    if not filters:
+        return
+    plan_key = json.dumps(filters, sort_keys=True)
+    if st.session_state[AGENT_DATA_LABELING].get(QUERY_PLAN) != plan_key:
+        payload = Payload(action=PayloadAction.USER_MESSAGE,
+                          message=json.dumps({QUERY_PLAN: plan_key, FILTERS: filters}))
+        try:
+            ws = st.session_state[AGENT_DATA_LABELING][WEBSOCKET]
+            ws.send(json.dumps(payload, cls=PayloadEncoder))
+            st.session_state[AGENT_DATA_LABELING][QUERY_PLAN] = plan_key
+        except Exception as e:
+            st.error('The cost of the filters could not be estimated. The connection is already closed')
+            return
+    plan = st.session_state[QUERY_PLAN] if QUERY_PLAN in st.session_state else None
+    if plan is None or plan[QUERY_PLAN] != plan_key:
+        st.caption('Estimating the cost of the filters...')
+        return
+    for warning in plan[PLAN_WARNINGS]:
+        st.warning(warning, icon='⚠️')
+    with st.expander('Query plan', expanded=False):
+        st.markdown('Filters in execution order:')
+        for planned_filter in plan[PLAN_FILTERS]:
+            st.markdown(f'- {planned_filter}')
+        if plan[PLAN_REWRITES]:
+            st.markdown('Filters rewritten to cheaper queries:')
+            for rewrite in plan[PLAN_REWRITES]:
+                st.markdown(f'- {rewrite}')
+        if plan[PLAN_TOOK] is not None:
+            st.text(f'Estimated query time: {plan[PLAN_TOOK]:.2f} s')
 
 
 def checkboxes(key: str, checkboxes_key: str):
@@ -138,10 +175,10 @@ def create_request():
     request.filters = st.session_state[AGENT_DATA_LABELING][FILTERS]
     request.instructions = st.session_state[AGENT_DATA_LABELING][INSTRUCTIONS]
     with submit_tab:
-        load_progress_bar()
+        load_jobs('submit')
         submit_request(request)
     with history_tab:
-        load_progress_bar()
+        load_jobs('history')
         request_history()
     return request
 
@@ -157,8 +194,27 @@ def request_history():
             icon=":material/download:",
             mime="application/json"
         )
+    # The checkpoints are looked up where the agent stores them
+    checkpoint_directory = data_labeling_agent.get_property(CHECKPOINT_DIRECTORY)
+    # Requests with a queued, running or paused job cannot be resumed (their checkpoint is in use)
+    active_requests = [job[REQUEST_ID] for job in st.session_state.get(JOBS, {}).values()
+                       if job.get(JOB_STATUS) in [JOB_QUEUED, JOB_RUNNING, JOB_PAUSED, JOB_CANCELLING]]
     for i, r in enumerate(iterate_json_file(st.secrets[REQUEST_HISTORY_FILE])):
         with st.expander(f"Request #{i + 1} at {r[TIMESTAMP]}", expanded=False):
+            if r[REQUEST_ID] not in active_requests and has_checkpoint(checkpoint_directory, r[REQUEST_ID]):
+                st.info('This request was interrupted. You can resume it from its last checkpoint.')
+                if st.button('Resume', type='primary', use_container_width=True, key=f'resume_{i}'):
+                    message = f'Request #{r[REQUEST_ID]} resumed'
+                    message = Message(t=MessageType.STR, content=message, is_user=True, timestamp=datetime.now())
+                    st.session_state[AGENT_DATA_LABELING][HISTORY].append(message)
+                    payload = Payload(action=PayloadAction.USER_MESSAGE,
+                                      message=json.dumps({**r, RESUME: True}))
+                    try:
+                        ws = st.session_state[AGENT_DATA_LABELING][WEBSOCKET]
+                        ws.send(json.dumps(payload, cls=PayloadEncoder))
+                        st.rerun()
+                    except Exception as e:
+                        st.error('Your message could not be sent. The connection is already closed')
             if st.button('Submit', type='primary', use_container_width=True, key=f'submit_{i}'):
                 request = Request(
                     action=r[ACTION],
@@ -172,8 +228,6 @@ def request_history():
                 # st.session_state[AGENT_DATA_LABELING][HISTORY].clear()
                 request_json = request.to_json()
                 update_json_file(st.secrets[REQUEST_HISTORY_FILE], [request_json])
-                if PROGRESS_DATA_LABELING in st.session_state[AGENT_DATA_LABELING]:
-                    del st.session_state[AGENT_DATA_LABELING][PROGRESS_DATA_LABELING]
                 message = f'Request #{request.id} submitted'
                 message = Message(t=MessageType.STR, content=message, is_user=True, timestamp=datetime.now())
                 st.session_state[AGENT_DATA_LABELING][HISTORY].append(message)
@@ -211,8 +265,6 @@ def submit_request(request):
         request.timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         request_json = request.to_json()
         update_json_file(st.secrets[REQUEST_HISTORY_FILE], [request_json])
-        if PROGRESS_DATA_LABELING in st.session_state[AGENT_DATA_LABELING]:
-            del st.session_state[AGENT_DATA_LABELING][PROGRESS_DATA_LABELING]
         message = f'Request #{request.id} submitted'
         message = Message(t=MessageType.STR, content=message, is_user=True, timestamp=datetime.now())
         st.session_state[AGENT_DATA_LABELING][HISTORY].append(message)
@@ -228,39 +280,85 @@ def submit_request(request):
     st.json(request.to_json(), expanded=False)
 
 
-def load_progress_bar():
-    if PROGRESS_DATA_LABELING in st.session_state:
-        with st.container(border=True, height=200):
-            updated = st.session_state[PROGRESS_DATA_LABELING][UPDATED_DOCS]
-            ignored = st.session_state[PROGRESS_DATA_LABELING][IGNORED_DOCS]
-            total = st.session_state[PROGRESS_DATA_LABELING][TOTAL_DOCS]
-            initial_time = st.session_state[PROGRESS_DATA_LABELING][INITIAL_TIME]
-
-            time = datetime.now() - initial_time
-            total_seconds = int(time.total_seconds())
-            if updated + ignored > 0:
-                eta_total_seconds = int(((total - (updated + ignored)) * total_seconds) / (updated + ignored))
-            else:
-                eta_total_seconds = 0
-            hours = total_seconds // 3600
-            minutes = (total_seconds % 3600) // 60
-            seconds = total_seconds % 60
-
-            eta_hours = eta_total_seconds // 3600
-            eta_minutes = (eta_total_seconds % 3600) // 60
-            eta_seconds = eta_total_seconds % 60
-
-            st.markdown(f'**{int(((updated + ignored) / total) * 100)}% completed**')
-            st.progress(updated/total, text=f"{updated}/{total} documents updated")
-            st.progress(ignored/total, text=f"{ignored}/{total} documents ignored")
-
-            time_message = f"{hours:02}:{minutes:02}:{seconds:02}"
-            if eta_total_seconds > 0:
-                time_message += f' | ETA: {eta_hours:02}:{eta_minutes:02}:{eta_seconds:02}'
-            st.text(time_message)
-        if st.session_state[PROGRESS_DATA_LABELING][FINISHED]:
-            st.session_state[PROGRESS_DATA_LABELING][FINISHED] = False  # To avoid overwriting multiple times
-            update_entry_by_id(st.secrets[REQUEST_HISTORY_FILE], st.session_state[PROGRESS_DATA_LABELING][REQUEST_ID], {UPDATED_DOCS: updated, IGNORED_DOCS: ignored, TIME: time_message})
+def load_jobs(key: str):
+    """Show the labeling jobs of the session (the most recent first), with their progress and control buttons.
+
+    The key identifies the tab where the list is shown, so that the buttons of each tab are different widgets.
+    """
+    if JOBS not in st.session_state or not st.session_state[JOBS]:
+        return
+    st.subheader('Jobs')
+    with st.container(height=400):
+        for job in sorted(st.session_state[JOBS].values(), key=lambda j: j[JOB_ID], reverse=True):
+            with st.container(border=True):
+                load_job(job, key)
+
+
+def load_job(job: dict, key: str):
+    status = job.get(JOB_STATUS, JOB_QUEUED)
+    st.markdown(f'**Job #{job[JOB_ID]}** (request #{job[REQUEST_ID]}) · {job_status_dict[status]}')
+    if job.get(JOB_ERROR):
+        st.error(job[JOB_ERROR])
+    if TOTAL_DOCS in job:
+        load_progress_bar(job)
+    buttons = []
+    if status == JOB_RUNNING:
+        buttons.append(('Pause', PAUSE_JOB))
+    if status == JOB_PAUSED:
+        buttons.append(('Continue', UNPAUSE_JOB))
+    if status in [JOB_QUEUED, JOB_RUNNING, JOB_PAUSED]:
+        buttons.append(('Cancel', CANCEL_JOB))
+    if buttons:
+        cols = st.columns(len(buttons))
+        for col, (label, job_action) in zip(cols, buttons):
+            if col.button(label, use_container_width=True, key=f'{key}_{job_action}_{job[JOB_ID]}'):
+                send_job_action(job[JOB_ID], job_action)
+
+
+def send_job_action(job_id: int, job_action: str):
+    payload = Payload(action=PayloadAction.USER_MESSAGE,
+                      message=json.dumps({JOB_ID: job_id, JOB_ACTION: job_action}))
+    try:
+        ws = st.session_state[AGENT_DATA_LABELING][WEBSOCKET]
+        ws.send(json.dumps(payload, cls=PayloadEncoder))
+    except Exception as e:
+        st.error('Your message could not be sent. The connection is already closed')
+
+
+def load_progress_bar(job: dict):
+    updated = job[UPDATED_DOCS]
+    ignored = job[IGNORED_DOCS]
+    total = job[TOTAL_DOCS]
+    initial_time = job[INITIAL_TIME]
+
+    time = datetime.now() - initial_time
+    total_seconds = int(time.total_seconds())
+    if updated + ignored > 0:
+        eta_total_seconds = int(((total - (updated + ignored)) * total_seconds) / (updated + ignored))
+    else:
+        eta_total_seconds = 0
+    hours = total_seconds // 3600
+    minutes = (total_seconds % 3600) // 60
+    seconds = total_seconds % 60
+
+    eta_hours = eta_total_seconds // 3600
+    eta_minutes = (eta_total_seconds % 3600) // 60
+    eta_seconds = eta_total_seconds % 60
+
+    if total > 0:
+        st.markdown(f'**{int(((updated + ignored) / total) * 100)}% completed**')
+        st.progress(updated/total, text=f"{updated}/{total} documents updated")
+        st.progress(ignored/total, text=f"{ignored}/{total} documents ignored")
+    else:
+        st.markdown('**No documents to process**')
+
+    time_message = f"{hours:02}:{minutes:02}:{seconds:02}"
+    if eta_total_seconds > 0 and job.get(JOB_STATUS) == JOB_RUNNING:
+        time_message += f' | ETA: {eta_hours:02}:{eta_minutes:02}:{eta_seconds:02}'
+    st.text(time_message)
+    if job[FINISHED]:
+        job[FINISHED] = False  # To avoid overwriting multiple times
+        update_entry_by_id(st.secrets[REQUEST_HISTORY_FILE], job[REQUEST_ID], {UPDATED_DOCS: updated, IGNORED_DOCS: ignored, TIME: time_message})
 
 
 def data_labeling():
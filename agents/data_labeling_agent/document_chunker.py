@@ -0,0 +1,178 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+from besser.agent.nlp.llm.llm import LLM
+
+from agents.elasticsearch.elasticsearch_query import classify_doc, CLASSIFY_INSTRUCTION
+from agents.utils.token_count import token_count
+
+# How the verdicts of the chunks of a document are combined
+COMBINE_ANY = 'any'  # The document satisfies the instructions if any chunk does
+COMBINE_RECONCILE = 'reconcile'  # The LLM takes notes of each chunk, and decides on the notes with a final call
+COMBINE_MODES = [COMBINE_ANY, COMBINE_RECONCILE]
+
+# Tokens reserved in the prompts for the LLM answer
+_ANSWER_TOKENS = 16
+
+CHUNK_NOTES_PROMPT = "You will receive a list of filters, which may relate to a specific document field, and one part of a long elasticsearch document (the document is too long to be analyzed at once). Write a few sentences with the information of this part that is relevant to decide whether the whole document satisfies each filter. If this part has no relevant information, answer 'Nothing relevant'."
+
+
+def split_text(text: str, tokenizer, max_tokens: int, overlap: int = 0) -> list[str]:
+    """
+    Splits a text into chunks of at most max_tokens tokens.
+
+    :param text: The text
+    :param tokenizer: The tokenizer used to measure the chunks (a HuggingFace tokenizer)
+    :param max_tokens: Maximum number of tokens of a chunk
+    :param overlap: Number of tokens repeated at the beginning of each chunk from the end of the previous one, so that
+        sentences split between chunks are not lost
+    :return: The chunks
+    """
+    tokens = tokenizer.encode(text, add_special_tokens=False)
+    max_tokens = max(1, max_tokens)
+    # Each chunk must advance at least 1 token, otherwise the end of the text would be lost
+    overlap = min(max(0, overlap), max_tokens - 1)
+    step = max_tokens - overlap
+    return [tokenizer.decode(tokens[start:start + max_tokens])
+            for start in range(0, max(1, len(tokens) - overlap), step)]
+
+
+class DocumentChunker:
+    """Classifies the documents that do not fit in the LLM context with map-reduce.
+
+    The longest field of the document (usually CONTENT) is split into chunks that fit in ``max_tokens`` together with
+    the instructions and the rest of the fields, which are repeated in every chunk. The chunks are classified in
+    parallel and their verdicts are combined according to ``combine``:
+
+    - COMBINE_ANY: the document satisfies the instructions if any of its chunks does. The remaining chunks are not sent
+      to the LLM once a chunk satisfies them. Suitable for instructions like "mentions X" or "talks about Y".
+    - COMBINE_RECONCILE: the LLM takes notes of the relevant information of each chunk, and a final call decides on the
+      notes. Suitable for instructions that need the whole document (e.g. "the email asks for approval and gives a
+      deadline").
+
+    The chunker is shared by all the jobs: at most ``max_workers`` chunks are classified at the same time.
+
+    Args:
+        tokenizer: the tokenizer used to measure the documents (a HuggingFace tokenizer)
+        max_tokens (int): maximum number of input tokens of a prompt (``nlp.ollama.max_tokens``)
+        overlap_tokens (int): number of tokens repeated between consecutive chunks
+        combine (str): how the verdicts of the chunks are combined (COMBINE_ANY or COMBINE_RECONCILE)
+        max_workers (int): maximum number of chunks classified at the same time
+    """
+
+    def __init__(
+            self,
+            tokenizer,
+            max_tokens: int,
+            overlap_tokens: int = 100,
+            combine: str = COMBINE_ANY,
+            max_workers: int = 4
+    ):
+        if combine not in COMBINE_MODES:
+            raise ValueError(f'Unknown combine mode: {combine} (expected one of {COMBINE_MODES})')
+        self.tokenizer = tokenizer
+        self.max_tokens: int = max_tokens
+        self.overlap_tokens: int = overlap_tokens
+        self.combine: str = combine
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='labeling-chunk')
+        self._budgets: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def doc_token_budget(self, prompt_filters: str) -> int:
+        """Get the maximum number of tokens of a document classified in a single LLM call, once the instructions and
+        the answer are accounted for.
+
+        Args:
+            prompt_filters (str): the filters block of the prompt (see :func:`build_prompt_filters`)
+
+        Returns:
+            int: the number of tokens
+        """
+        with self._lock:
+            if prompt_filters not in self._budgets:
+                self._budgets[prompt_filters] = (self.max_tokens - _ANSWER_TOKENS
+                                                 - token_count(self.tokenizer, CLASSIFY_INSTRUCTION + prompt_filters))
+            return self._budgets[prompt_filters]
+
+    def fits(self, prompt_filters: str, doc_tokens: int) -> bool:
+        """Check whether a document can be classified in a single LLM call (without chunks)."""
+        return doc_tokens <= self.doc_token_budget(prompt_filters)
+
+    def split(self, prompt_filters: str, prompt_doc: dict) -> tuple[str, list[dict]]:
+        """Split a document into chunks that fit in a single LLM call, splitting its longest field.
+
+        Args:
+            prompt_filters (str): the filters block of the prompt
+            prompt_doc (dict): the document fields sent to the LLM (see :func:`build_prompt_doc`)
+
+        Returns:
+            tuple[str, list[dict]]: the split field and the chunks (copies of the document with a part of that field)
+        """
+        budget = self.doc_token_budget(prompt_filters)
+        field = max((field for field, value in prompt_doc.items() if isinstance(value, str)),
+                    key=lambda field: len(prompt_doc[field]))
+        rest_tokens = token_count(self.tokenizer, str({**prompt_doc, field: ''}))
+        # If the other fields alone are too long, the chunks will not fit completely, but the document is still split
+        field_budget = max(budget - rest_tokens, budget // 4)
+        parts = split_text(prompt_doc[field], self.tokenizer, field_budget, min(self.overlap_tokens, field_budget // 2))
+        return field, [{**prompt_doc, field: part} for part in parts]
+
+    def classify(self, llm: LLM, prompt_filters: str, prompt_doc: dict) -> tuple[bool, int]:
+        """Classify a document that does not fit in a single LLM call. Blocks the caller.
+
+        Args:
+            llm (LLM): the LLM used to classify the document
+            prompt_filters (str): the filters block of the prompt
+            prompt_doc (dict): the document fields sent to the LLM
+
+        Returns:
+            tuple[bool, int]: whether the document satisfies the instructions, and the number of LLM calls made
+        """
+        field, chunks = self.split(prompt_filters, prompt_doc)
+        if self.combine == COMBINE_ANY:
+            return self._classify_any(llm, prompt_filters, chunks)
+        return self._reconcile(llm, prompt_filters, field, chunks)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _classify_any(self, llm: LLM, prompt_filters: str, chunks: list[dict]) -> tuple[bool, int]:
+        # The LLM calls keep the priority of the caller (see llm_request_context)
+        futures = [self._executor.submit(contextvars.copy_context().run, classify_doc, llm,
+                                         prompt_filters + f"Document:\n{chunk}") for chunk in chunks]
+        verdict = False
+        try:
+            for future in as_completed(futures):
+                if future.result():
+                    verdict = True
+                    break
+        finally:
+            # The chunks that did not start yet are not needed (or the classification failed)
+            for future in futures:
+                future.cancel()
+            wait(futures)
+        return verdict, sum(1 for future in futures if not future.cancelled())
+
+    def _reconcile(self, llm: LLM, prompt_filters: str, field: str, chunks: list[dict]) -> tuple[bool, int]:
+        futures = [
+            self._executor.submit(
+                contextvars.copy_context().run,
+                llm.predict,
+                message=prompt_filters + f"Document part {i + 1} of {len(chunks)}:\n{chunk}",
+                system_message=CHUNK_NOTES_PROMPT
+            )
+            for i, chunk in enumerate(chunks)
+        ]
+        try:
+            notes = [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+        reduced_doc = {**chunks[0], field: '\n'.join(f'Notes about part {i + 1}: {note}' for i, note in enumerate(notes))}
+        verdict = classify_doc(
+            llm,
+            prompt_filters + f"Document (its \"{field}\" field is too long, so it was replaced by notes about each "
+                             f"of its parts):\n{reduced_doc}"
+        )
+        return verdict, len(chunks) + 1
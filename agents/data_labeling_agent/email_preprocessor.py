@@ -0,0 +1,224 @@
+import re
+from html.parser import HTMLParser
+
+from app.vars import *
+
+# Lines that start the quoted message in a reply (everything below them is the previous conversation). The 'wrote:'
+# header must end its line and include a date or an address, so prose like "On Friday, Bob wrote: ..." is kept
+_REPLY_HEADER = re.compile(
+    r'^\s*(-+\s*Original Message\s*-+'
+    r'|On\s.{0,200}(\d|@).{0,200}\swrote:[ \t]*$'
+    r'|From:\s.+\n\s*(Sent|Date):\s.+\n(.+\n)?\s*To:\s)',
+    re.IGNORECASE | re.MULTILINE
+)
+# Lines that introduce a forwarded message, whose 'From:' header block must not be taken for a reply header
+_FORWARDED_MARKER = re.compile(r'-+\s*Forwarded (message|by)\b.*|Begin forwarded message:', re.IGNORECASE)
+_FORWARDED_SUBJECT = re.compile(r'^\s*Subject:\s*(FW|Fwd)\s*:', re.IGNORECASE | re.MULTILINE)
+# Standard signature delimiter ("-- " line)
+_SIGNATURE_DELIMITER = re.compile(r'^-- ?$', re.MULTILINE)
+# Paragraphs with a legal disclaimer or a mobile signature. The phrases are specific to the boilerplate, since
+# ordinary content (e.g. "this message is confidential: ...") must never be removed
+_DISCLAIMER = re.compile(
+    r'(intended (solely|only|exclusively) for the (use of the )?(addressee|recipient|individual|person|entity|named)'
+    r'|if you (have )?received this (e-?mail|message|communication|transmission) (in error|by mistake)'
+    r'|^\s*(confidentiality notice|legal disclaimer|disclaimer)\s*:'
+    r'|^\s*sent from my [\w ]{1,30}\s*$)',
+    re.IGNORECASE | re.MULTILINE
+)
+# Markers of an HTML body
+_HTML = re.compile(r'<(html|body|div|p|br|table|span|font|td)\b[^>]*>', re.IGNORECASE)
+# Appended to truncated fields
+TRUNCATION_MARK = ' [...]'
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """Extracts the visible text of an HTML document, with line breaks at the block elements."""
+
+    BLOCK_TAGS = {'p', 'div', 'br', 'tr', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table', 'blockquote', 'hr'}
+    SKIPPED_TAGS = {'script', 'style', 'head', 'title'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        self._skipped_depth: int = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self._skipped_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+        elif tag == 'td':
+            self.parts.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS:
+            self._skipped_depth = max(0, self._skipped_depth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skipped_depth:
+            self.parts.append(data)
+
+
+def html_to_text(text: str) -> str:
+    """
+    Converts an HTML text to plain text. Texts without HTML markup are returned unchanged.
+
+    :param text: The text
+    :return: The plain text
+    """
+    if not _HTML.search(text):
+        return text
+    parser = _HTMLTextExtractor()
+    parser.feed(text)
+    parser.close()
+    return ''.join(parser.parts)
+
+
+def strip_quoted_replies(text: str) -> str:
+    """
+    Removes the quoted messages of an email body: the lines quoted with '>' and everything after a reply header
+    (e.g. '-----Original Message-----' or 'On <date>, <someone> wrote:'). Forwarded messages are kept, since they are
+    usually the content of the email.
+
+    :param text: The email body
+    :return: The email body without the quoted messages
+    """
+    for match in _REPLY_HEADER.finditer(text):
+        if _is_forwarded(text, match):
+            continue
+        if match.start() > 0:
+            # Keep the body if the whole email is a quote
+            text = text[:match.start()]
+        break
+    return '\n'.join(line for line in text.split('\n') if not line.lstrip().startswith('>'))
+
+
+def _is_forwarded(text: str, match: re.Match) -> bool:
+    """Check if a reply header is the 'From:' header block of a forwarded message."""
+    if not match.group().lstrip().lower().startswith('from:'):
+        return False
+    previous_line = text[:match.start()].rstrip().rsplit('\n', 1)[-1].strip()
+    if _FORWARDED_MARKER.fullmatch(previous_line):
+        return True
+    # Outlook forwards have the same header block as its replies: only the subject tells them apart
+    return bool(_FORWARDED_SUBJECT.search(text, match.start(), match.end() + 200))
+
+
+def strip_signatures(text: str) -> str:
+    """
+    Removes the signature (everything after the standard '-- ' delimiter) and the disclaimer paragraphs at the end of
+    an email body. Only the trailing paragraphs are checked, and the first paragraph is always kept, so the content of
+    the email is never removed.
+
+    :param text: The email body
+    :return: The email body without the signature and disclaimers
+    """
+    match = _SIGNATURE_DELIMITER.search(text)
+    if match and match.start() > 0:
+        text = text[:match.start()]
+    paragraphs = re.split(r'\n\s*\n', text)
+    end = len(paragraphs)
+    while end > 1 and (not paragraphs[end - 1].strip() or _DISCLAIMER.search(paragraphs[end - 1])):
+        end -= 1
+    return '\n\n'.join(paragraphs[:end])
+
+
+def collapse_whitespace(text: str) -> str:
+    """
+    Collapses the runs of spaces and tabs into a single space and the runs of blank lines into a single blank line.
+
+    :param text: The text
+    :return: The collapsed text
+    """
+    text = re.sub(r'[ \t\r\f\v\u00a0]+', ' ', text)
+    text = re.sub(r' ?\n ?', '\n', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip()
+
+
+class EmailPreprocessor:
+    """Shrinks the email documents sent to the LLM, removing the parts that do not help to classify them.
+
+    Every step can be disabled. They are applied to the string fields of the prompt document in this order:
+
+    1. HTML bodies are converted to plain text.
+    2. The quoted messages of replies are removed (only in the ``body_fields``).
+    3. Signatures and disclaimers are removed (only in the ``body_fields``).
+    4. Whitespace is collapsed.
+    5. If the document has more than ``max_doc_tokens`` tokens (measured with the tokenizer), its longest fields are
+       truncated, so that the short fields (e.g. SUBJECT, FROM) are kept whole.
+
+    Args:
+        html_to_text (bool): whether to convert HTML to plain text
+        strip_quotes (bool): whether to remove the quoted messages of replies
+        strip_signatures (bool): whether to remove signatures and disclaimers
+        collapse_whitespace (bool): whether to collapse whitespace
+        max_doc_tokens (int): maximum number of tokens of a document (if 0 or there is no tokenizer, documents are not
+            truncated)
+        tokenizer: the tokenizer used to measure and truncate the documents (a HuggingFace tokenizer)
+        body_fields (list[str]): the fields that contain email bodies
+    """
+
+    def __init__(
+            self,
+            html_to_text: bool = True,
+            strip_quotes: bool = True,
+            strip_signatures: bool = True,
+            collapse_whitespace: bool = True,
+            max_doc_tokens: int = 0,
+            tokenizer=None,
+            body_fields: list[str] = None
+    ):
+        self.html_to_text: bool = html_to_text
+        self.strip_quotes: bool = strip_quotes
+        self.strip_signatures: bool = strip_signatures
+        self.collapse_whitespace: bool = collapse_whitespace
+        self.max_doc_tokens: int = max_doc_tokens if tokenizer else 0
+        self.tokenizer = tokenizer
+        self.body_fields: list[str] = body_fields if body_fields is not None else [CONTENT]
+
+    def process(self, prompt_doc: dict) -> dict:
+        """Preprocess a prompt document (see :func:`build_prompt_doc`).
+
+        Args:
+            prompt_doc (dict): the document fields sent to the LLM
+
+        Returns:
+            dict: the preprocessed document fields
+        """
+        processed = {field: self._clean(field, value) if isinstance(value, str) else value
+                     for field, value in prompt_doc.items()}
+        if self.max_doc_tokens:
+            self._truncate(processed)
+        return processed
+
+    def _clean(self, field: str, text: str) -> str:
+        if self.html_to_text:
+            text = html_to_text(text)
+        if field in self.body_fields:
+            if self.strip_quotes:
+                text = strip_quoted_replies(text)
+            if self.strip_signatures:
+                text = strip_signatures(text)
+        if self.collapse_whitespace:
+            text = collapse_whitespace(text)
+        return text
+
+    def _truncate(self, processed: dict) -> None:
+        """Truncate the string fields of a document to fit in max_doc_tokens, splitting the budget fairly: the
+        shortest fields are kept whole and the rest of the budget is shared by the longest ones."""
+        tokens = {field: self.tokenizer.encode(value, add_special_tokens=False)
+                  for field, value in processed.items() if isinstance(value, str)}
+        if sum(len(field_tokens) for field_tokens in tokens.values()) <= self.max_doc_tokens:
+            return
+        budget = self.max_doc_tokens
+        fields = sorted(tokens, key=lambda field: len(tokens[field]))
+        for i, field in enumerate(fields):
+            field_budget = budget // (len(fields) - i)
+            if len(tokens[field]) > field_budget:
+                processed[field] = self.tokenizer.decode(tokens[field][:field_budget]) + TRUNCATION_MARK
+                budget -= field_budget
+            else:
+                budget -= len(tokens[field])
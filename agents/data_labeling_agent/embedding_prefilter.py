@@ -0,0 +1,185 @@
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from agents.utils.llm_ollama import LLMOllama
+from app.vars import *
+
+# Number of insertions between 2 checks of the store size
+_EVICTION_CHECK_INTERVAL = 1000
+
+
+def cosine_similarity(a: list[float], b: list[float]) -> float:
+    """
+    Computes the cosine similarity of 2 vectors.
+
+    :param a: The first vector
+    :param b: The second vector
+    :return: The similarity, between -1 and 1 (0 if any of the vectors is null)
+    """
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    if norm == 0:
+        return 0.0
+    return sum(x * y for x, y in zip(a, b)) / norm
+
+
+def embedding_text(prompt_doc: dict) -> str:
+    """
+    Gets the text of a document that is embedded: its non-empty fields, one per line.
+
+    :param prompt_doc: The document fields sent to the LLM (see :func:`build_prompt_doc`)
+    :return: The text
+    """
+    return '\n'.join(f'{field}: {value}' for field, value in prompt_doc.items() if value)
+
+
+class EmbeddingStore:
+    """A persistent (SQLite) store of document embeddings, so that the documents of repeated or overlapping requests
+    are only embedded once.
+
+    Embeddings are keyed by the embedding model and a hash of the embedded text. When the store exceeds
+    ``max_entries`` (checked periodically), the least recently used embeddings are evicted.
+
+    The store is thread-safe.
+
+    Args:
+        path (str): path of the SQLite database file
+        max_entries (int): maximum number of stored embeddings
+    """
+
+    def __init__(self, path: str, max_entries: int = 1000000):
+        self.path: str = path
+        self.max_entries: int = max_entries
+        self._lock = threading.Lock()
+        self._puts: int = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return hashlib.sha256(f'{model}\n{text}'.encode('utf-8')).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        """Get the stored embeddings of some keys (the keys that are not stored are missing from the result)."""
+        if not keys:
+            return {}
+        with self._lock:
+            placeholders = ','.join('?' * len(keys))
+            rows = self._connection.execute(
+                f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', keys
+            ).fetchall()
+            with self._connection:
+                self._connection.executemany(
+                    'UPDATE embeddings SET last_used = ? WHERE key = ?', [(time.time(), key) for key, _ in rows]
+                )
+        return {key: array('f', vector).tolist() for key, vector in rows}
+
+    def put_many(self, embeddings: dict[str, list[float]]) -> None:
+        """Store some embeddings, evicting the least recently used ones if the store is full."""
+        with self._lock, self._connection:
+            now = time.time()
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)',
+                [(key, array('f', vector).tobytes(), now) for key, vector in embeddings.items()]
+            )
+            previous_puts = self._puts
+            self._puts += len(embeddings)
+            if self._puts // _EVICTION_CHECK_INTERVAL == previous_puts // _EVICTION_CHECK_INTERVAL:
+                return
+            num_entries = self._connection.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+            if num_entries > self.max_entries:
+                # Evict a few more than needed, so that eviction does not run on every insertion
+                num_evicted = num_entries - self.max_entries + max(1, self.max_entries // 100)
+                self._connection.execute(
+                    'DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)',
+                    (num_evicted,)
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class EmbeddingPrefilter:
+    """Discards the documents that are clearly unrelated to the request instructions before sending them to the LLM.
+
+    The instructions and the documents are embedded with a small embedding model served by Ollama (e.g.
+    ``all-minilm`` or ``nomic-embed-text``, which run fast on CPU). The score of a document is its lowest cosine
+    similarity to the instructions (a document must satisfy all of them), and only the documents scoring at least
+    ``threshold`` are sent to the LLM. The rest are considered not to satisfy the instructions.
+
+    Since the prefilter may discard some matching documents, the estimation of a request reports the recall and the
+    saved LLM calls at different thresholds (see :func:`estimate_labeling`).
+
+    Args:
+        llm (LLMOllama): the Ollama LLM whose client is used to compute the embeddings
+        model (str): the name of the embedding model
+        threshold (float): the minimum score of the documents sent to the LLM
+        store (EmbeddingStore): the store of document embeddings (if None, embeddings are not stored)
+    """
+
+    def __init__(self, llm: LLMOllama, model: str, threshold: float = 0.3, store: EmbeddingStore = None):
+        self.llm: LLMOllama = llm
+        self.model: str = model
+        self.threshold: float = threshold
+        self.store: EmbeddingStore = store
+        self._instruction_vectors: dict[str, list[list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        """Compute the embeddings of some texts, with a single request to Ollama."""
+        if not texts:
+            return []
+        return self.llm.client.embed(model=self.model, input=texts)['embeddings']
+
+    def scores(self, instructions: list[dict], prompt_docs: list[dict]) -> list[float]:
+        """Get the scores of some documents: their lowest similarity to the instructions.
+
+        Args:
+            instructions (list[dict]): the request instructions
+            prompt_docs (list[dict]): the document fields sent to the LLM (see :func:`build_prompt_doc`)
+
+        Returns:
+            list[float]: the score of each document
+        """
+        instruction_vectors = self._get_instruction_vectors(instructions)
+        doc_vectors = self._get_doc_vectors(prompt_docs)
+        return [min(cosine_similarity(doc_vector, instruction_vector) for instruction_vector in instruction_vectors)
+                for doc_vector in doc_vectors]
+
+    def passes(self, score: float) -> bool:
+        """Check whether a document with a score must be sent to the LLM."""
+        return score >= self.threshold
+
+    def _get_instruction_vectors(self, instructions: list[dict]) -> list[list[float]]:
+        texts = [instruction[TEXT] for instruction in instructions]
+        key = json.dumps(texts, ensure_ascii=False)
+        with self._lock:
+            if key in self._instruction_vectors:
+                return self._instruction_vectors[key]
+        vectors = self.embed(texts)
+        with self._lock:
+            self._instruction_vectors[key] = vectors
+        return vectors
+
+    def _get_doc_vectors(self, prompt_docs: list[dict]) -> list[list[float]]:
+        texts = [embedding_text(prompt_doc) for prompt_doc in prompt_docs]
+        keys = [EmbeddingStore.key(self.model, text) for text in texts]
+        stored = self.store.get_many(list(set(keys))) if self.store else {}
+        missing = list({key: text for key, text in zip(keys, texts) if key not in stored}.items())
+        if missing:
+            computed = dict(zip([key for key, _ in missing], self.embed([text for _, text in missing])))
+            if self.store:
+                self.store.put_many(computed)
+            stored.update(computed)
+        return [stored[key] for key in keys]
@@ -0,0 +1,217 @@
+import itertools
+import json
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable
+
+from besser.agent.core.session import Session
+from besser.agent.exceptions.logger import logger
+
+from agents.data_labeling_agent.labeling_pipeline import LabelingCancelled
+from app.vars import *
+
+
+class LabelingJob:
+    """A labeling request running in the background.
+
+    The job runs a target function, which receives the job itself. While running, the target can register the task
+    doing the actual work (see :meth:`set_task`) so that the job can pause, continue or cancel it. The task must
+    implement ``pause()``, ``unpause()`` and ``cancel()``; cancelling it must make the target raise
+    :class:`LabelingCancelled`.
+
+    Args:
+        job_id (int): the job ID
+        session (Session): the session of the user that submitted the job
+        request (dict): the labeling request
+        target (Callable[[LabelingJob], None]): the function that runs the job
+
+    Attributes:
+        id (int): the job ID
+        session (Session): the session of the user that submitted the job
+        request (dict): the labeling request
+        status (str): the job status (JOB_QUEUED, JOB_RUNNING, JOB_PAUSED, JOB_CANCELLING, JOB_CANCELLED,
+            JOB_COMPLETED or JOB_FAILED)
+        created (datetime): the job creation time
+        error (str): the error message, if the job failed
+    """
+
+    def __init__(self, job_id: int, session: Session, request: dict, target: Callable[['LabelingJob'], None]):
+        self.id: int = job_id
+        self.session: Session = session
+        self.request: dict = request
+        self.status: str = JOB_QUEUED
+        self.created: datetime = datetime.now()
+        self.error: str = None
+        self._target: Callable[['LabelingJob'], None] = target
+        self._task = None
+        self._lock = threading.Lock()
+
+    def is_active(self) -> bool:
+        """Check whether the job is queued, running, paused or being cancelled."""
+        return self.status in [JOB_QUEUED, JOB_RUNNING, JOB_PAUSED, JOB_CANCELLING]
+
+    def set_task(self, task) -> None:
+        """Register the task doing the work of the job, so that it can be paused or cancelled."""
+        with self._lock:
+            self._task = task
+
+    def pause(self) -> bool:
+        """Pause the job. Only running jobs with a registered task can be paused.
+
+        Returns:
+            bool: whether the job was paused
+        """
+        with self._lock:
+            if self.status != JOB_RUNNING or self._task is None:
+                return False
+            if not self._control_task(self._task.pause):
+                return False
+            self._set_status(JOB_PAUSED)
+            return True
+
+    def unpause(self) -> bool:
+        """Continue a paused job.
+
+        Returns:
+            bool: whether the job was continued
+        """
+        with self._lock:
+            if self.status != JOB_PAUSED:
+                return False
+            if not self._control_task(self._task.unpause):
+                return False
+            self._set_status(JOB_RUNNING)
+            return True
+
+    def cancel(self) -> bool:
+        """Cancel the job. Queued jobs are never run; running jobs can only be cancelled if they registered a task.
+
+        A running job is JOB_CANCELLING until its target returns (e.g. until the pipeline threads stop writing), and
+        only then JOB_CANCELLED.
+
+        Returns:
+            bool: whether the job was cancelled
+        """
+        with self._lock:
+            if self.status == JOB_QUEUED:
+                self._set_status(JOB_CANCELLED)
+                return True
+            if self.status not in [JOB_RUNNING, JOB_PAUSED] or self._task is None:
+                return False
+            if not self._control_task(self._task.cancel):
+                return False
+            self._set_status(JOB_CANCELLING)
+            return True
+
+    def _control_task(self, control: Callable[[], None]) -> bool:
+        try:
+            control()
+            return True
+        except Exception as e:
+            # E.g. the task finished in the meantime
+            logger.warning(f'Job #{self.id} could not be controlled: {e}')
+            return False
+
+    def run(self) -> None:
+        """Run the job (unless it was cancelled while queued). Called by the :class:`JobManager` workers."""
+        with self._lock:
+            if self.status == JOB_CANCELLED:
+                return
+            self._set_status(JOB_RUNNING)
+        try:
+            self._target(self)
+            status = JOB_COMPLETED
+        except LabelingCancelled:
+            status = JOB_CANCELLED
+        except Exception as e:
+            logger.error(f'Job #{self.id} failed: {e}\n{traceback.format_exc()}')
+            self.error = str(e)
+            status = JOB_FAILED
+        with self._lock:
+            self._task = None
+            if status != self.status:
+                self._set_status(status)
+
+    def to_json(self) -> dict:
+        return {
+            JOB_ID: self.id,
+            REQUEST_ID: self.request[REQUEST_ID],
+            JOB_STATUS: self.status,
+            JOB_ERROR: self.error
+        }
+
+    def _set_status(self, status: str) -> None:
+        self.status = status
+        try:
+            self.session.reply(json.dumps(self.to_json()))
+        except Exception as e:
+            # The user may have closed the app, the job goes on
+            logger.warning(f'The status of job #{self.id} could not be sent: {e}')
+
+
+class JobManager:
+    """Runs labeling jobs in background worker threads, at most ``max_concurrent_jobs`` at a time.
+
+    Jobs submitted while all the workers are busy wait in a queue (in submission order). Only the latest
+    ``max_finished_jobs`` finished (completed, failed or cancelled) jobs are kept, so that the old jobs and their
+    sessions are released.
+
+    Args:
+        max_concurrent_jobs (int): maximum number of jobs running at the same time
+        max_finished_jobs (int): maximum number of finished jobs kept
+
+    Attributes:
+        jobs (dict[int, LabelingJob]): the active jobs and the latest finished jobs, by ID
+    """
+
+    def __init__(self, max_concurrent_jobs: int = 1, max_finished_jobs: int = 100):
+        self.jobs: dict[int, LabelingJob] = {}
+        self.max_finished_jobs: int = max(0, max_finished_jobs)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_concurrent_jobs), thread_name_prefix='labeling-job')
+
+    def submit(self, session: Session, request: dict, target: Callable[[LabelingJob], None]) -> LabelingJob:
+        """Enqueue a new job.
+
+        Args:
+            session (Session): the session of the user that submits the job
+            request (dict): the labeling request
+            target (Callable[[LabelingJob], None]): the function that runs the job
+
+        Returns:
+            LabelingJob: the new job
+        """
+        with self._lock:
+            job = LabelingJob(next(self._ids), session, request, target)
+            self.jobs[job.id] = job
+        job.session.reply(json.dumps(job.to_json()))
+        self._executor.submit(job.run).add_done_callback(lambda _: self._evict_finished_jobs())
+        return job
+
+    def get_job(self, job_id: int, session: Session) -> LabelingJob or None:
+        """Get a job of a session (jobs of other sessions are not accessible)."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is None or job.session.id != session.id:
+            return None
+        return job
+
+    def get_session_jobs(self, session: Session) -> list[LabelingJob]:
+        """Get the jobs submitted by a session."""
+        with self._lock:
+            return [job for job in self.jobs.values() if job.session.id == session.id]
+
+    def count_active_jobs(self) -> int:
+        """Get the number of queued, running, paused or cancelling jobs (of all sessions)."""
+        with self._lock:
+            return sum(1 for job in self.jobs.values() if job.is_active())
+
+    def _evict_finished_jobs(self) -> None:
+        """Remove the oldest finished jobs beyond ``max_finished_jobs``."""
+        with self._lock:
+            finished = [job_id for job_id, job in self.jobs.items() if not job.is_active()]
+            for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+                del self.jobs[job_id]
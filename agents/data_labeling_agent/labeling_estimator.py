@@ -0,0 +1,222 @@
+import contextvars
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from besser.agent.nlp.llm.llm import LLM
+
+from agents.data_labeling_agent.document_chunker import DocumentChunker
+from agents.data_labeling_agent.email_preprocessor import EmailPreprocessor
+from agents.data_labeling_agent.embedding_prefilter import EmbeddingPrefilter
+from agents.data_labeling_agent.model_cascade import ModelCascade
+from agents.data_labeling_agent.verdict_cache import VerdictCache
+from agents.elasticsearch.elasticsearch_query import get_random_docs, get_prompt_fields, build_prompt_filters, \
+    build_prompt_doc, classify_doc
+from agents.utils.token_count import token_count
+from app.vars import *
+
+# z value of a 95% confidence interval
+_Z_95 = 1.96
+# Offsets from the configured prefilter threshold reported in the estimation
+_PREFILTER_THRESHOLD_OFFSETS = [-0.1, -0.05, 0, 0.05, 0.1]
+
+
+def wilson_interval(matches: int, n: int, z: float = _Z_95) -> tuple[float, float]:
+    """
+    Computes the Wilson score confidence interval of a proportion. Unlike the normal approximation, it is valid for
+    small samples and proportions close to 0 or 1.
+
+    :param matches: Number of positive observations
+    :param n: Number of observations
+    :param z: z value of the confidence level (1.96 for 95%)
+    :return: The lower and upper bounds of the interval
+    """
+    if n == 0:
+        return 0.0, 1.0
+    p = matches / n
+    denominator = 1 + z ** 2 / n
+    center = (p + z ** 2 / (2 * n)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / denominator
+    # The bounds are exactly 0 and 1 when no or all observations are positive (without rounding errors)
+    low = 0.0 if matches == 0 else max(0.0, center - margin)
+    high = 1.0 if matches == n else min(1.0, center + margin)
+    return low, high
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Formats a duration for the user, with the 2 most significant units (e.g. '3 d 4 h', '12 min 5 s').
+
+    :param seconds: The duration in seconds
+    :return: The formatted duration
+    """
+    seconds = int(round(seconds))
+    parts = []
+    for unit, unit_seconds in [('d', 86400), ('h', 3600), ('min', 60), ('s', 1)]:
+        if seconds >= unit_seconds or (unit == 's' and not parts):
+            parts.append(f'{seconds // unit_seconds} {unit}')
+            seconds %= unit_seconds
+    return ' '.join(parts[:2])
+
+
+class LabelingEstimate:
+    """The estimated cost and selectivity of a labeling request, measured on a random sample of its documents.
+
+    Args:
+        num_docs (int): number of documents that would be classified by the LLM
+        sample_size (int): number of documents of the sample
+        matches (int): number of documents of the sample that satisfy the instructions
+        mean_latency (float): mean time (in seconds) of an LLM call on a sample document
+        wall_time (float): time (in seconds) taken to classify the whole sample
+        llm_workers (int): number of concurrent LLM calls used to classify the sample (as in the full job)
+        batch_max_docs (int): maximum number of documents per LLM call in the full job
+        prefilter_threshold (float): the threshold of the embedding prefilter (None if there is no prefilter)
+        prefilter_results (list[tuple[float, bool]]): the prefilter score and the LLM verdict of each document of the
+            sample (all of them are classified by the LLM, to measure the recall of the prefilter)
+
+    Attributes:
+        match_rate (float): fraction of the sample that satisfies the instructions
+        match_rate_interval (tuple[float, float]): 95% confidence interval of the match rate
+        prefilter_rate (float): fraction of the sample that passes the prefilter (1 without prefilter)
+        projected_time (float): projected time (in seconds) to classify all the documents (only those that pass the
+            prefilter are sent to the LLM)
+    """
+
+    def __init__(
+            self,
+            num_docs: int,
+            sample_size: int,
+            matches: int,
+            mean_latency: float,
+            wall_time: float,
+            llm_workers: int,
+            batch_max_docs: int,
+            prefilter_threshold: float = None,
+            prefilter_results: list[tuple[float, bool]] = None
+    ):
+        self.num_docs: int = num_docs
+        self.sample_size: int = sample_size
+        self.matches: int = matches
+        self.mean_latency: float = mean_latency
+        self.wall_time: float = wall_time
+        self.llm_workers: int = llm_workers
+        self.batch_max_docs: int = batch_max_docs
+        self.match_rate: float = matches / sample_size if sample_size else 0
+        self.match_rate_interval: tuple[float, float] = wilson_interval(matches, sample_size)
+        self.prefilter_threshold: float = prefilter_threshold
+        self.prefilter_results: list[tuple[float, bool]] = prefilter_results or []
+        self.prefilter_rate: float = self.prefilter_tradeoff(prefilter_threshold)[0] if prefilter_results else 1
+        self.projected_time: float = num_docs * wall_time / sample_size * self.prefilter_rate if sample_size else 0
+
+    def prefilter_tradeoff(self, threshold: float) -> tuple[float, float or None]:
+        """Get the fraction of the sample that a prefilter threshold sends to the LLM, and the fraction of the
+        matching documents of the sample it keeps (recall, None if no document matches)."""
+        passed = [verdict for score, verdict in self.prefilter_results if score >= threshold]
+        rate = len(passed) / len(self.prefilter_results) if self.prefilter_results else 1
+        return rate, sum(passed) / self.matches if self.matches else None
+
+    def to_str(self) -> str:
+        low, high = self.match_rate_interval
+        message = (f'Estimation on a random sample of {self.sample_size} documents:\n'
+                   f'- Time per document: {self.mean_latency:.2f} s per LLM call, '
+                   f'{self.wall_time / self.sample_size:.2f} s with {self.llm_workers} concurrent calls\n'
+                   f'- Projected time for {self.num_docs} documents: {format_duration(self.projected_time)}')
+        if self.batch_max_docs > 1:
+            message += f' (measured with 1 document per LLM call, the job can pack up to {self.batch_max_docs})'
+        message += (f'\n- Estimated match rate: {self.match_rate:.0%} (95% confidence interval: {low:.0%}-{high:.0%}), '
+                    f'about {round(self.match_rate * self.num_docs)} documents '
+                    f'({round(low * self.num_docs)}-{round(high * self.num_docs)}) would get the score/label\n')
+        if self.prefilter_results:
+            message += ('- Prefilter (documents less similar to the instructions than the threshold are not sent to the '
+                        'LLM), documents sent to the LLM / matching documents kept (recall):\n')
+            for offset in _PREFILTER_THRESHOLD_OFFSETS:
+                threshold = round(self.prefilter_threshold + offset, 2)
+                rate, recall = self.prefilter_tradeoff(threshold)
+                message += f'  - Threshold {threshold:.2f}{" (current)" if offset == 0 else ""}: {rate:.0%} sent'
+                message += f', {recall:.0%} recall\n' if recall is not None else ' (no matching documents in the sample)\n'
+        return message
+
+
+def estimate_labeling(
+        es_client,
+        index_name: str,
+        query: dict,
+        request: dict,
+        llm: LLM,
+        num_docs: int,
+        sample_size: int = 20,
+        llm_workers: int = 4,
+        batch_max_docs: int = 1,
+        verdict_cache: VerdictCache = None,
+        preprocessor: EmailPreprocessor = None,
+        chunker: DocumentChunker = None,
+        prefilter: EmbeddingPrefilter = None,
+        cascade: ModelCascade = None
+) -> LabelingEstimate or None:
+    """
+    Estimates the cost and selectivity of a labeling request (dry run): classifies a random sample of its documents
+    with the same prompt and concurrency as the full job, and projects the results to all the documents. Nothing is
+    written to the index.
+
+    The verdicts of the sample are stored in the verdict cache (if given), so the full job does not classify the
+    sample documents again.
+
+    :param es_client: Elasticsearch client instance
+    :param index_name: Name of the Elasticsearch index
+    :param query: Query to find the documents that would be classified
+    :param request: The labeling request
+    :param llm: The LLM used to classify the documents
+    :param num_docs: Number of documents matching the query
+    :param sample_size: Maximum number of documents of the sample
+    :param llm_workers: Number of concurrent LLM calls
+    :param batch_max_docs: Maximum number of documents per LLM call in the full job (only reported)
+    :param verdict_cache: The cache of LLM verdicts
+    :param preprocessor: The preprocessing applied to the documents before classifying them (the same as in the full job)
+    :param chunker: Classifies the documents that do not fit in the LLM context
+    :param prefilter: The embedding prefilter of the full job. All the sample documents are classified by the LLM, and
+        the estimate reports the recall and the LLM calls saved by the prefilter
+    :param cascade: The 2 tiers of models of the full job (if None, documents are classified by the LLM)
+    :return: The estimate, or None if there are no documents to sample
+    """
+    fields = get_prompt_fields(request)
+    prompt_filters = build_prompt_filters(request)
+    cache_prefix = VerdictCache.instructions_key(cascade.name if cascade else llm.name, request[INSTRUCTIONS])
+    hits = get_random_docs(es_client, index_name, query, size=min(sample_size, num_docs), source_includes=fields)
+    if not hits:
+        return None
+
+    prompt_docs = [build_prompt_doc(doc, fields) for doc in hits]
+    if preprocessor:
+        prompt_docs = [preprocessor.process(prompt_doc) for prompt_doc in prompt_docs]
+    scores = prefilter.scores(request[INSTRUCTIONS], prompt_docs) if prefilter else None
+
+    def classify(prompt_doc: dict) -> tuple[bool, float]:
+        start = time.monotonic()
+        if chunker and not chunker.fits(prompt_filters, token_count(chunker.tokenizer, str(prompt_doc))):
+            verdict, _ = chunker.classify(llm, prompt_filters, prompt_doc)
+        elif cascade:
+            verdict, _ = cascade.classify(prompt_filters + f"Document:\n{prompt_doc}")
+        else:
+            verdict = classify_doc(llm, prompt_filters + f"Document:\n{prompt_doc}")
+        latency = time.monotonic() - start
+        if verdict_cache:
+            verdict_cache.put(VerdictCache.key(cache_prefix, prompt_doc), verdict)
+        return verdict, latency
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, llm_workers), thread_name_prefix='labeling-estimation') as executor:
+        # The LLM calls keep the priority of the caller (see llm_request_context)
+        futures = [executor.submit(contextvars.copy_context().run, classify, prompt_doc) for prompt_doc in prompt_docs]
+        results = [future.result() for future in futures]
+    wall_time = time.monotonic() - start
+    return LabelingEstimate(
+        num_docs=num_docs,
+        sample_size=len(results),
+        matches=sum(1 for verdict, _ in results if verdict),
+        mean_latency=sum(latency for _, latency in results) / len(results),
+        wall_time=wall_time,
+        llm_workers=max(1, llm_workers),
+        batch_max_docs=batch_max_docs,
+        prefilter_threshold=prefilter.threshold if prefilter else None,
+        prefilter_results=list(zip(scores, [verdict for verdict, _ in results])) if prefilter else None
+    )
@@ -0,0 +1,741 @@
+import contextvars
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from besser.agent.core.session import Session
+from besser.agent.exceptions.logger import logger
+from besser.agent.nlp.llm.llm import LLM
+
+from agents.data_labeling_agent.checkpoint import load_checkpoint, save_checkpoint, delete_checkpoint
+from agents.data_labeling_agent.document_chunker import DocumentChunker
+from agents.data_labeling_agent.email_preprocessor import EmailPreprocessor
+from agents.data_labeling_agent.embedding_prefilter import EmbeddingPrefilter
+from agents.data_labeling_agent.model_cascade import ModelCascade
+from agents.elasticsearch.bulk_writer import BulkWriter
+from agents.elasticsearch.elasticsearch_query import build_prompt_filters, build_prompt_doc, classify_doc, \
+    get_prompt_fields, classify_batch, BATCH_INSTRUCTION, BATCH_CONFIDENCE_INSTRUCTION, VERDICT_NUM_PREDICT, \
+    CONFIDENT_VERDICT_NUM_PREDICT
+from agents.data_labeling_agent.verdict_cache import VerdictCache
+from agents.elasticsearch.point_in_time import PointInTimeScanner
+from agents.elasticsearch.query_cache import QueryCache
+from agents.utils.llm_ollama import llm_request_context, PRIORITY_BATCH
+from agents.utils.progress_reporter import ProgressReporter
+from agents.utils.token_count import token_count
+from app.vars import *
+
+# Marks the end of a stage's output
+_END = object()
+# Interval (in seconds) at which blocked stages check whether the pipeline has been stopped
+_POLL_INTERVAL = 0.5
+
+
+class LabelingCancelled(Exception):
+    """Raised by :meth:`LabelingPipeline.run` when the pipeline is cancelled."""
+
+
+class _Page:
+    """A page of fetched documents, tracked until all its documents are written.
+
+    Args:
+        slice_id (int): the slice the page belongs to
+        search_after (list): sort value of the last document of the page
+        remaining (int): number of documents of the page that are not written yet
+    """
+
+    def __init__(self, slice_id: int, search_after: list, remaining: int):
+        self.slice_id: int = slice_id
+        self.search_after: list = search_after
+        self.remaining: int = remaining
+
+
+class LabelingPipeline:
+    """Labels the documents matching a query with an LLM, running 3 concurrent stages:
+
+    1. Fetch: one thread per slice scans the index (through a :class:`PointInTimeScanner`) and prefetches the next
+       pages of documents.
+    2. Classify: a bounded pool of workers sends the documents to the LLM (at most ``llm_workers`` calls in flight).
+       With ``batch_max_docs`` > 1, several documents are packed in a single prompt, as many as fit in
+       ``batch_max_tokens``. Documents missing from a (malformed or partial) batch answer are classified individually.
+       If a :class:`VerdictCache` is given, documents with a cached verdict skip the LLM. If a
+       :class:`DocumentChunker` is given, documents that do not fit in the LLM context are split into chunks that are
+       classified in parallel (map-reduce). If an :class:`EmbeddingPrefilter` is given, the documents that are not
+       similar enough to the instructions are discarded without calling the LLM. If a :class:`ModelCascade` is
+       given, documents are classified by its small model first, and only escalated to the large one (``llm``) if the
+       small model is not confident.
+    3. Write: a thread writes the positive verdicts back to the index (through a :class:`BulkWriter`) and reports
+       the progress to the user (through a :class:`ProgressReporter`).
+
+    Stages are connected with bounded queues, so a slow stage applies backpressure to the previous one. Only the
+    document fields needed by the LLM prompt are fetched from the index, and they are shrunk by an
+    :class:`EmailPreprocessor` (if given) before being sent to the LLM.
+
+    If a ``checkpoint_directory`` is given, the write stage periodically stores a checkpoint of the job: the PIT ID,
+    the cursor of each slice (the last document of the last page completely written), the counters and the IDs of the
+    processed documents. A job created with ``resume=True`` continues from its checkpoint: from the cursors if the PIT
+    is still alive, otherwise from the beginning of a new PIT, skipping the processed documents. The checkpoint is
+    deleted when the job finishes.
+
+    The pipeline can be paused (no new documents are sent to the LLM, the calls in flight are completed) and cancelled
+    from other threads. A cancelled pipeline sends its pending updates and stores its checkpoint, so it can be resumed
+    later.
+
+    Args:
+        session (Session): the user session, used to send progress updates
+        es_client: Elasticsearch client instance
+        index_name (str): name of the Elasticsearch index
+        query (dict): query to find the documents to label, excluding those that already have the target score/label
+            (see the exclusion mode of :func:`build_query`)
+        request (dict): the labeling request
+        llm (LLM): the LLM used to classify the documents
+        labeled_docs (int): number of documents matching the request that already have the target score/label (they
+            are counted as updated but not fetched)
+        page_size (int): number of documents per fetched page
+        llm_workers (int): maximum number of concurrent LLM calls
+        prefetch_pages (int): maximum number of fetched pages waiting to be classified
+        write_queue_size (int): maximum number of verdicts waiting to be written
+        keep_alive (str): time to keep the point in time alive between requests (it is renewed automatically)
+        slices (int): number of disjoint slices of the query result, each one fetched by a different thread
+        bulk_max_actions (int): maximum number of buffered updates before sending a ``_bulk`` request
+        bulk_flush_interval (float): maximum time (in seconds) an update can stay buffered
+        bulk_max_retries (int): maximum number of times a failed update is retried
+        batch_max_docs (int): maximum number of documents classified in a single LLM call
+        batch_max_tokens (int): maximum number of input tokens of a batch prompt
+        tokenizer: the tokenizer used to measure the batch prompts and the preprocessed documents (if None, batches are
+            only limited by ``batch_max_docs``)
+        preprocessor (EmailPreprocessor): the preprocessing applied to the documents before classifying them (if None,
+            documents are sent as fetched)
+        chunker (DocumentChunker): classifies the documents that do not fit in the LLM context (requires a tokenizer, if
+            None, long documents are sent whole)
+        prefilter (EmbeddingPrefilter): discards the documents unrelated to the instructions before the LLM (if None, all
+            the documents are sent to the LLM)
+        cascade (ModelCascade): the 2 tiers of models used to classify the documents (if None, all the documents are
+            classified by ``llm``). Long documents classified in chunks always use ``llm``
+        verdict_cache (VerdictCache): the cache of LLM verdicts (if None, verdicts are not cached)
+        query_cache (QueryCache): the cache of query results, invalidated when the pipeline writes to the index
+        checkpoint_directory (str): directory where the job checkpoint is stored (if None, checkpoints are disabled)
+        checkpoint_interval (float): time (in seconds) between checkpoints
+        resume (bool): whether to resume the job from its checkpoint (if it exists)
+        progress_max_rate (float): maximum number of progress updates sent to the user per second
+        job_id (int): the ID of the job running the pipeline, included in the progress updates
+
+    Attributes:
+        total_docs (int): number of documents matching the query
+        updated_docs (int): number of documents that have (or already had) the target score/label
+        ignored_docs (int): number of documents that do not satisfy the instructions
+        updated_ids (list[str]): IDs of the documents updated by the pipeline
+        fetched_docs (int): number of documents fetched from the index
+        fetched_bytes (int): size of the fetched documents' ``_source``, in bytes
+        llm_calls (int): number of LLM calls
+        retried_docs (int): number of documents classified individually after a malformed or partial batch answer
+        cache_hits (int): number of documents whose verdict was found in the verdict cache
+        resumed_docs (int): number of documents processed before resuming the job from a checkpoint
+        preprocessed_docs (int): number of documents measured before and after preprocessing (only with a preprocessor
+            and a tokenizer)
+        tokens_before (int): number of tokens of the measured documents before preprocessing
+        tokens_after (int): number of tokens of the measured documents after preprocessing
+        chunked_docs (int): number of documents split into chunks because they did not fit in the LLM context
+        prefiltered_docs (int): number of documents discarded by the prefilter
+        small_llm_calls (int): number of LLM calls to the small model of the cascade (included in llm_calls)
+        escalated_docs (int): number of documents escalated to the large model of the cascade
+        llm_stats (dict[str, dict[str, int]]): for each model reporting stats (see :meth:`LLMOllama.get_stats`), its
+            calls, timings and token counts while the pipeline ran (including the calls of other concurrent jobs)
+        host_stats (dict[str, dict[str, float]]): for each Ollama server of the LLM pool (see :class:`OllamaPool`),
+            its requests, failures, busy time and generated tokens while the pipeline ran (including other jobs)
+        elapsed (float): time (in seconds) the pipeline ran
+    """
+
+    def __init__(
+            self,
+            session: Session,
+            es_client,
+            index_name: str,
+            query: dict,
+            request: dict,
+            llm: LLM,
+            labeled_docs: int = 0,
+            page_size: int = 50,
+            llm_workers: int = 4,
+            prefetch_pages: int = 2,
+            write_queue_size: int = 100,
+            keep_alive: str = '1m',
+            slices: int = 1,
+            bulk_max_actions: int = 500,
+            bulk_flush_interval: float = 5,
+            bulk_max_retries: int = 3,
+            batch_max_docs: int = 1,
+            batch_max_tokens: int = 3000,
+            tokenizer=None,
+            preprocessor: EmailPreprocessor = None,
+            chunker: DocumentChunker = None,
+            prefilter: EmbeddingPrefilter = None,
+            cascade: ModelCascade = None,
+            verdict_cache: VerdictCache = None,
+            query_cache: QueryCache = None,
+            checkpoint_directory: str = None,
+            checkpoint_interval: float = 60,
+            resume: bool = False,
+            progress_max_rate: float = 2,
+            job_id: int = None
+    ):
+        self.session: Session = session
+        self.es_client = es_client
+        self.index_name: str = index_name
+        self.query: dict = query
+        self.request: dict = request
+        self.llm: LLM = llm
+        self.page_size: int = page_size
+        self.llm_workers: int = max(1, llm_workers)
+        self.keep_alive: str = keep_alive
+        self.slices: int = max(1, slices)
+        self.prompt_filters: str = build_prompt_filters(request)
+        self.fields: list[str] = get_prompt_fields(request)
+        self.batch_max_docs: int = max(1, batch_max_docs)
+        self.tokenizer = tokenizer
+        self.cascade: ModelCascade = cascade
+        if tokenizer and self.batch_max_docs > 1:
+            # Tokens left for the documents once the instructions and the answer are accounted for
+            batch_instruction = BATCH_CONFIDENCE_INSTRUCTION if cascade else BATCH_INSTRUCTION
+            verdict_tokens = CONFIDENT_VERDICT_NUM_PREDICT if cascade else VERDICT_NUM_PREDICT
+            self._batch_token_budget = (batch_max_tokens - token_count(tokenizer, batch_instruction + self.prompt_filters)
+                                        - verdict_tokens * (self.batch_max_docs + 1))
+        else:
+            self._batch_token_budget = None
+        self.preprocessor: EmailPreprocessor = preprocessor
+        self.chunker: DocumentChunker = chunker if tokenizer else None
+        self.prefilter: EmbeddingPrefilter = prefilter
+        self.verdict_cache: VerdictCache = verdict_cache
+        self._cache_prefix: str = VerdictCache.instructions_key(cascade.name if cascade else llm.name, request[INSTRUCTIONS])
+        self.checkpoint_directory: str = checkpoint_directory
+        self.checkpoint_interval: float = checkpoint_interval
+        self.resume: bool = resume
+        self.progress: ProgressReporter = ProgressReporter(session, progress_max_rate)
+        # The LLM calls of the pipeline are batch requests, shared fairly with the jobs of other sessions
+        self._llm_key: str = session.id if session else None
+        self.job_id: int = job_id
+
+        self.labeled_docs: int = labeled_docs
+        self.total_docs: int = 0
+        self.updated_docs: int = labeled_docs
+        self.ignored_docs: int = 0
+        self.updated_ids: list[str] = []
+        self.fetched_docs: int = 0
+        self.fetched_bytes: int = 0
+        self.llm_calls: int = 0
+        self.retried_docs: int = 0
+        self.cache_hits: int = 0
+        self.resumed_docs: int = 0
+        self.preprocessed_docs: int = 0
+        self.tokens_before: int = 0
+        self.tokens_after: int = 0
+        self.chunked_docs: int = 0
+        self.prefiltered_docs: int = 0
+        self.small_llm_calls: int = 0
+        self.escalated_docs: int = 0
+        self.llm_stats: dict[str, dict[str, int]] = {}
+        self.host_stats: dict[str, dict[str, float]] = {}
+        self.elapsed: float = 0.0
+        self.bulk_writer: BulkWriter = BulkWriter(
+            es_client=es_client,
+            index_name=index_name,
+            action=request[ACTION],
+            target_value=request[TARGET_VALUE],
+            max_actions=bulk_max_actions,
+            flush_interval=bulk_flush_interval,
+            max_retries=bulk_max_retries,
+            query_cache=query_cache
+        )
+
+        self._pages: queue.Queue = queue.Queue(maxsize=max(1, prefetch_pages))
+        self._results: queue.Queue = queue.Queue(maxsize=max(1, write_queue_size))
+        self._in_flight = threading.BoundedSemaphore(self.llm_workers)
+        self._stop = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+        self._error: Exception = None
+        self._fetch_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # Checkpoint state
+        self._scanner: PointInTimeScanner = None
+        self._cursors: list[list] = [None] * self.slices
+        self._open_pages: list[deque[_Page]] = [deque() for _ in range(self.slices)]
+        self._processed_ids: set[str] = set()
+        self._skipped_ids: frozenset[str] = frozenset()
+        self._count_skipped: bool = False
+        self._last_checkpoint: float = time.monotonic()
+
+    def run(self) -> None:
+        """Run the pipeline until all the documents are processed. Blocks the caller.
+
+        Any error raised in one of the stages stops the pipeline and is re-raised here.
+        """
+        llms = [self.cascade.small_llm, self.cascade.large_llm] if self.cascade else [self.llm]
+        llms = [llm for llm in llms if hasattr(llm, 'get_stats')]
+        initial_stats = [llm.get_stats() for llm in llms]
+        pools = list({id(llm.client): llm.client for llm in llms if hasattr(llm.client, 'get_stats')}.values())
+        initial_host_stats = [pool.get_stats() for pool in pools]
+        start = time.monotonic()
+        checkpoint = None
+        if self.resume and self.checkpoint_directory:
+            checkpoint = load_checkpoint(self.checkpoint_directory, self.request[REQUEST_ID])
+        if checkpoint and checkpoint[SLICES] != self.slices:
+            # Cursors are only valid with the same slices
+            self._set_slices(checkpoint[SLICES])
+        with PointInTimeScanner(
+            es_client=self.es_client,
+            index_name=self.index_name,
+            query=self.query,
+            page_size=self.page_size,
+            keep_alive=self.keep_alive,
+            slices=self.slices,
+            source_includes=self.fields,
+            pit_id=checkpoint[PIT_ID] if checkpoint else None
+        ) as scanner:
+            self._scanner = scanner
+            self.total_docs = scanner.total_docs + self.labeled_docs
+            if checkpoint:
+                self._restore(checkpoint, scanner.reused)
+            fetchers = [
+                threading.Thread(target=self._fetch, args=(scanner, slice_id), name=f'labeling-fetch-{slice_id}', daemon=True)
+                for slice_id in range(self.slices)
+            ]
+            writer = threading.Thread(target=self._write, name='labeling-write', daemon=True)
+            for fetcher in fetchers:
+                fetcher.start()
+            writer.start()
+            try:
+                with llm_request_context(PRIORITY_BATCH, self._llm_key):
+                    self._classify()
+            except Exception as e:
+                self._fail(e)
+            finally:
+                self._put(self._results, _END)
+                writer.join()
+                self._stop.set()
+                for fetcher in fetchers:
+                    fetcher.join()
+                self._close()
+        for llm, stats in zip(llms, initial_stats):
+            self.llm_stats[llm.name] = {field: value - stats[field] for field, value in llm.get_stats().items()}
+        for pool, stats in zip(pools, initial_host_stats):
+            for url, host_stats in pool.get_stats().items():
+                self.host_stats[url] = {field: host_stats[field] - stats[url][field]
+                                        for field in ['requests', 'failures', 'timeouts', 'retries', 'busy_time',
+                                                      'eval_count']}
+        self.elapsed = time.monotonic() - start
+        if self._error:
+            raise self._error
+        if self.bulk_writer.failed_ids:
+            logger.error(f'{len(self.bulk_writer.failed_ids)} documents could not be updated: {self.bulk_writer.failed_ids}')
+        if self.checkpoint_directory:
+            delete_checkpoint(self.checkpoint_directory, self.request[REQUEST_ID])
+        self._report(finished=True)
+
+    def pause(self) -> None:
+        """Stop sending documents to the LLM until :meth:`unpause` is called."""
+        self._running.clear()
+
+    def unpause(self) -> None:
+        self._running.set()
+
+    def cancel(self) -> None:
+        """Stop the pipeline. :meth:`run` raises :class:`LabelingCancelled` once all the stages are stopped."""
+        self._fail(LabelingCancelled(f'Request #{self.request[REQUEST_ID]} was cancelled'))
+
+    def summary(self) -> str:
+        """Get a summary of the job, to be shown to the user once it is finished."""
+        summary = f'Job summary:\n- Documents analyzed: {self.fetched_docs}\n'
+        if self.resumed_docs:
+            summary += f'- Documents processed before resuming the job: {self.resumed_docs}\n'
+        if self.labeled_docs:
+            summary += f'- Documents skipped (they already had the score/label): {self.labeled_docs}\n'
+        if self.fetched_docs:
+            summary += (f'- Data transferred: {self.fetched_bytes / 1024:.1f} KB '
+                        f'({self.fetched_bytes / self.fetched_docs / 1024:.2f} KB per document, '
+                        f'fields: {", ".join(self.fields)})\n')
+        if self.preprocessed_docs:
+            tokens_before = self.tokens_before / self.preprocessed_docs
+            tokens_after = self.tokens_after / self.preprocessed_docs
+            summary += (f'- Average tokens per document: {tokens_before:.0f} before preprocessing, {tokens_after:.0f} after '
+                        f'({1 - tokens_after / max(1.0, tokens_before):.0%} less)\n')
+        if self.prefilter:
+            summary += (f'- Documents discarded by the prefilter (similarity to the instructions below '
+                        f'{self.prefilter.threshold}): {self.prefiltered_docs}\n')
+        summary += f'- LLM calls: {self.llm_calls}\n'
+        if self.cascade:
+            summary += (f'  - Small model ({self.cascade.small_llm.name}): {self.small_llm_calls}, '
+                        f'large model ({self.cascade.large_llm.name}): {self.llm_calls - self.small_llm_calls}\n'
+                        f'- Documents escalated to the large model (confidence below {self.cascade.min_confidence}): '
+                        f'{self.escalated_docs}\n')
+        for name, stats in self.llm_stats.items():
+            if stats['calls']:
+                # Ollama only evaluates the prompt tokens not shared with the previous prompt of the model (the rest
+                # are reused from its KV cache), so few evaluated tokens per call means a high prefix reuse
+                summary += (f'- {name} (including concurrent jobs): {stats["calls"]} calls, '
+                            f'prompt evaluation {stats["prompt_eval_duration"] / 1e9:.1f}s '
+                            f'({stats["prompt_eval_count"] / stats["calls"]:.0f} tokens evaluated per call), '
+                            f'generation {stats["eval_duration"] / 1e9:.1f}s '
+                            f'({stats["eval_count"] / stats["calls"]:.0f} tokens per call), '
+                            f'model loading {stats["load_duration"] / 1e9:.1f}s')
+                if stats.get('hedges'):
+                    summary += (f', {stats["hedges"]} calls hedged (slower than usual, sent twice), '
+                                f'{stats["hedge_wins"]} answered first by the duplicate')
+                summary += '\n'
+        limiter = getattr(self.llm, 'limiter', None)
+        stats = limiter.get_stats() if limiter else None
+        if stats and stats['p50'] is not None:
+            summary += (f'- Concurrent LLM calls (adaptive limit, between {limiter.min_limit} and {limiter.max_limit}): '
+                        f'{stats["limit"]}, decreased {stats["decreases"]} times. Latency of the latest calls: '
+                        f'{stats["p50"]:.2f} s (median), {stats["p90"]:.2f} s (p90), {stats["p99"]:.2f} s (p99)\n')
+            waits = ', '.join(f'{wait:.2f} s ({name})' for name, wait in stats['mean_wait'].items() if wait is not None)
+            if waits:
+                summary += f'- Mean wait of the LLM calls for a free slot, by priority (all the agents): {waits}\n'
+        timeouts = sum(stats['timeouts'] for stats in self.host_stats.values())
+        retries = sum(stats['retries'] for stats in self.host_stats.values())
+        if timeouts or retries:
+            summary += (f'- LLM calls timed out (including concurrent jobs): {timeouts}, '
+                        f'failed calls retried: {retries}\n')
+        if len(self.host_stats) > 1:
+            total_requests = max(1, sum(stats['requests'] for stats in self.host_stats.values()))
+            elapsed = max(self.elapsed, 1e-3)
+            summary += '- Ollama hosts (including concurrent jobs):\n'
+            for url, stats in self.host_stats.items():
+                summary += (f'  - {url}: {stats["requests"]} requests ({stats["requests"] / total_requests:.0%}), '
+                            f'{stats["requests"] / elapsed:.2f} requests/s, {stats["eval_count"] / elapsed:.1f} tokens/s '
+                            f'generated, {stats["busy_time"] / elapsed:.1f} requests in progress on average')
+                summary += f', {stats["failures"]} failed\n' if stats['failures'] else '\n'
+        if self.chunked_docs:
+            summary += f'- Documents split into chunks (too long for the LLM context): {self.chunked_docs}\n'
+        if self.verdict_cache:
+            summary += f'- Verdicts found in cache: {self.cache_hits} (cache hit rate: {self.cache_hits / max(1, self.fetched_docs):.0%})\n'
+        if self.retried_docs:
+            summary += f'- Documents classified again individually (incomplete batch answers): {self.retried_docs}\n'
+        if self.bulk_writer.failed_ids:
+            summary += f'- Documents that could not be updated: {len(self.bulk_writer.failed_ids)}\n'
+        return summary
+
+    def _set_slices(self, slices: int) -> None:
+        self.slices = slices
+        self._cursors = [None] * slices
+        self._open_pages = [deque() for _ in range(slices)]
+
+    def _restore(self, checkpoint: dict, reused_pit: bool) -> None:
+        """Restore the state of the job from a checkpoint."""
+        self._processed_ids = set(checkpoint[PROCESSED_IDS])
+        self._skipped_ids = frozenset(self._processed_ids)
+        self.resumed_docs = len(self._processed_ids)
+        if reused_pit:
+            # Continue from the cursors: the counters of the checkpoint already include the skipped documents
+            self._cursors = checkpoint[CURSORS]
+            self.labeled_docs = checkpoint[LABELED_DOCS]
+            self.updated_docs = checkpoint[UPDATED_DOCS]
+            self.ignored_docs = checkpoint[IGNORED_DOCS]
+            self.total_docs = checkpoint[TOTAL_DOCS]
+        else:
+            # Scan again from the beginning. The documents updated before the checkpoint are already excluded by the
+            # query (and counted in labeled_docs), so the processed documents that are found were ignored
+            self._count_skipped = True
+
+    def _close(self) -> None:
+        """Send the pending updates and store the checkpoint of a failed or cancelled pipeline. Called once all the
+        stages are stopped.
+
+        The checkpoint is only stored if all the pending updates were sent, so it never contains processed documents
+        that are not in the index (the previous checkpoint is kept otherwise).
+        """
+        try:
+            if self._error and self.checkpoint_directory:
+                # Keep the progress made since the last checkpoint, including the verdicts waiting to be written
+                while not self._results.empty():
+                    result = self._results.get_nowait()
+                    if result is not _END:
+                        self._write_result(result)
+            self.bulk_writer.close()
+        except Exception as e:
+            logger.error(f'The pending updates of request #{self.request[REQUEST_ID]} could not be sent: {e}')
+            self._fail(e)
+            return
+        if self._error and self.checkpoint_directory:
+            try:
+                self._checkpoint()
+            except Exception as e:
+                logger.error(f'The checkpoint of request #{self.request[REQUEST_ID]} could not be stored: {e}')
+
+    def _checkpoint(self) -> None:
+        """Store a checkpoint of the job. Must be called from the write stage."""
+        # Pending updates are sent first, so that all the processed documents in the checkpoint are in the index
+        self.bulk_writer.flush_all()
+        save_checkpoint(self.checkpoint_directory, self.request[REQUEST_ID], {
+            REQUEST: self.request,
+            PIT_ID: self._scanner.pit_id,
+            SLICES: self.slices,
+            CURSORS: self._cursors,
+            PROCESSED_IDS: list(self._processed_ids),
+            LABELED_DOCS: self.labeled_docs,
+            UPDATED_DOCS: self.updated_docs,
+            IGNORED_DOCS: self.ignored_docs,
+            TOTAL_DOCS: self.total_docs
+        })
+        self._last_checkpoint = time.monotonic()
+
+    def _checkpoint_if_due(self) -> None:
+        if self.checkpoint_directory and time.monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+            self._checkpoint()
+
+    def _fetch(self, scanner: PointInTimeScanner, slice_id: int) -> None:
+        pages = scanner.pages(slice_id=slice_id, search_after=self._cursors[slice_id])
+        try:
+            for page in pages:
+                page_bytes = sum(len(json.dumps(doc['_source'], ensure_ascii=False).encode('utf-8')) for doc in page)
+                with self._fetch_lock:
+                    self.fetched_docs += len(page)
+                    self.fetched_bytes += page_bytes
+                if not self._put(self._pages, (slice_id, page)):
+                    break
+        except Exception as e:
+            self._fail(e)
+        finally:
+            pages.close()
+            self._put(self._pages, _END)
+
+    def _classify(self) -> None:
+        with ThreadPoolExecutor(max_workers=self.llm_workers, thread_name_prefix='labeling-llm') as executor:
+            active_fetchers = self.slices
+            batch, batch_tokens = [], 0
+            while not self._stop.is_set():
+                fetched = self._get(self._pages)
+                if fetched is _END:
+                    active_fetchers -= 1
+                    if active_fetchers == 0:
+                        break
+                    continue
+                slice_id, hits = fetched
+                page = _Page(slice_id, hits[-1]['sort'], len(hits))
+                self._open_pages[slice_id].append(page)
+                candidates = []
+                for doc in hits:
+                    if doc['_id'] in self._skipped_ids:
+                        # Processed before resuming the job
+                        self._put(self._results, (doc['_id'], None, page))
+                        continue
+                    prompt_doc, doc_tokens = self._prompt_doc(doc)
+                    cache_key = None
+                    if self.verdict_cache:
+                        cache_key = VerdictCache.key(self._cache_prefix, prompt_doc)
+                        cached_verdict = self.verdict_cache.get(cache_key)
+                        if cached_verdict is not None:
+                            self.cache_hits += 1
+                            self._put(self._results, (doc['_id'], cached_verdict, page))
+                            continue
+                    candidates.append((doc['_id'], prompt_doc, doc_tokens, cache_key))
+                if self.prefilter:
+                    candidates = self._prefilter(candidates, page)
+                for doc_id, prompt_doc, doc_tokens, cache_key in candidates:
+                    if (self._batch_token_budget is not None or self.chunker) and doc_tokens is None:
+                        doc_tokens = token_count(self.tokenizer, str(prompt_doc))
+                    if self.chunker and not self.chunker.fits(self.prompt_filters, doc_tokens):
+                        # Classified alone, with several LLM calls
+                        if not self._submit(executor, [(doc_id, prompt_doc, cache_key, page)], chunked=True):
+                            return
+                        continue
+                    if batch and (len(batch) >= self.batch_max_docs or (self._batch_token_budget is not None and
+                                                                        batch_tokens + doc_tokens > self._batch_token_budget)):
+                        if not self._submit(executor, batch):
+                            return
+                        batch, batch_tokens = [], 0
+                    batch.append((doc_id, prompt_doc, cache_key, page))
+                    batch_tokens += doc_tokens or 0
+            if batch:
+                self._submit(executor, batch)
+
+    def _prefilter(self, candidates: list[tuple[str, dict, int, str]], page: _Page) -> list[tuple[str, dict, int, str]]:
+        """Discard the documents of a page that score below the prefilter threshold (with a single embedding request),
+        returning the documents that must be sent to the LLM."""
+        scores = self.prefilter.scores(self.request[INSTRUCTIONS], [prompt_doc for _, prompt_doc, _, _ in candidates])
+        passed = []
+        for candidate, score in zip(candidates, scores):
+            if self.prefilter.passes(score):
+                passed.append(candidate)
+            else:
+                # Not stored in the verdict cache: it is not a verdict of the LLM
+                self.prefiltered_docs += 1
+                self._put(self._results, (candidate[0], False, page))
+        return passed
+
+    def _prompt_doc(self, doc: dict) -> tuple[dict, int or None]:
+        """Build the prompt document of a fetched document, preprocessing it.
+
+        The tokens of the document are measured before and after the preprocessing (if there is a tokenizer), and the
+        tokens of the preprocessed document are returned too, so the batching does not measure it again.
+        """
+        prompt_doc = build_prompt_doc(doc, self.fields)
+        if not self.preprocessor:
+            return prompt_doc, None
+        processed = self.preprocessor.process(prompt_doc)
+        if not self.tokenizer:
+            return processed, None
+        processed_tokens = token_count(self.tokenizer, str(processed))
+        self.preprocessed_docs += 1
+        self.tokens_before += token_count(self.tokenizer, str(prompt_doc))
+        self.tokens_after += processed_tokens
+        return processed, processed_tokens
+
+    def _submit(self, executor: ThreadPoolExecutor, batch: list[tuple[str, dict, str, _Page]], chunked: bool = False) -> bool:
+        """Submit a batch of documents to the LLM workers (or a single document to be classified in chunks).
+
+        Waits for a free slot, so that at most llm_workers batches are in flight. Returns False if the pipeline is
+        stopped while waiting. While the pipeline is paused, no batch is submitted.
+        """
+        while not self._running.wait(timeout=_POLL_INTERVAL):
+            if self._stop.is_set():
+                return False
+        while not self._in_flight.acquire(timeout=_POLL_INTERVAL):
+            if self._stop.is_set():
+                return False
+        if self._stop.is_set():
+            self._in_flight.release()
+            return False
+        future = executor.submit(contextvars.copy_context().run, self._classify_batch, batch, chunked)
+        future.add_done_callback(self._on_classified)
+        return True
+
+    def _classify_batch(self, batch: list[tuple[str, dict, str, _Page]], chunked: bool = False) -> list[tuple[str, bool, _Page]]:
+        if chunked:
+            verdict, llm_calls = self.chunker.classify(self.llm, self.prompt_filters, batch[0][1])
+            verdicts = {0: verdict}
+            with self._stats_lock:
+                self.llm_calls += llm_calls
+                self.chunked_docs += 1
+        elif len(batch) == 1:
+            verdicts = {0: self._classify_doc(batch[0][1])}
+        elif self.cascade:
+            # The verdicts of the small model with a low confidence are left out, so they are escalated below
+            verdicts = classify_batch(self.cascade.small_llm, self.prompt_filters,
+                                      [prompt_doc for _, prompt_doc, _, _ in batch], self.cascade.min_confidence)
+            with self._stats_lock:
+                self.llm_calls += 1
+                self.small_llm_calls += 1
+        else:
+            verdicts = classify_batch(self.llm, self.prompt_filters, [prompt_doc for _, prompt_doc, _, _ in batch])
+            with self._stats_lock:
+                self.llm_calls += 1
+        results = []
+        for i, (doc_id, prompt_doc, cache_key, page) in enumerate(batch):
+            if i not in verdicts:
+                # The answer did not include a valid (or, in a cascade, confident) verdict for this document
+                with self._stats_lock:
+                    if self.cascade:
+                        self.escalated_docs += 1
+                    else:
+                        self.retried_docs += 1
+                verdicts[i] = self._classify_doc(prompt_doc, escalated=self.cascade is not None)
+            if self.verdict_cache:
+                self.verdict_cache.put(cache_key, verdicts[i])
+            results.append((doc_id, verdicts[i], page))
+        return results
+
+    def _classify_doc(self, prompt_doc: dict, escalated: bool = False) -> bool:
+        """Classify a single document, with the cascade if there is one (unless it is already escalated to the large
+        model)."""
+        prompt = self.prompt_filters + f"Document:\n{prompt_doc}"
+        if self.cascade and not escalated:
+            verdict, escalated = self.cascade.classify(prompt)
+            with self._stats_lock:
+                self.llm_calls += 2 if escalated else 1
+                self.small_llm_calls += 1
+                self.escalated_docs += escalated
+            return verdict
+        with self._stats_lock:
+            self.llm_calls += 1
+        return classify_doc(self.llm, prompt)
+
+    def _on_classified(self, future: Future) -> None:
+        self._in_flight.release()
+        if future.exception():
+            self._fail(future.exception())
+            return
+        for result in future.result():
+            self._put(self._results, result)
+
+    def _write(self) -> None:
+        try:
+            while not self._stop.is_set():
+                result = self._get(self._results, on_idle=self._on_write_idle)
+                if result is _END:
+                    break
+                self._write_result(result)
+                self._report(finished=False)
+                self._checkpoint_if_due()
+        except Exception as e:
+            self._fail(e)
+
+    def _write_result(self, result: tuple[str, bool, _Page]) -> None:
+        doc_id, llm_prediction, page = result
+        if llm_prediction is None:
+            if self._count_skipped:
+                self.ignored_docs += 1
+        elif llm_prediction:
+            self.bulk_writer.add(doc_id)
+            self.updated_ids.append(doc_id)  # TODO: To show list of updated docs
+            self.updated_docs += 1
+        else:
+            self.ignored_docs += 1
+        self._processed_ids.add(doc_id)
+        self._complete(page)
+
+    def _on_write_idle(self) -> None:
+        self.bulk_writer.flush_if_due()
+        self._checkpoint_if_due()
+
+    def _complete(self, page: _Page) -> None:
+        """Mark a document of a page as written, moving the slice cursor past the pages that are complete."""
+        page.remaining -= 1
+        open_pages = self._open_pages[page.slice_id]
+        while open_pages and open_pages[0].remaining == 0:
+            self._cursors[page.slice_id] = open_pages.popleft().search_after
+
+    def _report(self, finished: bool) -> None:
+        progress = {
+            REQUEST_ID: self.request[REQUEST_ID],
+            UPDATED_DOCS: self.updated_docs,
+            IGNORED_DOCS: self.ignored_docs,
+            TOTAL_DOCS: self.total_docs
+        }
+        if self.job_id is not None:
+            progress[JOB_ID] = self.job_id
+        if finished:
+            self.progress.finish(progress)
+        else:
+            self.progress.update(progress)
+
+    def _fail(self, error: Exception) -> None:
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        """Put an item in a queue, giving up if the pipeline is stopped while waiting for a free slot."""
+        while True:
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                if self._stop.is_set():
+                    return False
+
+    def _get(self, q: queue.Queue, on_idle=None):
+        """Get an item from a queue, returning the end mark if the pipeline is stopped while waiting.
+
+        If given, on_idle is called every time the wait times out.
+        """
+        while True:
+            try:
+                return q.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return _END
+                if on_idle:
+                    on_idle()
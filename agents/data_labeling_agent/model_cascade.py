@@ -0,0 +1,45 @@
+from besser.agent.nlp.llm.llm import LLM
+
+from agents.elasticsearch.elasticsearch_query import classify_doc, classify_doc_with_confidence
+
+
+class ModelCascade:
+    """Classifies documents with 2 tiers of LLMs: a small fast model gives a verdict with a confidence score, and only
+    the documents it is not confident about are escalated to the large model.
+
+    The throughput then depends on how easy the documents are: the more documents the small model decides with
+    confidence, the fewer calls to the large model.
+
+    In batch prompts (see :func:`classify_batch`), the small model rates each verdict, and the documents with a low
+    confidence (or missing from the answer) are escalated individually.
+
+    Args:
+        small_llm (LLM): the small model (first tier)
+        large_llm (LLM): the large model (second tier)
+        min_confidence (float): the minimum confidence of the small model's verdicts, between 0 and 1 (documents with
+            a lower confidence are escalated)
+
+    Attributes:
+        name (str): the name of the cascade (its models and threshold), used instead of the model name to cache its
+            verdicts
+    """
+
+    def __init__(self, small_llm: LLM, large_llm: LLM, min_confidence: float = 0.8):
+        self.small_llm: LLM = small_llm
+        self.large_llm: LLM = large_llm
+        self.min_confidence: float = min_confidence
+        self.name: str = f'{small_llm.name}>{large_llm.name}@{min_confidence}'
+
+    def classify(self, prompt: str) -> tuple[bool, bool]:
+        """Classify a document, escalating it to the large model if the small model is not confident.
+
+        Args:
+            prompt (str): the prompt with the filters and the document
+
+        Returns:
+            tuple[bool, bool]: whether the document satisfies the instructions, and whether it was escalated
+        """
+        verdict, confidence = classify_doc_with_confidence(self.small_llm, prompt)
+        if verdict is not None and confidence >= self.min_confidence:
+            return verdict, False
+        return classify_doc(self.large_llm, prompt), True
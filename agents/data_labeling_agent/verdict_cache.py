@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from agents.data_labeling_agent.document_chunker import CHUNK_NOTES_PROMPT
+from agents.elasticsearch.elasticsearch_query import CLASSIFY_INSTRUCTION, CONFIDENCE_INSTRUCTION, BATCH_INSTRUCTION, \
+    BATCH_CONFIDENCE_INSTRUCTION, VERDICT_SCHEMA, CONFIDENT_VERDICT_SCHEMA
+from app.vars import *
+
+# Number of insertions between 2 checks of the cache size
+_EVICTION_CHECK_INTERVAL = 1000
+
+# Fingerprint of the prompts and answer schemas the verdicts are obtained with, so that the verdicts cached with
+# previous versions of them are not used
+PROMPT_VERSION = hashlib.sha256(json.dumps([
+    CLASSIFY_INSTRUCTION,
+    CONFIDENCE_INSTRUCTION,
+    BATCH_INSTRUCTION,
+    BATCH_CONFIDENCE_INSTRUCTION,
+    CHUNK_NOTES_PROMPT,
+    VERDICT_SCHEMA,
+    CONFIDENT_VERDICT_SCHEMA
+], sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def normalize_instructions(instructions: list[dict]) -> list[list[str]]:
+    """
+    Normalizes a list of request instructions, so that equivalent instruction sets are equal regardless of their
+    order, case or spacing.
+
+    :param instructions: The request instructions
+    :return: The sorted list of [field, text] pairs
+    """
+    return sorted(
+        [instruction[FIELD] or '', re.sub(r'\s+', ' ', instruction[TEXT]).strip().lower()]
+        for instruction in instructions
+    )
+
+
+class VerdictCache:
+    """A persistent (SQLite) cache of LLM verdicts, so that repeated or overlapping requests skip the LLM calls.
+
+    Verdicts are keyed by the model name, the version of the classification prompts (see ``PROMPT_VERSION``), the
+    normalized instruction set and a hash of the document fields sent to the LLM: if any of them changes, the cached
+    verdict is not used. When the cache exceeds ``max_entries`` (checked
+    periodically), the least recently used verdicts are evicted.
+
+    The cache is thread-safe.
+
+    Args:
+        path (str): path of the SQLite database file
+        max_entries (int): maximum number of cached verdicts
+
+    Attributes:
+        hits (int): number of lookups that found a cached verdict
+        misses (int): number of lookups that did not find a cached verdict
+    """
+
+    def __init__(self, path: str, max_entries: int = 1000000):
+        self.path: str = path
+        self.max_entries: int = max_entries
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock = threading.Lock()
+        self._puts: int = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, verdict INTEGER NOT NULL, last_used REAL NOT NULL)'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS verdicts_last_used ON verdicts (last_used)')
+
+    @staticmethod
+    def instructions_key(model: str, instructions: list[dict]) -> str:
+        """Get the part of the cache keys shared by all the documents of a request."""
+        return json.dumps([model, PROMPT_VERSION, normalize_instructions(instructions)], ensure_ascii=False)
+
+    @staticmethod
+    def key(instructions_key: str, prompt_doc: dict) -> str:
+        """Get the cache key of a document (see :meth:`instructions_key`)."""
+        doc = json.dumps(prompt_doc, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(f'{instructions_key}\n{doc}'.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> bool or None:
+        """Get a cached verdict, or None if it is not cached."""
+        with self._lock:
+            row = self._connection.execute('SELECT verdict FROM verdicts WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._connection:
+                self._connection.execute('UPDATE verdicts SET last_used = ? WHERE key = ?', (time.time(), key))
+            return bool(row[0])
+
+    def put(self, key: str, verdict: bool) -> None:
+        """Store a verdict, evicting the least recently used ones if the cache is full."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO verdicts (key, verdict, last_used) VALUES (?, ?, ?)',
+                (key, int(verdict), time.time())
+            )
+            self._puts += 1
+            if self._puts % _EVICTION_CHECK_INTERVAL:
+                return
+            num_entries = self._connection.execute('SELECT COUNT(*) FROM verdicts').fetchone()[0]
+            if num_entries > self.max_entries:
+                # Evict a few more than needed, so that eviction does not run on every insertion
+                num_evicted = num_entries - self.max_entries + max(1, self.max_entries // 100)
+                self._connection.execute(
+                    'DELETE FROM verdicts WHERE key IN (SELECT key FROM verdicts ORDER BY last_used LIMIT ?)',
+                    (num_evicted,)
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
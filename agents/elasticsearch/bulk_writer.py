@@ -0,0 +1,149 @@
+import time
+
+from besser.agent.exceptions.logger import logger
+
+from agents.elasticsearch.elasticsearch_query import APPEND_LABEL_SCRIPT
+from agents.elasticsearch.query_cache import QueryCache
+from app.vars import *
+
+# ID of the stored version of APPEND_LABEL_SCRIPT, so bulk updates reference it instead of sending its source
+APPEND_LABEL_SCRIPT_ID = 'caselens-append-document-label'
+# Bulk item statuses that are worth retrying (conflicts, throttling and transient server errors)
+RETRYABLE_STATUSES = {409, 429, 500, 502, 503, 504}
+
+
+class BulkWriter:
+    """Buffers document score/label updates and sends them to Elasticsearch in ``_bulk`` requests.
+
+    The buffer is flushed when it reaches ``max_actions`` updates or when its oldest update is older than
+    ``flush_interval`` seconds (checked on every call to :meth:`add` and :meth:`flush_if_due`). Items that fail
+    with a retryable status are sent again in the next flushes, up to ``max_retries`` times. If the ``_bulk`` request
+    itself raises, the error is propagated and the updates stay in the buffer. The index is not refreshed after each
+    flush but only once, when the writer is closed.
+
+    A BulkWriter is not thread-safe: it must be used from a single thread.
+
+    Args:
+        es_client: Elasticsearch client instance
+        index_name (str): name of the Elasticsearch index
+        action (str): the request action (DOCUMENT_RELEVANCE or DOCUMENT_LABELS)
+        target_value: the score or label to set
+        max_actions (int): maximum number of buffered updates before flushing
+        flush_interval (float): maximum time (in seconds) an update can stay in the buffer
+        max_retries (int): maximum number of times a failed update is retried
+        query_cache (QueryCache): if given, its results for the index are invalidated after each write
+
+    Attributes:
+        written_docs (int): number of documents successfully updated
+        failed_ids (list[str]): IDs of the documents that could not be updated
+        num_requests (int): number of ``_bulk`` requests sent
+    """
+
+    def __init__(
+            self,
+            es_client,
+            index_name: str,
+            action: str,
+            target_value,
+            max_actions: int = 500,
+            flush_interval: float = 5,
+            max_retries: int = 3,
+            query_cache: QueryCache = None
+    ):
+        self.es_client = es_client
+        self.index_name: str = index_name
+        self.action: str = action
+        self.target_value = target_value
+        self.max_actions: int = max(1, max_actions)
+        self.flush_interval: float = flush_interval
+        self.max_retries: int = max_retries
+        self.query_cache: QueryCache = query_cache
+
+        self.written_docs: int = 0
+        self.failed_ids: list[str] = []
+        self.num_requests: int = 0
+
+        self._buffer: list[tuple[str, int]] = []  # (doc_id, attempts)
+        self._buffer_since: float = None
+        self._script_stored: bool = False
+
+    def add(self, doc_id: str) -> None:
+        """Add a document to be updated with the target score/label."""
+        self._append(doc_id, 0)
+        if len(self._buffer) >= self.max_actions:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self) -> None:
+        """Flush the buffer if its oldest update has been waiting for more than ``flush_interval`` seconds."""
+        if self._buffer and time.monotonic() - self._buffer_since >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """Send all the buffered updates in a single ``_bulk`` request."""
+        if not self._buffer:
+            return
+        buffer = self._buffer
+        buffer_since = self._buffer_since
+        self._buffer = []
+        self._buffer_since = None
+        operations = []
+        for doc_id, _ in buffer:
+            operations.append({'update': {'_index': self.index_name, '_id': doc_id, 'retry_on_conflict': 3}})
+            operations.append(self._update_body())
+        try:
+            if self.action == DOCUMENT_LABELS:
+                self._store_script()
+            response = self.es_client.bulk(operations=operations, refresh=False)
+        except Exception:
+            # Keep the updates pending, so they are sent by the next flush instead of being lost
+            self._buffer = buffer
+            self._buffer_since = buffer_since
+            raise
+        self.num_requests += 1
+        if self.query_cache:
+            self.query_cache.invalidate(self.index_name)
+        if not response['errors']:
+            self.written_docs += len(buffer)
+            return
+        for (doc_id, attempts), item in zip(buffer, response['items']):
+            result = item['update']
+            if 'error' not in result:
+                self.written_docs += 1
+            elif result['status'] in RETRYABLE_STATUSES and attempts < self.max_retries:
+                self._append(doc_id, attempts + 1)
+            else:
+                logger.error(f"Document {doc_id} could not be updated: {result['error']}")
+                self.failed_ids.append(doc_id)
+        if self._buffer:
+            # Give the cluster some time before retrying (exponential backoff on the highest attempt)
+            time.sleep(min(0.5 * 2 ** max(attempts for _, attempts in self._buffer), 10))
+
+    def flush_all(self) -> None:
+        """Flush the buffer until all the pending updates (including retries) are sent."""
+        while self._buffer:
+            self.flush()
+
+    def close(self) -> None:
+        """Flush the pending updates (including retries) and refresh the index once."""
+        self.flush_all()
+        if self.num_requests:
+            self.es_client.indices.refresh(index=self.index_name)
+            if self.query_cache:
+                self.query_cache.invalidate(self.index_name)
+
+    def _append(self, doc_id: str, attempts: int) -> None:
+        if not self._buffer:
+            self._buffer_since = time.monotonic()
+        self._buffer.append((doc_id, attempts))
+
+    def _update_body(self) -> dict:
+        if self.action == DOCUMENT_RELEVANCE:
+            return {'doc': {DOCUMENT_RELEVANCE: self.target_value}}
+        return {'script': {'id': APPEND_LABEL_SCRIPT_ID, 'params': {'new_label': self.target_value}}}
+
+    def _store_script(self) -> None:
+        if not self._script_stored:
+            self.es_client.put_script(id=APPEND_LABEL_SCRIPT_ID, script={'lang': 'painless', 'source': APPEND_LABEL_SCRIPT})
+            self._script_stored = True
@@ -0,0 +1,123 @@
+import threading
+import time
+
+from besser.agent.exceptions.logger import logger
+from elastic_transport import Urllib3HttpNode, TransportError
+from elasticsearch import Elasticsearch
+
+# Response statuses retried by the client (throttling and transient server errors)
+RETRY_ON_STATUS = (429, 500, 502, 503, 504)
+
+
+def backoff_node_class(backoff_factor: float, max_backoff: float) -> type[Urllib3HttpNode]:
+    """
+    Creates an HTTP node class that waits before retrying a failed request, with exponential backoff.
+
+    The Elasticsearch transport retries failed requests right away when there is a single node. With this node class,
+    a request sent by a thread whose previous requests to the node failed (with a status in RETRY_ON_STATUS or a
+    connection error) waits backoff_factor * 2^(failures - 1) seconds first, at most max_backoff.
+
+    :param backoff_factor: Wait (in seconds) before the first retry
+    :param max_backoff: Maximum wait (in seconds) before a retry
+    :return: The node class, to be used as the Elasticsearch client's node_class
+    """
+
+    class BackoffUrllib3HttpNode(Urllib3HttpNode):
+
+        def __init__(self, config):
+            super().__init__(config)
+            # Consecutive failures of the requests of each thread (the transport retries in the same thread)
+            self._failures = threading.local()
+
+        def perform_request(self, *args, **kwargs):
+            failures = getattr(self._failures, 'count', 0)
+            if failures:
+                time.sleep(min(max_backoff, backoff_factor * 2 ** (failures - 1)))
+            try:
+                response = super().perform_request(*args, **kwargs)
+            except TransportError:
+                self._failures.count = failures + 1
+                raise
+            self._failures.count = failures + 1 if response.meta.status in RETRY_ON_STATUS else 0
+            return response
+
+    return BackoffUrllib3HttpNode
+
+
+class ElasticsearchClientManager:
+    """Process-wide Elasticsearch client, shared by all the agent sessions (the client is thread-safe).
+
+    The client keeps a pool of up to ``connections_per_node`` connections, applies a timeout to every request and
+    retries failed requests (connection errors and statuses in RETRY_ON_STATUS) with exponential backoff.
+
+    :meth:`is_available` is a cheap health probe: it pings the cluster with a short timeout and caches the result for
+    ``health_check_interval`` seconds, so it can be called before every user request.
+
+    Args:
+        host (str): host address of the Elasticsearch database
+        port (int): port of the Elasticsearch database
+        connections_per_node (int): maximum number of pooled connections
+        request_timeout (float): timeout (in seconds) of each request (long operations can override it with
+            ``client.options(request_timeout=...)``)
+        max_retries (int): maximum number of times a failed request is retried
+        retry_backoff (float): wait (in seconds) before the first retry, doubled on each retry
+        max_retry_backoff (float): maximum wait (in seconds) before a retry
+        health_check_interval (float): time (in seconds) the result of the health probe is cached
+        health_check_timeout (float): timeout (in seconds) of the health probe
+
+    Attributes:
+        client (Elasticsearch): the shared client
+    """
+
+    def __init__(
+            self,
+            host: str,
+            port: int,
+            connections_per_node: int = 10,
+            request_timeout: float = 30,
+            max_retries: int = 3,
+            retry_backoff: float = 0.5,
+            max_retry_backoff: float = 10,
+            health_check_interval: float = 5,
+            health_check_timeout: float = 2
+    ):
+        self.url: str = f'http://{host}:{port}'
+        self.health_check_interval: float = health_check_interval
+        self.health_check_timeout: float = health_check_timeout
+        self.client: Elasticsearch = Elasticsearch(
+            [self.url],
+            connections_per_node=connections_per_node,
+            request_timeout=request_timeout,
+            max_retries=max_retries,
+            retry_on_status=RETRY_ON_STATUS,
+            retry_on_timeout=True,
+            node_class=backoff_node_class(retry_backoff, max_retry_backoff)
+        )
+        self._lock = threading.Lock()
+        self._available: bool = None
+        self._last_check: float = None
+
+    def is_available(self, force: bool = False) -> bool:
+        """Check whether the Elasticsearch database is reachable.
+
+        Args:
+            force (bool): ignore the cached result of the previous check
+
+        Returns:
+            bool: whether the database answered the ping
+        """
+        with self._lock:
+            now = time.monotonic()
+            if force or self._last_check is None or now - self._last_check >= self.health_check_interval:
+                # A failed probe is not retried: an outage must be reported quickly
+                probe = self.client.options(request_timeout=self.health_check_timeout, max_retries=0)
+                try:
+                    self._available = probe.ping()
+                except Exception as e:
+                    logger.warning(f'Elasticsearch health check failed: {e}')
+                    self._available = False
+                self._last_check = time.monotonic()
+            return self._available
+
+    def close(self) -> None:
+        self.client.close()
@@ -1,14 +1,29 @@
 import json
+import re
 
 from besser.agent.nlp.llm.llm import LLM
 from besser.agent.nlp.llm.llm_openai_api import LLMOpenAI
 from pydantic import BaseModel
-from besser.agent.core.session import Session
 
+from agents.elasticsearch.query_planner import plan_filters
 from app.vars import *
 
 
-def build_query(date_from=None, date_to=None, filters=None):
+# Painless script that adds params.new_label to the DOCUMENT_LABELS list of a document (if not already present)
+APPEND_LABEL_SCRIPT = f"""
+    if (ctx._source.{DOCUMENT_LABELS} == null) {{
+        ctx._source.{DOCUMENT_LABELS} = [params.new_label];
+    }} else if (!ctx._source.{DOCUMENT_LABELS}.contains(params.new_label)) {{
+        ctx._source.{DOCUMENT_LABELS}.add(params.new_label);
+    }}
+"""
+
+
+# Document fields sent to the LLM when no instruction refers to a specific field
+DEFAULT_PROMPT_FIELDS = [SUBJECT, CONTENT, FROM, TO]
+
+
+def build_query(date_from=None, date_to=None, filters=None, exclude_action=None, exclude_target_value=None, mappings=None):
     query = {"query": {"bool": {"filter": []}}}
     # Add date range filter if parameters are provided
     if date_from or date_to:
@@ -20,109 +35,151 @@ def build_query(date_from=None, date_to=None, filters=None):
 
         query["query"]["bool"]["filter"].append({"range": {DATE_CREATED: date_range}})
 
-    # Add filters
+    # Add filters, cheapest first. With the field mappings, they are rewritten to cheaper equivalent queries when possible
     if filters:
-        for f in filters:
-            field, operator, value = f[FIELD], f[OPERATOR], f[VALUE]
-            # if operator == "equals":
-            #     query["query"]["bool"]["filter"].append({"term": {field: value}}) # This only for fields keyword fields
-            # elif operator == "different":
-            #     query["query"]["bool"].setdefault("must_not", []).append({"term": {field: value}})
-            if operator == EQUALS:
-                query["query"]["bool"]["filter"].append({"match_phrase": {field: value}})  # This only for fields with analyzed text (SUBJECT, CONTENT)
-            elif operator == DIFFERENT:
-                query["query"]["bool"].setdefault("must_not", []).append({"match_phrase": {field: value}})
-            elif operator == CONTAINS:
-                query["query"]["bool"]["filter"].append({"wildcard": {field: f"*{value}*"}})
-            elif operator == STARTS_WITH:
-                query["query"]["bool"]["filter"].append({"prefix": {field: value}})
-            elif operator == REGEXP:
-                query["query"]["bool"]["filter"].append({"regexp": {field: value}})
-            elif operator == FUZZY:
-                query["query"]["bool"]["filter"].append({"fuzzy": {field: {"value": value, "fuzziness": "AUTO"}}})
+        for planned in plan_filters(filters, mappings or {}):
+            if planned.negated:
+                query["query"]["bool"].setdefault("must_not", []).append(planned.clause)
+            else:
+                query["query"]["bool"]["filter"].append(planned.clause)
+
+    # Exclusion mode: skip the documents that already have the target score/label of the request
+    if exclude_action:
+        query["query"]["bool"].setdefault("must_not", []).append(build_labeled_clause(exclude_action, exclude_target_value))
     return query
 
 
-def get_num_docs(es_client, index_name, query):
-    # Perform the count query by using size=0 to avoid retrieving documents
-    response = es_client.search(index=index_name, body=query, size=0, track_total_hits=True)
-    total_hits = response["hits"]["total"]["value"]
-    return total_hits
+def build_labeled_clause(action, target_value):
+    """
+    Builds the query clause matching the documents that already have a score/label.
+
+    DOCUMENT_LABELS is expected to be a keyword field, so the label is matched exactly.
+
+    :param action: The request action (DOCUMENT_RELEVANCE or DOCUMENT_LABELS)
+    :param target_value: The score or label
+    :return: The query clause
+    """
+    if action == DOCUMENT_RELEVANCE:
+        return {"term": {DOCUMENT_RELEVANCE: target_value}}
+    elif action == DOCUMENT_LABELS:
+        return {"term": {DOCUMENT_LABELS: target_value}}
+    raise ValueError(f'Unknown action: {action}')
+
+
+def get_num_docs(es_client, index_name, query, query_cache=None):
+    def count():
+        # Perform the count query by using size=0 to avoid retrieving documents
+        response = es_client.search(index=index_name, body=query, size=0, track_total_hits=True)
+        return response["hits"]["total"]["value"]
+
+    if query_cache is None:
+        return count()
+    return query_cache.get(es_client, index_name, 'count', query, count)
+
+
+def count_labeled_docs(es_client, index_name, query, action, target_value, query_cache=None):
+    """
+    Counts the documents matching a query that already have a score/label, without retrieving them.
+
+    :param es_client: Elasticsearch client instance
+    :param index_name: Name of the Elasticsearch index
+    :param query: Query to find matching documents
+    :param action: The request action (DOCUMENT_RELEVANCE or DOCUMENT_LABELS)
+    :param target_value: The score or label
+    :param query_cache: If given, the count is cached (see :class:`QueryCache`)
+    :return: The number of documents
+    """
+    labeled_query = {"query": {"bool": {"filter": [query["query"], build_labeled_clause(action, target_value)]}}}
+    return get_num_docs(es_client, index_name, labeled_query, query_cache)
+
+
+def get_random_docs(es_client, index_name, query, size, source_includes=None, seed=None):
+    """
+    Gets a uniform random sample of the documents matching a query.
+
+    :param es_client: Elasticsearch client instance
+    :param index_name: Name of the Elasticsearch index
+    :param query: Query to find matching documents
+    :param size: Number of documents of the sample
+    :param source_includes: If set, only these fields of the documents' _source are retrieved
+    :param seed: Seed of the random scores (if None, every call returns a different sample)
+    :return: The list of hits
+    """
+    random_score = {} if seed is None else {"seed": seed, "field": "_seq_no"}
+    body = {
+        "query": {"function_score": {"query": query["query"], "random_score": random_score, "boost_mode": "replace"}},
+        "size": size
+    }
+    if source_includes is not None:
+        body["_source"] = {"includes": source_includes}
+    response = es_client.search(index=index_name, body=body)
+    return response["hits"]["hits"]
+
 
+def build_prompt_filters(request):
+    """
+    Builds the filters block of the LLM prompt from the request instructions.
 
-def scroll_docs(session: Session, es_client, index_name, query, request, llm: LLM, scroll_time="1m", batch_size=100):
-    # Start the scroll
-    response = es_client.search(index=index_name, body=query, scroll=scroll_time, size=batch_size)
-    # Extract the scroll ID and process the first batch
-    scroll_id = response['_scroll_id']
-    total_docs = response["hits"]["total"]["value"]
-    updated_docs = 0
-    ignored_docs = 0
-    fields = set()
+    :param request: The labeling request
+    :return: The prompt text
+    """
     prompt_filters = 'Filters:\n'
     for i, instruction in enumerate(request[INSTRUCTIONS]):
         prompt_filters += f"{i+1}: {instruction[TEXT]}"
         if instruction[FIELD]:
             prompt_filters += f"(\"{instruction[FIELD]}\" field)"
-            fields.add(instruction[FIELD])
         prompt_filters += "\n"
-    ids = []
-    # Process the documents in batches
-    while len(response["hits"]["hits"]) > 0:
-        # Process each document in the current batch
-        # print(f'Total scroll size: {len(response["hits"]["hits"])}')
-        for doc in response["hits"]["hits"]:
-            doc_not_labeled = True
-            if (request[ACTION] == DOCUMENT_RELEVANCE and DOCUMENT_RELEVANCE in doc['_source'] and doc['_source'][DOCUMENT_RELEVANCE] == request[TARGET_VALUE]) \
-                    or (request[ACTION] == DOCUMENT_LABELS and DOCUMENT_LABELS in doc['_source'] and doc['_source'][DOCUMENT_LABELS] is not None and request[TARGET_VALUE] in doc['_source'][DOCUMENT_LABELS]):
-                # Doc already has the target score/label
-                doc_not_labeled = False
-            if doc_not_labeled:
-                #print(doc["_source"])  # Example: print the document content
-                if fields:
-                    prompt_doc = {
-                        field: doc['_source'][field] for field in fields
-                    }
-                else:
-                    prompt_doc = {
-                        SUBJECT: doc['_source'][SUBJECT],
-                        CONTENT: doc['_source'][CONTENT],
-                        FROM: doc['_source'][FROM],
-                        TO: doc['_source'][TO],
-                    }
-                prompt = prompt_filters + f"Document:\n{prompt_doc}"
-                llm_prediction = run_llm_openai(llm, prompt) if isinstance(llm, LLMOpenAI) else run_llm(llm, prompt)
-                if llm_prediction:
-                    updated_docs += 1
-                    ids.append(doc['_id'])  # TODO: To show list of updated docs
-                    if request[ACTION] == DOCUMENT_RELEVANCE:
-                        update_document_relevance_id(
-                            es_client=es_client,
-                            index_name=index_name,
-                            doc_id=doc['_id'],
-                            relevance_value=request[TARGET_VALUE]
-                        )
-                    elif request[ACTION] == DOCUMENT_LABELS:
-                        append_document_label_id(
-                            es_client=es_client,
-                            index_name=index_name,
-                            doc_id=doc['_id'],
-                            new_label=request[TARGET_VALUE]
-                        )
-                else:
-                    ignored_docs += 1
-            else:
-                updated_docs += 1
-            session.reply(json.dumps({REQUEST_ID: session.get(REQUEST)[REQUEST_ID], UPDATED_DOCS: updated_docs, IGNORED_DOCS: ignored_docs, TOTAL_DOCS: total_docs, FINISHED: False}))
-        # Get the next batch using the scroll ID
-        response = es_client.scroll(scroll_id=scroll_id, scroll=scroll_time)
+    return prompt_filters
+
+
+def get_prompt_fields(request):
+    """
+    Gets the document fields the LLM needs to evaluate the request instructions: the fields the instructions refer
+    to or, if no instruction refers to a specific field, the default email fields.
+
+    :param request: The labeling request
+    :return: The sorted list of fields
+    """
+    fields = sorted({instruction[FIELD] for instruction in request[INSTRUCTIONS] if instruction[FIELD]})
+    return fields or DEFAULT_PROMPT_FIELDS
+
+
+def build_prompt_doc(doc, fields):
+    """
+    Selects the document fields that are sent to the LLM.
+
+    :param doc: Elasticsearch hit
+    :param fields: Fields to send (see :func:`get_prompt_fields`)
+    :return: Dictionary with the document fields for the prompt
+    """
+    return {field: doc['_source'].get(field) for field in fields}
+
+
+def classify_doc(llm: LLM, prompt: str) -> bool:
+    """
+    Asks the LLM whether a document satisfies the request instructions.
+
+    :param llm: The LLM used to classify the document
+    :param prompt: The prompt with the filters and the document
+    :return: True if the document satisfies the instructions, False otherwise
+    """
+    return run_llm_openai(llm, prompt) if isinstance(llm, LLMOpenAI) else run_llm(llm, prompt)
 
-    # Clear the scroll context when done
-    es_client.clear_scroll(scroll_id=scroll_id)
-    session.reply(json.dumps({REQUEST_ID: session.get(REQUEST)[REQUEST_ID], UPDATED_DOCS: updated_docs, IGNORED_DOCS: ignored_docs, TOTAL_DOCS: total_docs, FINISHED: True}))
 
+def update_by_query_options(wait_for_completion):
+    """
+    Gets the update_by_query options of the *_query update functions.
 
-def append_document_label_query(es_client, index_name, query, new_label):
+    :param wait_for_completion: If False, the update runs in the background as a task, split into parallel slices
+        (one per shard), and the index is refreshed when it finishes
+    :return: The keyword arguments for update_by_query
+    """
+    if wait_for_completion:
+        return {}
+    return {"slices": "auto", "wait_for_completion": False, "refresh": True}
+
+
+def append_document_label_query(es_client, index_name, query, new_label, wait_for_completion=True):
     """
     Updates the DOCUMENT_LABELS field in Elasticsearch by adding a new value to the list using update_by_query.
 
@@ -130,17 +187,13 @@ def append_document_label_query(es_client, index_name, query, new_label):
     :param index_name: Name of the Elasticsearch index
     :param query: Query to find matching documents
     :param new_label: Label to add to the DOCUMENT_LABELS field
+    :param wait_for_completion: If False, returns immediately with the ID of the update task (see
+        :func:`update_by_query_options`)
     :return: Elasticsearch response
     """
     update_body = {
         "script": {
-            "source": f"""
-                if (ctx._source.{DOCUMENT_LABELS} == null) {{
-                    ctx._source.{DOCUMENT_LABELS} = [params.new_label];
-                }} else if (!ctx._source.{DOCUMENT_LABELS}.contains(params.new_label)) {{
-                    ctx._source.{DOCUMENT_LABELS}.add(params.new_label);
-                }}
-            """,
+            "source": APPEND_LABEL_SCRIPT,
             "params": {
                 "new_label": new_label
             }
@@ -149,7 +202,7 @@ def append_document_label_query(es_client, index_name, query, new_label):
     }
 
     # Perform the update_by_query to update all matching documents
-    response = es_client.update_by_query(index=index_name, body=update_body)
+    response = es_client.update_by_query(index=index_name, body=update_body, **update_by_query_options(wait_for_completion))
     # print(f"Documents updated: {response['updated']}")
     return response
 
@@ -166,13 +219,7 @@ def append_document_label_id(es_client, index_name, doc_id, new_label):
     """
     update_body = {
         "script": {
-            "source": f"""
-                if (ctx._source.{DOCUMENT_LABELS} == null) {{
-                    ctx._source.{DOCUMENT_LABELS} = [params.new_label];
-                }} else if (!ctx._source.{DOCUMENT_LABELS}.contains(params.new_label)) {{
-                    ctx._source.{DOCUMENT_LABELS}.add(params.new_label);
-                }}
-            """,
+            "source": APPEND_LABEL_SCRIPT,
             "params": {
                 "new_label": new_label
             }
@@ -207,7 +254,7 @@ def update_document_relevance_id(es_client, index_name, doc_id, relevance_value)
     return response
 
 
-def update_document_relevance_query(es_client, index_name, query, document_relevance):
+def update_document_relevance_query(es_client, index_name, query, document_relevance, wait_for_completion=True):
     # Prepare the update query
     update_body = {
         "script": {
@@ -219,30 +266,258 @@ def update_document_relevance_query(es_client, index_name, query, document_relev
         "query": query["query"]  # Use the same query to match documents
     }
     # Perform the update_by_query to update the DOCUMENT_RELEVANCE field
-    response = es_client.update_by_query(index=index_name, body=update_body)
+    response = es_client.update_by_query(index=index_name, body=update_body, **update_by_query_options(wait_for_completion))
 
     #print(f"Documents updated: {response['updated']}")
     return response
 
 
+# The classification prompts are laid out so that consecutive calls share the longest possible prefix, which the LLM
+# server can reuse (e.g. Ollama keeps the evaluated prompt of the previous call in its KV cache): the task instruction
+# (always the same) is the system message, and the user message starts with the filters block (the same for all the
+# documents of a request), followed by the documents.
+
+OPENAI_CLASSIFY_INSTRUCTION = "Your task is to filter documents from an elasticsearch index based on some natural language conditions. You will receive a list of filters, which may relate to a specific document field, and an elasticsearch document. Return True if the document satisfies all the filters, and False otherwise.\n"
+
+
+def prompt_messages(instruction: str, prompt: str) -> list[dict]:
+    """
+    Builds the chat messages of a classification prompt.
+
+    :param instruction: The task instruction, sent as the system message
+    :param prompt: The filters and the document(s)
+    :return: The messages
+    """
+    return [
+        {"role": "system", "content": instruction},
+        {"role": "user", "content": prompt}
+    ]
+
+
 def run_llm_openai(llm: LLMOpenAI, prompt: str) -> bool:
     class LLMOutput(BaseModel):
         result: bool
 
-    instruction = "Your task is to filter documents from an elasticsearch index based on some natural language conditions. You will receive a list of filters, which may relate to a specific document field, and an elasticsearch document. Return True if the document satisfies all the filters, and False otherwise.\n"
     answer = llm.client.beta.chat.completions.parse(
         model=llm.name,
-        messages=[
-            {"role": "user", "content": instruction + prompt}
-        ],
+        messages=prompt_messages(OPENAI_CLASSIFY_INSTRUCTION, prompt),
         response_format=LLMOutput
     )
     return answer.choices[0].message.parsed.result
 
 
+# The Ollama answers are constrained to these JSON schemas (the model cannot write anything else, e.g. an explanation
+# before the verdict), and their length is capped with num_predict, so a verdict only takes a few generated tokens.
+
+VERDICT_SCHEMA = {
+    "type": "object",
+    "properties": {"result": {"type": "boolean"}},
+    "required": ["result"]
+}
+
+CONFIDENT_VERDICT_SCHEMA = {
+    "type": "object",
+    "properties": {"result": {"type": "boolean"}, "confidence": {"type": "number"}},
+    "required": ["result", "confidence"]
+}
+
+# Maximum number of generated tokens of a verdict, with and without confidence (per document in batch prompts)
+VERDICT_NUM_PREDICT = 16
+CONFIDENT_VERDICT_NUM_PREDICT = 24
+
+_RESULT_PATTERN = re.compile(r'"result"\s*:\s*(true|false)', re.IGNORECASE)
+
+
+def constrained_parameters(llm: LLM, schema: dict, num_predict: int) -> dict:
+    """
+    Gets the Ollama parameters of a call whose answer is constrained to a JSON schema and capped in length.
+
+    :param llm: The LLM that is called
+    :param schema: The JSON schema of the answer
+    :param num_predict: The maximum number of generated tokens
+    :return: The parameters (the LLM parameters with the format and the num_predict option)
+    """
+    options = {**(llm.parameters.get('options') or {}), 'num_predict': num_predict}
+    return {**llm.parameters, 'format': schema, 'options': options}
+
+
+def parse_verdict(answer: str) -> bool or None:
+    """
+    Parses the LLM answer to a classification prompt (see :data:`VERDICT_SCHEMA`). If the answer is not valid JSON
+    (e.g. it was cut by num_predict), the result is searched in the raw text.
+
+    :param answer: The LLM answer
+    :return: The verdict (None if the answer has no result)
+    """
+    try:
+        result = json.loads(answer)
+        if isinstance(result, dict) and isinstance(result.get('result'), bool):
+            return result['result']
+    except json.JSONDecodeError:
+        pass
+    match = _RESULT_PATTERN.search(answer)
+    return match.group(1).lower() == 'true' if match else None
+
+
+CLASSIFY_INSTRUCTION = "Your task is to filter documents from an elasticsearch index based on some natural language conditions. You will receive a list of filters, which may relate to a specific document field, and an elasticsearch document. Answer only with a JSON with this structure: {\"result\": true} if the document satisfies all the filters, and {\"result\": false} otherwise.\n"
+
+
 def run_llm(llm: LLM, prompt: str) -> bool:
-    instruction = "Your task is to filter documents from an elasticsearch index based on some natural language conditions. You will receive a list of filters, which may relate to a specific document field, and an elasticsearch document. Return a JSON with this structure: {'result': True} if the document satisfies all the filters, and {'result': False} otherwise.\nFilters:\n"
-    answer = llm.predict(instruction + prompt)
-    if 'true' in answer.lower():
-        return True
-    return False
+    answer = llm.predict(prompt, parameters=constrained_parameters(llm, VERDICT_SCHEMA, VERDICT_NUM_PREDICT),
+                         system_message=CLASSIFY_INSTRUCTION)
+    return parse_verdict(answer) or False
+
+
+CONFIDENCE_INSTRUCTION = "Your task is to filter documents from an elasticsearch index based on some natural language conditions. You will receive a list of filters, which may relate to a specific document field, and an elasticsearch document. Return a JSON with this structure: {\"result\": true, \"confidence\": 0.9}, where result is true if the document satisfies all the filters and false otherwise, and confidence is how sure you are of the result, from 0 (guessing) to 1 (certain).\n"
+
+
+def parse_confident_verdict(answer: str) -> tuple[bool or None, float]:
+    """
+    Parses the LLM answer to a classification prompt with confidence (see :data:`CONFIDENCE_INSTRUCTION`).
+
+    :param answer: The LLM answer
+    :return: The verdict (None if the answer is malformed) and its confidence (0 if it is missing or malformed)
+    """
+    try:
+        result = json.loads(answer)
+    except json.JSONDecodeError:
+        return None, 0.0
+    if not isinstance(result, dict) or not isinstance(result.get('result'), bool):
+        return None, 0.0
+    confidence = result.get('confidence')
+    if not isinstance(confidence, (int, float)) or isinstance(confidence, bool):
+        return result['result'], 0.0
+    return result['result'], min(1.0, max(0.0, float(confidence)))
+
+
+def classify_doc_with_confidence(llm: LLM, prompt: str) -> tuple[bool or None, float]:
+    """
+    Asks the LLM whether a document satisfies the request instructions, and how confident it is.
+
+    :param llm: The LLM used to classify the document
+    :param prompt: The prompt with the filters and the document
+    :return: The verdict (None if the answer is malformed) and its confidence, between 0 and 1
+    """
+    if isinstance(llm, LLMOpenAI):
+        class LLMOutput(BaseModel):
+            result: bool
+            confidence: float
+
+        answer = llm.client.beta.chat.completions.parse(
+            model=llm.name,
+            messages=prompt_messages(CONFIDENCE_INSTRUCTION, prompt),
+            response_format=LLMOutput
+        )
+        answer = answer.choices[0].message.content
+    else:
+        answer = llm.predict(prompt, parameters=constrained_parameters(llm, CONFIDENT_VERDICT_SCHEMA, CONFIDENT_VERDICT_NUM_PREDICT),
+                             system_message=CONFIDENCE_INSTRUCTION)
+    return parse_confident_verdict(answer)
+
+
+BATCH_INSTRUCTION = "Your task is to filter documents from an elasticsearch index based on some natural language conditions. You will receive a list of filters, which may relate to a specific document field, and a numbered list of elasticsearch documents. For each document, decide whether it satisfies all the filters. Return a JSON with this structure: {\"results\": [{\"id\": 1, \"result\": true}, {\"id\": 2, \"result\": false}, ...]}, with one entry for each document, using the document numbers as ids.\n"
+
+
+BATCH_CONFIDENCE_INSTRUCTION = "Your task is to filter documents from an elasticsearch index based on some natural language conditions. You will receive a list of filters, which may relate to a specific document field, and a numbered list of elasticsearch documents. For each document, decide whether it satisfies all the filters, and how sure you are, from 0 (guessing) to 1 (certain). Return a JSON with this structure: {\"results\": [{\"id\": 1, \"result\": true, \"confidence\": 0.9}, {\"id\": 2, \"result\": false, \"confidence\": 0.6}, ...]}, with one entry for each document, using the document numbers as ids.\n"
+
+
+def build_batch_prompt(prompt_filters: str, prompt_docs: list[dict]) -> str:
+    """
+    Builds the prompt to classify several documents with a single LLM call (the task instruction, BATCH_INSTRUCTION,
+    is sent apart as the system message).
+
+    :param prompt_filters: The filters block of the prompt (see :func:`build_prompt_filters`)
+    :param prompt_docs: The documents to classify (see :func:`build_prompt_doc`)
+    :return: The prompt
+    """
+    prompt = prompt_filters
+    for i, prompt_doc in enumerate(prompt_docs):
+        prompt += f"Document {i+1}:\n{prompt_doc}\n"
+    return prompt
+
+
+def parse_batch_verdicts(answer: str, num_docs: int, min_confidence: float = None) -> dict[int, bool]:
+    """
+    Parses the LLM answer to a batch classification prompt. Malformed entries are ignored.
+
+    :param answer: The LLM answer
+    :param num_docs: The number of documents in the batch
+    :param min_confidence: If given, the entries with a lower (or without) confidence are ignored too
+    :return: The verdicts that could be parsed, by document position in the batch (starting from 0)
+    """
+    try:
+        results = json.loads(answer)
+    except json.JSONDecodeError:
+        return {}
+    if isinstance(results, dict):
+        results = results.get('results')
+    if not isinstance(results, list):
+        return {}
+    verdicts = {}
+    for result in results:
+        if not isinstance(result, dict):
+            continue
+        doc_id = result.get('id')
+        verdict = result.get('result')
+        if min_confidence is not None:
+            confidence = result.get('confidence')
+            if not isinstance(confidence, (int, float)) or isinstance(confidence, bool) or confidence < min_confidence:
+                continue
+        if isinstance(doc_id, int) and 1 <= doc_id <= num_docs and isinstance(verdict, bool):
+            verdicts[doc_id - 1] = verdict
+    return verdicts
+
+
+def classify_batch(llm: LLM, prompt_filters: str, prompt_docs: list[dict], min_confidence: float = None) -> dict[int, bool]:
+    """
+    Asks the LLM whether each document of a batch satisfies the request instructions, with a single call.
+
+    The answer may be partial (e.g. if the model skips some documents or returns malformed entries), so the caller
+    is responsible for classifying the missing documents individually.
+
+    :param llm: The LLM used to classify the documents
+    :param prompt_filters: The filters block of the prompt (see :func:`build_prompt_filters`)
+    :param prompt_docs: The documents to classify (see :func:`build_prompt_doc`)
+    :param min_confidence: If given, the LLM also rates its confidence in each verdict, and the verdicts with a lower
+        confidence are left out of the result (as missing)
+    :return: The verdicts, by document position in the batch (starting from 0)
+    """
+    instruction = BATCH_INSTRUCTION if min_confidence is None else BATCH_CONFIDENCE_INSTRUCTION
+    prompt = build_batch_prompt(prompt_filters, prompt_docs)
+    if isinstance(llm, LLMOpenAI):
+        class LLMVerdict(BaseModel):
+            id: int
+            result: bool
+
+        class LLMConfidentVerdict(LLMVerdict):
+            confidence: float
+
+        class LLMOutput(BaseModel):
+            results: list[LLMVerdict if min_confidence is None else LLMConfidentVerdict]
+
+        answer = llm.client.beta.chat.completions.parse(
+            model=llm.name,
+            messages=prompt_messages(instruction, prompt),
+            response_format=LLMOutput
+        )
+        answer = answer.choices[0].message.content
+    else:
+        verdict_schema = VERDICT_SCHEMA if min_confidence is None else CONFIDENT_VERDICT_SCHEMA
+        schema = {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"id": {"type": "integer"}, **verdict_schema["properties"]},
+                        "required": ["id", *verdict_schema["required"]]
+                    }
+                }
+            },
+            "required": ["results"]
+        }
+        verdict_tokens = VERDICT_NUM_PREDICT if min_confidence is None else CONFIDENT_VERDICT_NUM_PREDICT
+        num_predict = verdict_tokens * (len(prompt_docs) + 1)
+        answer = llm.predict(prompt, parameters=constrained_parameters(llm, schema, num_predict), system_message=instruction)
+    return parse_batch_verdicts(answer, len(prompt_docs), min_confidence)
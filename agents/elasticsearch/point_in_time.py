@@ -0,0 +1,155 @@
+import threading
+from typing import Generator
+
+from besser.agent.exceptions.logger import logger
+from elasticsearch import ApiError
+
+# Sort on the internal shard/doc order: the cheapest sort for a point in time, and a valid tiebreaker for search_after
+PIT_SORT = [{'_shard_doc': 'asc'}]
+
+
+def keep_alive_seconds(keep_alive: str) -> float:
+    """
+    Converts an Elasticsearch time unit (e.g. '30s', '5m', '1h') into seconds.
+
+    :param keep_alive: The time value
+    :return: The number of seconds
+    """
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    for unit in sorted(units, key=len, reverse=True):
+        if keep_alive.endswith(unit):
+            return float(keep_alive[:-len(unit)]) * units[unit]
+    return float(keep_alive)
+
+
+class PointInTimeScanner:
+    """Scans all the documents matching a query with a point in time (PIT) and ``search_after`` pagination.
+
+    Unlike a scroll, a PIT can be read by several consumers: with ``slices`` > 1 the result set is partitioned into
+    disjoint slices, and each one can be scanned by a different worker with :meth:`pages`. While the scanner is open,
+    a background thread renews the PIT keep-alive periodically, so it does not expire when the consumers are slow.
+
+    Use it as a context manager (or call :meth:`open` and :meth:`close`). To resume a previous scan, pass its
+    ``pit_id``: it is reused if it has not expired yet (see :attr:`reused`), otherwise a new PIT is opened.
+
+    Args:
+        es_client: Elasticsearch client instance
+        index_name (str): name of the Elasticsearch index
+        query (dict): query to find matching documents
+        page_size (int): number of documents per page
+        keep_alive (str): time the PIT is kept alive between requests (e.g. '1m')
+        slices (int): number of disjoint slices the result set is split into
+        source_includes (list[str]): if set, only these fields of the documents' ``_source`` are retrieved
+        pit_id (str): the ID of an existing PIT to reuse
+
+    Attributes:
+        pit_id (str): the current PIT ID
+        total_docs (int): number of documents matching the query in the PIT
+        reused (bool): whether the given PIT could be reused
+    """
+
+    def __init__(
+            self,
+            es_client,
+            index_name: str,
+            query: dict,
+            page_size: int = 100,
+            keep_alive: str = '1m',
+            slices: int = 1,
+            source_includes: list[str] = None,
+            pit_id: str = None
+    ):
+        self.es_client = es_client
+        self.index_name: str = index_name
+        self.query: dict = query
+        self.page_size: int = page_size
+        self.keep_alive: str = keep_alive
+        self.slices: int = max(1, slices)
+        self.source_includes: list[str] = source_includes
+        self.pit_id: str = pit_id
+        self.total_docs: int = 0
+        self.reused: bool = False
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._renewal_thread: threading.Thread = None
+
+    def __enter__(self) -> 'PointInTimeScanner':
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def open(self) -> None:
+        """Open the PIT, count the matching documents and start renewing the keep-alive in the background."""
+        self._closed.clear()
+        response = None
+        if self.pit_id:
+            try:
+                response = self._search({**self.query, 'size': 0, 'track_total_hits': True})
+                self.reused = True
+            except ApiError as e:
+                logger.info(f'Point in time could not be reused, opening a new one: {e}')
+        if response is None:
+            self.pit_id = self.es_client.open_point_in_time(index=self.index_name, keep_alive=self.keep_alive)['id']
+            response = self._search({**self.query, 'size': 0, 'track_total_hits': True})
+        self.total_docs = response['hits']['total']['value']
+        self._renewal_thread = threading.Thread(target=self._renew, name='pit-keep-alive', daemon=True)
+        self._renewal_thread.start()
+
+    def close(self) -> None:
+        """Stop renewing the keep-alive and release the PIT."""
+        if self.pit_id is None:
+            return
+        self._closed.set()
+        self._renewal_thread.join()
+        try:
+            self.es_client.close_point_in_time(id=self.pit_id)
+        except Exception as e:
+            # The PIT will expire by itself after the keep-alive
+            logger.warning(f'Point in time could not be closed: {e}')
+        self.pit_id = None
+
+    def pages(self, slice_id: int = None, search_after: list = None) -> Generator[list[dict], None, None]:
+        """Iterate over the pages of documents of the PIT (or of one of its slices).
+
+        Each hit contains its ``sort`` value, which can be used as ``search_after`` to resume the scan after it.
+
+        Args:
+            slice_id (int): the slice to scan (only when the scanner has more than 1 slice)
+            search_after (list): sort value of the last processed document, to resume a scan
+
+        Returns:
+            Generator[list[dict], None, None]: the non-empty pages of hits
+        """
+        body = {**self.query, 'size': self.page_size, 'sort': PIT_SORT, 'track_total_hits': False}
+        if self.source_includes is not None:
+            body['_source'] = {'includes': self.source_includes}
+        if self.slices > 1:
+            body['slice'] = {'id': slice_id, 'max': self.slices}
+        while True:
+            if search_after:
+                body['search_after'] = search_after
+            hits = self._search(body)['hits']['hits']
+            if not hits:
+                return
+            yield hits
+            search_after = hits[-1]['sort']
+
+    def _search(self, body: dict) -> dict:
+        with self._lock:
+            pit = {'id': self.pit_id, 'keep_alive': self.keep_alive}
+        response = self.es_client.search(body={**body, 'pit': pit})
+        with self._lock:
+            # The PIT ID can change between requests, always use the most recent one
+            self.pit_id = response.get('pit_id', self.pit_id)
+        return response
+
+    def _renew(self) -> None:
+        interval = keep_alive_seconds(self.keep_alive) / 2
+        while not self._closed.wait(interval):
+            try:
+                # Any search on the PIT extends its keep-alive
+                self._search({'size': 0, 'track_total_hits': False})
+            except Exception as e:
+                logger.warning(f'Point in time keep-alive could not be renewed: {e}')
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Any
+
+
+def query_fingerprint(index_name: str, kind: str, query: dict) -> str:
+    """
+    Computes a canonical fingerprint of a query: equivalent queries (same clauses, keys in any order) have the same
+    fingerprint.
+
+    :param index_name: Name of the Elasticsearch index
+    :param kind: The kind of cached result (e.g. 'count')
+    :param query: The query
+    :return: The fingerprint
+    """
+    canonical = json.dumps([index_name, kind, query], sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def get_index_generation(es_client, index_name: str) -> tuple:
+    """
+    Gets the generation of an index: it changes whenever documents are indexed, updated or deleted, or the index is
+    refreshed, i.e. whenever the results of a query may have changed.
+
+    :param es_client: Elasticsearch client instance
+    :param index_name: Name of the Elasticsearch index
+    :return: The generation
+    """
+    stats = es_client.indices.stats(index=index_name, metric=['indexing', 'refresh'])['_all']['primaries']
+    return stats['indexing']['index_total'], stats['indexing']['delete_total'], stats['refresh']['external_total']
+
+
+class QueryCache:
+    """An in-memory cache of query results (e.g. hit counts), shared by all sessions.
+
+    Results are keyed by the fingerprint of the query (see :func:`query_fingerprint`) and are only valid for the
+    index generation they were computed on (see :func:`get_index_generation`), so a cached result is never used after
+    the index changes. Besides, results expire after ``ttl`` seconds, the least recently used are evicted when the
+    cache has more than ``max_entries``, and :meth:`invalidate` drops the results of an index right after the agent
+    writes to it (before the index stats reflect the writes).
+
+    The cache is thread-safe.
+
+    Args:
+        max_entries (int): maximum number of cached results
+        ttl (float): time (in seconds) a result is valid
+
+    Attributes:
+        hits (int): number of lookups that found a valid cached result
+        misses (int): number of lookups that had to compute the result
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 300):
+        self.max_entries: int = max_entries
+        self.ttl: float = ttl
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock = threading.Lock()
+        # fingerprint -> (index name, index generation, time, result)
+        self._entries: OrderedDict[str, tuple[str, tuple, float, Any]] = OrderedDict()
+
+    def get(self, es_client, index_name: str, kind: str, query: dict, compute: Callable[[], Any]) -> Any:
+        """Get the result of a query from the cache, or compute and store it if it is not cached (or not valid).
+
+        Args:
+            es_client: Elasticsearch client instance
+            index_name (str): name of the Elasticsearch index
+            kind (str): the kind of result (e.g. 'count')
+            query (dict): the query
+            compute (Callable[[], Any]): the function that runs the query and returns the result
+
+        Returns:
+            Any: the result
+        """
+        key = query_fingerprint(index_name, kind, query)
+        generation = get_index_generation(es_client, index_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == generation and time.monotonic() - entry[2] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[3]
+            self.misses += 1
+        result = compute()
+        with self._lock:
+            self._entries[key] = (index_name, generation, time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def invalidate(self, index_name: str = None) -> None:
+        """Drop the cached results of an index (or of all the indices)."""
+        with self._lock:
+            if index_name is None:
+                self._entries.clear()
+                return
+            for key in [key for key, entry in self._entries.items() if entry[0] == index_name]:
+                del self._entries[key]
@@ -0,0 +1,226 @@
+import re
+import threading
+import time
+
+from app.vars import *
+
+# Relative cost of the filter clauses (the execution order of the filters in the query)
+CHEAP = 0
+MODERATE = 1
+EXPENSIVE = 2
+cost_dict = {
+    CHEAP: 'cheap',
+    MODERATE: 'moderate',
+    EXPENSIVE: 'expensive'
+}
+
+# Field types matched exactly, without analysis
+KEYWORD_TYPES = ['keyword', 'constant_keyword', 'wildcard']
+# Time (in seconds) the index mappings are cached
+_MAPPINGS_TTL = 300
+_mappings_cache: dict[str, tuple[float, dict]] = {}
+_mappings_lock = threading.Lock()
+
+
+def get_field_mappings(es_client, index_name: str) -> dict[str, dict]:
+    """
+    Gets the mappings of the fields of an index (cached for a few minutes), with the names of the object subfields
+    flattened with dots (e.g. 'FROM.name').
+
+    :param es_client: Elasticsearch client instance
+    :param index_name: Name of the Elasticsearch index
+    :return: The mapping of each field (its type, its multi-fields...)
+    """
+    with _mappings_lock:
+        cached = _mappings_cache.get(index_name)
+        if cached and time.monotonic() - cached[0] < _MAPPINGS_TTL:
+            return cached[1]
+    response = es_client.indices.get_mapping(index=index_name)
+    mappings = {}
+    # The index name may be an alias: merge the mappings of all the indices behind it
+    for index in response.values():
+        _flatten_properties(index['mappings'].get('properties', {}), '', mappings)
+    with _mappings_lock:
+        _mappings_cache[index_name] = (time.monotonic(), mappings)
+    return mappings
+
+
+def _flatten_properties(properties: dict, prefix: str, mappings: dict) -> None:
+    for name, mapping in properties.items():
+        if 'properties' in mapping:
+            _flatten_properties(mapping['properties'], f'{prefix}{name}.', mappings)
+        else:
+            mappings[f'{prefix}{name}'] = mapping
+
+
+def _get_subfield(mapping: dict, field: str, field_types: list[str]) -> str or None:
+    for name, subfield in mapping.get('fields', {}).items():
+        if subfield.get('type') in field_types:
+            return f'{field}.{name}'
+    return None
+
+
+class PlannedFilter:
+    """A request filter translated into an Elasticsearch query clause by :func:`plan_filter`.
+
+    Args:
+        field (str): the filtered field
+        operator (str): the filter operator
+        value (str): the filter value
+        clause (dict): the query clause
+        negated (bool): whether the clause must not match (it goes in the ``must_not`` part of the query)
+        cost (int): the relative cost of the clause (CHEAP, MODERATE or EXPENSIVE)
+        rewrite (str): explanation of the rewrite, if the clause differs from the direct translation of the filter
+        warning (str): explanation of the cost, if the clause is expensive
+    """
+
+    def __init__(
+            self,
+            field: str,
+            operator: str,
+            value: str,
+            clause: dict,
+            negated: bool = False,
+            cost: int = CHEAP,
+            rewrite: str = None,
+            warning: str = None
+    ):
+        self.field: str = field
+        self.operator: str = operator
+        self.value: str = value
+        self.clause: dict = clause
+        self.negated: bool = negated
+        self.cost: int = cost
+        self.rewrite: str = rewrite
+        self.warning: str = warning
+
+    def to_str(self) -> str:
+        return f'{self.field} {self.operator} {self.value} ({cost_dict[self.cost]})'
+
+
+def plan_filter(f: dict, mappings: dict[str, dict]) -> PlannedFilter:
+    """
+    Translates a request filter into a query clause, using the cheapest query equivalent to the filter that the field
+    mapping allows. Without the field mapping, the direct translation is used.
+
+    :param f: The request filter
+    :param mappings: The field mappings of the index (see :func:`get_field_mappings`)
+    :return: The planned filter
+    """
+    field, operator, value = f[FIELD], f[OPERATOR], f[VALUE]
+    mapping = mappings.get(field, {})
+    field_type = mapping.get('type')
+    if operator in [EQUALS, DIFFERENT]:
+        if field_type in KEYWORD_TYPES:
+            # On a keyword field both are exact matches, but a term query skips the analysis of the value
+            clause = {"term": {field: value}}
+            rewrite = 'term query on a keyword field'
+        else:
+            clause = {"match_phrase": {field: value}}  # This only for fields with analyzed text (SUBJECT, CONTENT)
+            rewrite = None
+        return PlannedFilter(field, operator, value, clause, negated=operator == DIFFERENT, rewrite=rewrite)
+    elif operator == CONTAINS:
+        wildcard_subfield = _get_subfield(mapping, field, ['wildcard'])
+        if field_type == 'wildcard':
+            return PlannedFilter(field, operator, value, {"wildcard": {field: f"*{value}*"}}, cost=MODERATE)
+        elif wildcard_subfield:
+            return PlannedFilter(field, operator, value, {"wildcard": {wildcard_subfield: f"*{value}*"}}, cost=MODERATE,
+                                 rewrite=f'wildcard query on the {wildcard_subfield} field, indexed for wildcards')
+        elif field_type == 'text' and len(re.findall(r'\w+', value)) > 1:
+            # The wildcard is matched against the single terms of the analyzed field, so a value made of several
+            # terms can only be found as a phrase
+            return PlannedFilter(field, operator, value, {"match_phrase": {field: value}},
+                                 rewrite='match_phrase query, since the value has several words')
+        return PlannedFilter(field, operator, value, {"wildcard": {field: f"*{value}*"}}, cost=EXPENSIVE,
+                             warning=f'"{field} {operator} {value}" uses a leading wildcard, which scans all the terms of the field')
+    elif operator == STARTS_WITH:
+        if field_type == 'text' and mapping.get('index_prefixes') is not None:
+            return PlannedFilter(field, operator, value, {"prefix": {field: value}}, rewrite='prefix query on indexed prefixes')
+        return PlannedFilter(field, operator, value, {"prefix": {field: value}}, cost=MODERATE)
+    elif operator == REGEXP:
+        warning = f'"{field} {operator} {value}" is a regular expression, which scans the terms of the field'
+        if re.match(r'^\.[*+]', value):
+            warning += ' (all of them, since it starts with a wildcard)'
+        return PlannedFilter(field, operator, value, {"regexp": {field: value}}, cost=EXPENSIVE, warning=warning)
+    elif operator == FUZZY:
+        return PlannedFilter(field, operator, value, {"fuzzy": {field: {"value": value, "fuzziness": "AUTO"}}},
+                             cost=MODERATE)
+    raise ValueError(f'Unknown operator: {operator}')
+
+
+def plan_filters(filters: list[dict], mappings: dict[str, dict]) -> list[PlannedFilter]:
+    """
+    Translates the request filters into query clauses (see :func:`plan_filter`), ordered from the cheapest to the most
+    expensive (filters of the same cost keep their order).
+
+    :param filters: The request filters
+    :param mappings: The field mappings of the index
+    :return: The planned filters
+    """
+    return sorted((plan_filter(f, mappings) for f in filters), key=lambda planned: planned.cost)
+
+
+def explain_query_plan(es_client, index_name: str, query: dict, planned_filters: list[PlannedFilter],
+                       profile_timeout: str = '2s', slow_query_time: float = 1) -> dict:
+    """
+    Validates and profiles a query, and reports its estimated cost.
+
+    The query is profiled with a timeout and without retrieving documents, so the profile itself is bounded.
+
+    :param es_client: Elasticsearch client instance
+    :param index_name: Name of the Elasticsearch index
+    :param query: The query built from the planned filters
+    :param planned_filters: The planned filters of the query
+    :param profile_timeout: Timeout of the profiled search (e.g. '2s')
+    :param slow_query_time: Time (in seconds) above which the query is reported as slow
+    :return: The plan report, with the planned filters, the rewrites, the cost warnings and the profiled time
+    """
+    report = {
+        PLAN_FILTERS: [planned.to_str() for planned in planned_filters],
+        PLAN_REWRITES: [f'{planned.field} {planned.operator} {planned.value}: {planned.rewrite}'
+                        for planned in planned_filters if planned.rewrite],
+        PLAN_WARNINGS: [planned.warning for planned in planned_filters if planned.warning],
+        PLAN_TOOK: None
+    }
+    validation = es_client.indices.validate_query(index=index_name, body={"query": query["query"]}, explain=True)
+    if not validation['valid']:
+        errors = [explanation.get('error') for explanation in validation.get('explanations', []) if explanation.get('error')]
+        report[PLAN_WARNINGS].append(f'The filters are not valid: {errors[0] if errors else validation.get("error")}')
+        return report
+    response = es_client.search(
+        index=index_name,
+        body={**query, "size": 0, "profile": True, "timeout": profile_timeout, "track_total_hits": True}
+    )
+    took = response['took'] / 1000
+    report[PLAN_TOOK] = took
+    if response['timed_out']:
+        warning = f'The filters take more than {profile_timeout} to run.'
+    elif took >= slow_query_time:
+        warning = f'The filters took {took:.1f} s to run.'
+    else:
+        return report
+    warning += ' Each request runs them several times (to count and to fetch the documents), consider replacing the expensive ones.'
+    slowest_clause = get_slowest_clause(response)
+    if slowest_clause:
+        warning += f' The slowest part of the query is: {slowest_clause}'
+    report[PLAN_WARNINGS].append(warning)
+    return report
+
+
+def get_slowest_clause(response: dict) -> str or None:
+    """
+    Finds the slowest clause of a profiled search, adding up its time in all the shards.
+
+    :param response: The response of a search with profile=true
+    :return: The Lucene description of the slowest clause, or None if the response has no profile
+    """
+    times = {}
+    for shard in response.get('profile', {}).get('shards', []):
+        for search in shard['searches']:
+            for query in search['query']:
+                # The clauses of a boolean query are its children
+                for clause in query.get('children', [query]):
+                    times[clause['description']] = times.get(clause['description'], 0) + clause['time_in_nanos']
+    if not times:
+        return None
+    return max(times, key=times.get)
@@ -0,0 +1,72 @@
+import time
+from typing import Callable
+
+# Throttle that pauses a task: batches wait until the task is rethrottled again (speeding up is immediate)
+PAUSED_REQUESTS_PER_SECOND = 0.000001
+
+
+class UpdateByQueryError(Exception):
+    """Raised when an update by query task fails or finishes with failed documents."""
+
+
+class UpdateByQueryTask:
+    """Tracks an update by query running in the background as an Elasticsearch task (started with
+    ``wait_for_completion=false``), polling its status with the Tasks API.
+
+    The task can be paused (it is rethrottled so that no more batches run), continued and cancelled from other
+    threads while :meth:`wait` is polling it.
+
+    Args:
+        es_client: Elasticsearch client instance
+        task_id (str): the ID of the task (returned by the update by query)
+        poll_interval (float): time (in seconds) between status polls
+
+    Attributes:
+        status (dict): the last polled status of the task (with the total, updated, noops, version_conflicts... counts)
+        response (dict): the final result of the task, once completed
+        cancelled (bool): whether the task was cancelled before processing all the documents
+    """
+
+    def __init__(self, es_client, task_id: str, poll_interval: float = 1):
+        self.es_client = es_client
+        self.task_id: str = task_id
+        self.poll_interval: float = poll_interval
+        self.status: dict = {}
+        self.response: dict = None
+        self.cancelled: bool = False
+
+    def wait(self, on_progress: Callable[[dict], None] = None) -> dict:
+        """Poll the task until it completes. Blocks the caller.
+
+        Args:
+            on_progress (Callable[[dict], None]): function called with the status of the task after every poll
+
+        Returns:
+            dict: the final result of the task
+        """
+        while True:
+            task = self.es_client.tasks.get(task_id=self.task_id)
+            self.status = task['task'].get('status', {})
+            if task.get('completed'):
+                break
+            if on_progress:
+                on_progress(self.status)
+            time.sleep(self.poll_interval)
+        if 'error' in task:
+            raise UpdateByQueryError(f"Update by query task {self.task_id} failed: {task['error'].get('reason', task['error'])}")
+        self.response = task['response']
+        self.cancelled = bool(self.response.get('canceled'))
+        if self.response.get('failures'):
+            raise UpdateByQueryError(f"{len(self.response['failures'])} documents could not be updated by task "
+                                     f"{self.task_id}: {self.response['failures'][0]}")
+        return self.response
+
+    def pause(self) -> None:
+        # Slowing down takes effect after the current batch
+        self.es_client.update_by_query_rethrottle(task_id=self.task_id, requests_per_second=PAUSED_REQUESTS_PER_SECOND)
+
+    def unpause(self) -> None:
+        self.es_client.update_by_query_rethrottle(task_id=self.task_id, requests_per_second=-1)
+
+    def cancel(self) -> None:
+        self.es_client.tasks.cancel(task_id=self.task_id)
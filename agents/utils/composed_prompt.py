@@ -1,15 +1,16 @@
-import json
 import re
 
 from besser.agent.core.session import Session
 from besser.agent.nlp.llm.llm import LLM
 
 from agents.chat_files_agent.chat_data import Chat
+from agents.utils.progress_reporter import ProgressReporter
 from agents.utils.token_count import token_count
 from app.vars import *
 
 
-def composed_prompt(session: Session, llm: LLM, chat: Chat, max_tokens: int, tokenizer, chunk_prompt: str, final_prompt: str = None, overlap: int = 0):
+def composed_prompt(session: Session, llm: LLM, chat: Chat, max_tokens: int, tokenizer, chunk_prompt: str, final_prompt: str = None, overlap: int = 0, progress_max_rate: float = 2):
+    progress = ProgressReporter(session, progress_max_rate)
     chunk_answers: list[str] = []
     total_messages = chat.num_messages()
     start_message: int = 0
@@ -19,10 +20,11 @@ def composed_prompt(session: Session, llm: LLM, chat: Chat, max_tokens: int, tok
         chat_str, end_message = chat.to_prompt_format(start_message, max_tokens - chunk_prompt_tokens, tokenizer)
         if end_message < total_messages - 1 or start_message > 0:
             # Only show progress bar when there are > 1 chunks
-            session.reply(json.dumps({TOTAL_MESSAGES: total_messages, PROCESSED_MESSAGES: start_message, FINISHED: False}))
+            progress.update({TOTAL_MESSAGES: total_messages, PROCESSED_MESSAGES: start_message})
         chunk_answers.append(llm.predict(
             system_message=chunk_prompt,
-            message=chat_str
+            message=chat_str,
+            session=session
         ))
         if (start_message >= end_message - overlap) or (end_message == total_messages - 1):
             # Finished
@@ -38,11 +40,12 @@ def composed_prompt(session: Session, llm: LLM, chat: Chat, max_tokens: int, tok
         # TODO: CHECK LENGTH OF FINAL MESSAGE < MAX_TOKENS
         answer = llm.predict(
             system_message=final_prompt,
-            message=final_message
+            message=final_message,
+            session=session
         )
     else:
         answer = chunk_answers
-    session.reply(json.dumps({TOTAL_MESSAGES: total_messages, PROCESSED_MESSAGES: total_messages, FINISHED: True}))
+    progress.finish({TOTAL_MESSAGES: total_messages, PROCESSED_MESSAGES: total_messages})
     return answer
 
 
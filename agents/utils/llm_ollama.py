@@ -1,6 +1,12 @@
 from __future__ import annotations
 
 import json
+import threading
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from contextvars import ContextVar
 from typing import TYPE_CHECKING
 
 from besser.agent import Property
@@ -10,24 +16,268 @@ from besser.agent.nlp import SECTION_NLP
 from besser.agent.nlp.intent_classifier.intent_classifier_prediction import IntentClassifierPrediction
 from besser.agent.nlp.llm.llm import LLM
 
+from agents.utils.ollama_pool import OllamaPool, parse_hosts, shared_pool, is_host_error, is_ollama_error
+
 if TYPE_CHECKING:
     from besser.agent.core.agent import Agent
     from besser.agent.core.session import Session
     from besser.agent.nlp.intent_classifier.llm_intent_classifier import LLMIntentClassifier
 
-try:
-    from ollama import Client
-except ImportError:
-    logger.warning("ollama dependencies in LLMOllama could not be imported. You can install them from the "
-                   "requirements/requirements-llm.txt file")
-
 
 OLLAMA_MODEL = Property(SECTION_NLP, 'nlp.ollama.model', str, None)
 OLLAMA_HOST = Property(SECTION_NLP, 'nlp.ollama.host', str, 'localhost')
 OLLAMA_PORT = Property(SECTION_NLP, 'nlp.ollama.port', int, 11434)
+OLLAMA_HOSTS = Property(SECTION_NLP, 'nlp.ollama.hosts', str, None)
+OLLAMA_MAX_FAILURES = Property(SECTION_NLP, 'nlp.ollama.max_failures', int, 3)
+OLLAMA_EJECTION_TIME = Property(SECTION_NLP, 'nlp.ollama.ejection_time', float, 30.0)
+OLLAMA_MIN_CONCURRENCY = Property(SECTION_NLP, 'nlp.ollama.min_concurrency', int, 1)
+OLLAMA_MAX_CONCURRENCY = Property(SECTION_NLP, 'nlp.ollama.max_concurrency', int, 8)
+OLLAMA_QUEUE_TOLERANCE = Property(SECTION_NLP, 'nlp.ollama.queue_tolerance', float, 0.5)
+OLLAMA_TIMEOUT = Property(SECTION_NLP, 'nlp.ollama.timeout', float, 300.0)
+OLLAMA_MAX_RETRIES = Property(SECTION_NLP, 'nlp.ollama.max_retries', int, 2)
+OLLAMA_HEDGE_PERCENTILE = Property(SECTION_NLP, 'nlp.ollama.hedge_percentile', float, 0.0)
 OLLAMA_MAX_TOKENS = Property(SECTION_NLP, 'nlp.ollama.max_tokens', int, 3000)
+OLLAMA_KEEP_ALIVE = Property(SECTION_NLP, 'nlp.ollama.keep_alive', str, None)
+OLLAMA_NUM_CTX = Property(SECTION_NLP, 'nlp.ollama.num_ctx', int, None)
 HF_TOKENIZER = Property(SECTION_NLP, 'nlp.hf.tokenizer', str, None)
 
+# Fields of the Ollama chat responses accumulated in the LLM stats (durations are in nanoseconds)
+STATS_FIELDS = ['total_duration', 'load_duration', 'prompt_eval_count', 'prompt_eval_duration', 'eval_count',
+                'eval_duration']
+
+# Priority classes of the LLM requests (lower values are sent first)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_INTENT = 1
+PRIORITY_BATCH = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_INTENT: 'intent classification', PRIORITY_BATCH: 'batch'}
+
+# Priority class and fair-sharing key of the LLM requests sent in the current context (see llm_request_context)
+_request_context: ContextVar[tuple[int, str] or None] = ContextVar('llm_request_context', default=None)
+
+# Maximum fraction of the requests of an LLM that are hedged (so that hedging cannot overload the servers)
+_HEDGE_BUDGET = 0.1
+# Minimum number of latencies of an LLM to compute the hedging delay
+_MIN_HEDGE_SAMPLES = 20
+# Threads running the hedged requests (the original and the duplicate)
+_hedge_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix='llm-hedge')
+
+# Limiters shared by all the LLMs of the process, by list of hosts
+_shared_limiters: dict[tuple[str, ...], 'AdaptiveLimiter'] = {}
+_shared_limiters_lock = threading.Lock()
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """
+    Gets a percentile of some values (nearest-rank).
+
+    :param sorted_values: The values, sorted (must not be empty)
+    :param p: The percentile, between 0 and 100
+    :return: The value
+    """
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+@contextmanager
+def llm_request_context(priority: int, key: str = None):
+    """
+    Sets the priority class and the fair-sharing key (e.g. a session or job ID) of the LLM requests sent within the
+    context, overriding the ones chosen by :class:`LLMOllama`. Threads started within the context do not inherit it:
+    run their tasks with ``contextvars.copy_context().run``.
+
+    :param priority: The priority class (PRIORITY_INTERACTIVE, PRIORITY_INTENT or PRIORITY_BATCH)
+    :param key: The key the requests are shared fairly by, within their priority class
+    """
+    token = _request_context.set((priority, key))
+    try:
+        yield
+    finally:
+        _request_context.reset(token)
+
+
+class _Ticket:
+    """A request waiting in :class:`AdaptiveLimiter` to be sent."""
+
+    def __init__(self):
+        self.granted: bool = False
+
+
+class AdaptiveLimiter:
+    """Schedules the requests to the Ollama servers: limits the number of concurrent requests, adapting the limit to
+    the load of the servers with AIMD (additive increase, multiplicative decrease), and decides which waiting request
+    is sent next.
+
+    Ollama runs a limited number of requests in parallel, and queues the rest: a limit too low leaves the servers
+    idle, and a limit too high only makes the requests wait in the server queue (and time out, and use memory). The
+    queueing time of a request is its latency minus the processing time reported by Ollama (model loading, prompt
+    evaluation and generation). When it exceeds ``queue_tolerance`` times the processing time, or the request fails
+    because of the server, the limit is multiplied by ``backoff`` (at most once per round of requests). Otherwise, if
+    the limit was reached, it grows by 1 for every ``limit`` successful requests. The limit thus converges to the
+    number of requests the servers actually run in parallel.
+
+    Since the servers queue few requests, the order in which the limiter sends them decides the latency: when a slot
+    is free, the waiting request of the highest priority class goes first (interactive chat, then intent
+    classification, then batch labeling), and within a class, the keys (e.g. sessions or jobs) take turns, each one
+    in request order. A large labeling job thus only delays an interactive request until the next slot is free.
+
+    The limiter is thread-safe: :meth:`acquire` blocks the caller until a request can be sent.
+
+    Args:
+        min_limit (int): the minimum (and initial) limit
+        max_limit (int): the maximum limit
+        queue_tolerance (float): the maximum queueing time of a request, relative to its processing time
+        backoff (float): the factor applied to the limit when the servers are overloaded
+        window (int): the number of latest requests used to compute the latency percentiles
+
+    Attributes:
+        limit (float): the current limit (its integer part is the maximum number of concurrent requests)
+        in_flight (int): the number of requests in progress
+        decreases (int): the number of times the limit was decreased
+        _waiting (dict[int, OrderedDict[str, deque[_Ticket]]]): the waiting requests, by priority class and key (the
+            key of the next turn first)
+    """
+
+    def __init__(self, min_limit: int = 1, max_limit: int = 8, queue_tolerance: float = 0.5, backoff: float = 0.75,
+                 window: int = 200):
+        self.min_limit: int = max(1, min_limit)
+        self.max_limit: int = max(self.min_limit, max_limit)
+        self.queue_tolerance: float = queue_tolerance
+        self.backoff: float = backoff
+        self.limit: float = float(self.min_limit)
+        self.in_flight: int = 0
+        self.decreases: int = 0
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._last_decrease: float = 0.0
+        self._waiting: dict[int, OrderedDict[str, deque[_Ticket]]] = {}
+        self._wait_times: dict[int, list[float]] = {priority: [0.0, 0] for priority in PRIORITY_NAMES}
+        self._condition = threading.Condition()
+
+    def acquire(self, priority: int = PRIORITY_INTERACTIVE, key: str = None) -> float:
+        """Wait until a request can be sent.
+
+        Args:
+            priority (int): the priority class of the request
+            key (str): the key the requests of the class are shared fairly by
+
+        Returns:
+            float: the start time of the request (``time.monotonic()``), to be passed to :meth:`release`
+        """
+        with self._condition:
+            queued = time.monotonic()
+            ticket = _Ticket()
+            self._waiting.setdefault(priority, OrderedDict()).setdefault(key, deque()).append(ticket)
+            self._dispatch()
+            while not ticket.granted:
+                self._condition.wait()
+            start = time.monotonic()
+            wait_time = self._wait_times.setdefault(priority, [0.0, 0])
+            wait_time[0] += start - queued
+            wait_time[1] += 1
+            return start
+
+    def release(self, start: float, processing_time: float = None, failed: bool = False) -> None:
+        """Record the end of a request and adapt the limit.
+
+        Args:
+            start (float): the start time of the request, returned by :meth:`acquire`
+            processing_time (float): the processing time (in seconds) reported by the server, if any
+            failed (bool): whether the request failed because of the server
+        """
+        latency = time.monotonic() - start
+        overloaded = failed or (bool(processing_time) and latency - processing_time > self.queue_tolerance * processing_time)
+        with self._condition:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if not failed:
+                self._latencies.append(latency)
+            previous = int(self.limit)
+            if overloaded:
+                # The requests sent before the last decrease do not reflect it yet
+                if start >= self._last_decrease:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = time.monotonic()
+                    self.decreases += 1
+            elif saturated:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if int(self.limit) != previous:
+                logger.info(f'LLM concurrency limit: {previous} -> {int(self.limit)} '
+                            f'(latency {latency:.2f} s{", overloaded" if overloaded else ""})')
+            self._dispatch()
+
+    def cancel(self) -> None:
+        """Free the slot of a request acquired but not sent (it does not adapt the limit)."""
+        with self._condition:
+            self.in_flight -= 1
+            self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Grant the free slots to the next waiting requests. Must be called with the lock held."""
+        granted = False
+        while self.in_flight < int(self.limit):
+            ticket = self._next_ticket()
+            if ticket is None:
+                break
+            ticket.granted = True
+            self.in_flight += 1
+            granted = True
+        if granted:
+            self._condition.notify_all()
+
+    def _next_ticket(self) -> _Ticket or None:
+        for priority in sorted(self._waiting):
+            queues = self._waiting[priority]
+            if queues:
+                key, tickets = next(iter(queues.items()))
+                ticket = tickets.popleft()
+                # The key takes its next turn after the other keys of the class
+                del queues[key]
+                if tickets:
+                    queues[key] = tickets
+                return ticket
+        return None
+
+    def get_stats(self) -> dict[str, float]:
+        """Get the current limit and the latency percentiles of the latest requests.
+
+        Returns:
+            dict[str, float]: the limit, the requests in progress, the number of decreases, the 50th, 90th and 99th
+            latency percentiles (in seconds, None without requests), and by priority class name, the number of
+            waiting requests (``waiting``) and the mean time (in seconds) the requests waited to be sent
+            (``mean_wait``, None without requests)
+        """
+        with self._condition:
+            latencies = sorted(self._latencies)
+            stats = {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'decreases': self.decreases,
+                'waiting': {PRIORITY_NAMES.get(priority, str(priority)): sum(len(tickets) for tickets in queues.values())
+                            for priority, queues in self._waiting.items()},
+                'mean_wait': {PRIORITY_NAMES.get(priority, str(priority)): total / count if count else None
+                              for priority, (total, count) in self._wait_times.items()}
+            }
+        for p in [50, 90, 99]:
+            stats[f'p{p}'] = percentile(latencies, p) if latencies else None
+        return stats
+
+
+def shared_limiter(hosts: list[str], min_limit: int = 1, max_limit: int = 8,
+                   queue_tolerance: float = 0.5) -> AdaptiveLimiter:
+    """
+    Gets the concurrency limiter of some Ollama hosts shared by all the LLMs of the process (created on the first
+    call), so that the requests of all the models and agents count towards the same limit.
+
+    :param hosts: The host URLs
+    :param min_limit: See :class:`AdaptiveLimiter` (only used when the limiter is created)
+    :param max_limit: See :class:`AdaptiveLimiter` (only used when the limiter is created)
+    :param queue_tolerance: See :class:`AdaptiveLimiter` (only used when the limiter is created)
+    :return: The limiter
+    """
+    key = tuple(hosts)
+    with _shared_limiters_lock:
+        if key not in _shared_limiters:
+            _shared_limiters[key] = AdaptiveLimiter(min_limit, max_limit, queue_tolerance)
+        return _shared_limiters[key]
+
 
 class LLMOllama(LLM):
     """An LLM wrapper for Ollama's LLMs.
@@ -40,8 +290,24 @@ class LLMOllama(LLM):
             to add to the prompt context (must be > 0). Necessary a connection to
             :class:`~besser.agent.db.monitoring_db.MonitoringDB`.
         global_context (str): the global context to be provided to the LLM for each request
+        keep_alive (str): how long Ollama keeps the model loaded after a request (e.g. ``10m``, or ``-1`` to keep it
+            loaded forever). If None, the ``nlp.ollama.keep_alive`` property is used (or the Ollama server default)
+        num_ctx (int): the size of the context window of the model. If None, the ``nlp.ollama.num_ctx`` property is
+            used (or the model default)
+        hosts (list[str]): the Ollama servers (``host:port``) the requests are balanced across. If None, the
+            ``nlp.ollama.hosts`` property is used or, if empty, the ``nlp.ollama.host`` and ``nlp.ollama.port``
+            properties
+        hedge_percentile (float): if > 0, a request that takes longer than this percentile of the latencies of the
+            LLM is duplicated (hedged), and the first answer is used. If None, the ``nlp.ollama.hedge_percentile``
+            property is used
+        priority (int): the priority class of the ``predict`` requests sent without session nor
+            :func:`llm_request_context` (e.g. PRIORITY_BATCH for an LLM used to label documents). The requests with a
+            session are interactive, and the intent classification requests have PRIORITY_INTENT
 
     Attributes:
+        client (OllamaPool): the pool of Ollama servers, shared by all the LLMs with the same servers
+        limiter (AdaptiveLimiter): the scheduler of the requests to the servers, shared by all the LLMs (of all the
+            agents) with the same servers
         _nlp_engine (NLPEngine): the NLPEngine that handles the NLP processes of the agent the LLM belongs to
         name (str): the LLM name
         parameters (dict): the LLM parameters
@@ -50,13 +316,27 @@ class LLMOllama(LLM):
             :class:`~besser.agent.db.monitoring_db.MonitoringDB`.
         _global_context (str): the global context to be provided to the LLM for each request
         _user_context (dict): user specific context to be provided to the LLM for each request
+        keep_alive (str | float): how long Ollama keeps the model loaded after a request
+        num_ctx (int): the size of the context window of the model
+        _stats (dict): the accumulated timings and token counts of the LLM calls (see :meth:`get_stats`)
+        _latencies (deque[float]): the latencies (in seconds) of the latest successful requests
     """
 
     def __init__(self, agent: 'Agent', name: str, parameters: dict, num_previous_messages: int = 1,
-                 global_context: str = None):
+                 global_context: str = None, keep_alive: str = None, num_ctx: int = None, hosts: list[str] = None,
+                 hedge_percentile: float = None, priority: int = PRIORITY_INTERACTIVE):
         super().__init__(agent.nlp_engine, name, parameters, global_context=global_context)
-        self.client: Client = None
+        self.client: OllamaPool = None
+        self.limiter: AdaptiveLimiter = None
+        self.hosts: list[str] = hosts
         self.num_previous_messages: int = num_previous_messages
+        self.keep_alive: str | float = keep_alive
+        self.num_ctx: int = num_ctx
+        self.hedge_percentile: float = hedge_percentile
+        self.priority: int = priority
+        self._stats: dict[str, int] = {'calls': 0, 'hedges': 0, 'hedge_wins': 0, **{field: 0 for field in STATS_FIELDS}}
+        self._latencies: deque[float] = deque(maxlen=200)
+        self._stats_lock = threading.Lock()
 
     def set_model(self, name: str) -> None:
         """Set the LLM model name.
@@ -75,8 +355,140 @@ class LLMOllama(LLM):
         self.num_previous_messages = num_previous_messages
 
     def initialize(self) -> None:
-        url = f'{self._nlp_engine.get_property(OLLAMA_HOST)}:{self._nlp_engine.get_property(OLLAMA_PORT)}'
-        self.client = Client(host=url)
+        port = self._nlp_engine.get_property(OLLAMA_PORT)
+        if self.hosts is None:
+            self.hosts = parse_hosts(self._nlp_engine.get_property(OLLAMA_HOSTS) or '', port)
+        if not self.hosts:
+            self.hosts = [f'{self._nlp_engine.get_property(OLLAMA_HOST)}:{port}']
+        self.client = shared_pool(
+            self.hosts,
+            max_failures=self._nlp_engine.get_property(OLLAMA_MAX_FAILURES),
+            ejection_time=self._nlp_engine.get_property(OLLAMA_EJECTION_TIME),
+            timeout=self._nlp_engine.get_property(OLLAMA_TIMEOUT) or None,
+            max_retries=self._nlp_engine.get_property(OLLAMA_MAX_RETRIES)
+        )
+        self.limiter = shared_limiter(
+            self.hosts,
+            min_limit=self._nlp_engine.get_property(OLLAMA_MIN_CONCURRENCY),
+            max_limit=self._nlp_engine.get_property(OLLAMA_MAX_CONCURRENCY),
+            queue_tolerance=self._nlp_engine.get_property(OLLAMA_QUEUE_TOLERANCE)
+        )
+        if self.keep_alive is None:
+            self.keep_alive = self._nlp_engine.get_property(OLLAMA_KEEP_ALIVE) or None
+        if isinstance(self.keep_alive, str):
+            try:
+                # Ollama only accepts durations with units (e.g. '10m') or numbers of seconds
+                self.keep_alive = float(self.keep_alive)
+            except ValueError:
+                pass
+        if self.num_ctx is None:
+            self.num_ctx = self._nlp_engine.get_property(OLLAMA_NUM_CTX)
+        if self.hedge_percentile is None:
+            self.hedge_percentile = self._nlp_engine.get_property(OLLAMA_HEDGE_PERCENTILE)
+
+    def get_stats(self) -> dict[str, int]:
+        """Get the accumulated timings (in nanoseconds) and token counts of the calls to the LLM.
+
+        ``prompt_eval_count`` only counts the prompt tokens Ollama had to evaluate: the prefix shared with the previous
+        prompt (kept in the KV cache of the model) is reused, so comparing it with the prompt size measures the prefix
+        reuse.
+
+        Returns:
+            dict[str, int]: the number of calls (including the hedges), the number of hedged calls and how many of
+            them were answered first by the hedge, and the sum of each field of :data:`STATS_FIELDS`
+        """
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _schedule(self, session: 'Session' = None, priority: int = None) -> tuple[int, str]:
+        """Get the priority class and the fair-sharing key of a request: the ones of the current
+        :func:`llm_request_context` if any, else interactive requests shared by session if the request comes from a
+        session, else ``priority`` (or the default priority of the LLM)."""
+        context = _request_context.get()
+        if context is not None:
+            return context
+        if session is not None:
+            return PRIORITY_INTERACTIVE, session.id
+        return self.priority if priority is None else priority, None
+
+    def _chat(self, messages: list[dict], parameters: dict, schedule: tuple[int, str], **kwargs):
+        """Send a chat request to Ollama, with the keep_alive and context options of the LLM, hedging it if it takes
+        too long (see ``hedge_percentile``). ``schedule`` is the priority class and fair-sharing key of the request
+        (see :meth:`_schedule`)."""
+        parameters = {**parameters, **kwargs}
+        if self.num_ctx:
+            parameters['options'] = {'num_ctx': self.num_ctx, **(parameters.get('options') or {})}
+        if self.keep_alive is not None:
+            parameters.setdefault('keep_alive', self.keep_alive)
+        delay = self._hedge_delay()
+        if delay is None:
+            return self._send(messages, parameters, schedule)
+        original = _hedge_executor.submit(self._send, messages, parameters, schedule)
+        done, _ = wait([original], timeout=delay)
+        if done or not self._take_hedge():
+            return original.result()
+        # The slower request is not interrupted (it keeps its slot until it finishes or times out), so the hedge is not
+        # sent if the original request finishes while the hedge waits for the concurrency limiter
+        answered = threading.Event()
+        hedge = _hedge_executor.submit(self._send, messages, parameters, schedule, answered)
+        pending = {original, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    answered.set()
+                    if future is hedge:
+                        with self._stats_lock:
+                            self._stats['hedge_wins'] += 1
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def _send(self, messages: list[dict], parameters: dict, schedule: tuple[int, str],
+              cancelled: threading.Event = None):
+        """Send a chat request to Ollama and record its stats. Blocks until the limiter schedules the request (if
+        ``cancelled`` is set by then, the request is not sent and None is returned)."""
+        start = self.limiter.acquire(*schedule)
+        if cancelled is not None and cancelled.is_set():
+            self.limiter.cancel()
+            return None
+        try:
+            response = self.client.chat(model=self.name, messages=messages, **parameters)
+        except Exception as e:
+            if is_ollama_error(e):
+                self.limiter.release(start, failed=is_host_error(e))
+            else:
+                # The server did not take part, so the limit is not adapted
+                self.limiter.cancel()
+            raise
+        latency = time.monotonic() - start
+        processing_time = sum(response.get(field) or 0
+                              for field in ['load_duration', 'prompt_eval_duration', 'eval_duration']) / 1e9
+        self.limiter.release(start, processing_time=processing_time)
+        with self._stats_lock:
+            self._stats['calls'] += 1
+            for field in STATS_FIELDS:
+                self._stats[field] += response.get(field) or 0
+            self._latencies.append(latency)
+        return response
+
+    def _hedge_delay(self) -> float or None:
+        """Get the time after which a request is hedged (None if hedging is disabled or there are too few latencies)."""
+        if not self.hedge_percentile:
+            return None
+        with self._stats_lock:
+            if len(self._latencies) < _MIN_HEDGE_SAMPLES:
+                return None
+            return percentile(sorted(self._latencies), self.hedge_percentile)
+
+    def _take_hedge(self) -> bool:
+        """Check whether a request can be hedged without exceeding the hedging budget, and count it."""
+        with self._stats_lock:
+            if self._stats['hedges'] >= _HEDGE_BUDGET * self._stats['calls']:
+                return False
+            self._stats['hedges'] += 1
+            return True
 
     def predict(self, message: str, parameters: dict = None, session: 'Session' = None, system_message: str = None) -> str:
         messages = []
@@ -89,7 +501,7 @@ class LLMOllama(LLM):
         messages.append({"role": "user", "content": message})
         if not parameters:
             parameters = self.parameters
-        response = self.client.chat(model=self.name, messages=messages, **parameters)
+        response = self._chat(messages, parameters, self._schedule(session))
         return response['message']['content']
 
     def chat(self, session: 'Session', parameters: dict = None, system_message: str = None) -> str:
@@ -111,7 +523,7 @@ class LLMOllama(LLM):
         if system_message:
             context_messages.append({"role": "system", "content": system_message})
 
-        response = self.client.chat(model=self.name, messages=context_messages + messages, **parameters)
+        response = self._chat(context_messages + messages, parameters, self._schedule(session))
         return response['message']['content']
 
     def intent_classification(
@@ -122,13 +534,13 @@ class LLMOllama(LLM):
     ) -> list[IntentClassifierPrediction]:
         if not parameters:
             parameters = self.parameters
-        response = self.client.chat(
-            model=self.name,
-            messages=[
+        response = self._chat(
+            [
                 {"role": "user", "content": message}
             ],
-            format='json',
-            **parameters
+            parameters,
+            self._schedule(priority=PRIORITY_INTENT),
+            format='json'
         )
         response_json = json.loads(response['message']['content'])
         return intent_classifier.default_json_to_intent_classifier_predictions(
@@ -0,0 +1,270 @@
+import threading
+import time
+
+from besser.agent.exceptions.logger import logger
+
+try:
+    from httpx import TimeoutException, TransportError
+    from ollama import Client, ResponseError
+except ImportError:
+    logger.warning("ollama dependencies in OllamaPool could not be imported. You can install them from the "
+                   "requirements/requirements-llm.txt file")
+
+# Pools shared by all the LLMs of the process, by list of hosts
+_shared_pools: dict[tuple[str, ...], 'OllamaPool'] = {}
+_shared_pools_lock = threading.Lock()
+
+
+def parse_hosts(hosts: str, default_port: int) -> list[str]:
+    """
+    Parses a comma-separated list of Ollama hosts (e.g. ``box1:11434, box2``).
+
+    :param hosts: The hosts, each one optionally with a port
+    :param default_port: The port of the hosts without port
+    :return: The host URLs (``host:port``)
+    """
+    urls = []
+    for host in hosts.split(','):
+        host = host.strip()
+        if host:
+            urls.append(host if ':' in host.split('//')[-1] else f'{host}:{default_port}')
+    return urls
+
+
+def is_host_error(error: Exception) -> bool:
+    """
+    Checks whether an error of an Ollama request was caused by the server (connection errors, timeouts and 5xx
+    responses) rather than by the request itself (e.g. an unknown model or a bad argument), which would fail on any
+    server.
+
+    :param error: The error raised by the Ollama client
+    :return: Whether the error was caused by the server
+    """
+    if isinstance(error, ResponseError):
+        return error.status_code >= 500
+    return isinstance(error, (TransportError, ConnectionError))
+
+
+def is_ollama_error(error: Exception) -> bool:
+    """
+    Checks whether an error of an Ollama request comes from the server (an error response) or from the connection to
+    it, as opposed to an error of the caller (e.g. a TypeError for a bad argument), which must not affect the health
+    of the server.
+
+    :param error: The error raised by the Ollama client
+    :return: Whether the error comes from the server or the connection to it
+    """
+    return isinstance(error, ResponseError) or is_host_error(error)
+
+
+def shared_pool(urls: list[str], max_failures: int = 3, ejection_time: float = 30, timeout: float = None,
+                max_retries: int = 2) -> 'OllamaPool':
+    """
+    Gets the pool of some Ollama hosts shared by all the LLMs of the process (created on the first call), so that the
+    requests of all the models and agents are balanced together.
+
+    :param urls: The host URLs
+    :param max_failures: See :class:`OllamaPool` (only used when the pool is created)
+    :param ejection_time: See :class:`OllamaPool` (only used when the pool is created)
+    :param timeout: See :class:`OllamaPool` (only used when the pool is created)
+    :param max_retries: See :class:`OllamaPool` (only used when the pool is created)
+    :return: The pool
+    """
+    key = tuple(urls)
+    with _shared_pools_lock:
+        if key not in _shared_pools:
+            _shared_pools[key] = OllamaPool(urls, max_failures=max_failures, ejection_time=ejection_time,
+                                            timeout=timeout, max_retries=max_retries)
+        return _shared_pools[key]
+
+
+class OllamaHost:
+    """An Ollama server of a :class:`OllamaPool`, with the statistics of its requests.
+
+    Args:
+        url (str): the URL of the server
+        timeout (float): the timeout (in seconds) of the requests, None for no timeout
+
+    Attributes:
+        client (Client): the Ollama client of the server
+        outstanding (int): number of requests in progress
+        requests (int): number of finished requests (successful or not)
+        failures (int): number of requests that failed because of the server (connection errors, timeouts and 5xx
+            responses)
+        timeouts (int): number of requests that timed out (included in failures)
+        retries (int): number of failed requests retried (on another server, if possible)
+        consecutive_failures (int): number of failures since the last successful request
+        ejected_until (float): time (``time.monotonic()``) until which the server receives no requests, None if it
+            is not ejected
+        busy_time (float): total time (in seconds) of the requests
+        eval_count (int): number of tokens generated by the server
+    """
+
+    def __init__(self, url: str, timeout: float = None):
+        self.url: str = url
+        self.client: Client = Client(host=url, timeout=timeout)
+        self.outstanding: int = 0
+        self.requests: int = 0
+        self.failures: int = 0
+        self.timeouts: int = 0
+        self.retries: int = 0
+        self.consecutive_failures: int = 0
+        self.ejected_until: float = None
+        self.busy_time: float = 0.0
+        self.eval_count: int = 0
+
+
+class OllamaPool:
+    """A pool of Ollama servers serving the same models, used as an Ollama client (it has the same ``chat`` and
+    ``embed`` methods).
+
+    Each request is sent to the server with the fewest outstanding requests (ties are broken by the fewest finished
+    requests), so a slower server gets fewer requests. A server whose requests fail ``max_failures`` times in a row
+    (connection errors, timeouts or 5xx responses) is ejected from the pool for ``ejection_time`` seconds, and then it
+    is health-checked (a cheap request with a short timeout) before receiving requests again. A request that fails
+    because of its server (including a request that does not finish within ``timeout``, e.g. a runaway generation)
+    is retried up to ``max_retries`` times, on the servers not tried yet first.
+
+    If all the servers are ejected, the requests are still sent to the one whose ejection ends first, so that an
+    outage of a single-server pool does not outlast the outage itself.
+
+    The pool is thread-safe.
+
+    Args:
+        urls (list[str]): the URLs of the servers
+        max_failures (int): number of consecutive failures after which a server is ejected
+        ejection_time (float): time (in seconds) a server is ejected before being health-checked again
+        health_check_timeout (float): timeout (in seconds) of the health checks
+        timeout (float): timeout (in seconds) of the requests, None for no timeout. Since the answers are not
+            streamed, it bounds the whole generation
+        max_retries (int): maximum number of times a request that failed because of its server is retried
+
+    Attributes:
+        hosts (list[OllamaHost]): the servers of the pool
+    """
+
+    def __init__(self, urls: list[str], max_failures: int = 3, ejection_time: float = 30,
+                 health_check_timeout: float = 2, timeout: float = None, max_retries: int = 2):
+        if not urls:
+            raise ValueError('An Ollama pool needs at least 1 host')
+        self.hosts: list[OllamaHost] = [OllamaHost(url, timeout) for url in urls]
+        self.timeout: float = timeout
+        self.max_retries: int = max(0, max_retries)
+        self.max_failures: int = max(1, max_failures)
+        self.ejection_time: float = ejection_time
+        self.health_check_timeout: float = health_check_timeout
+        self._lock = threading.Lock()
+
+    def chat(self, **kwargs):
+        return self._request('chat', **kwargs)
+
+    def embed(self, **kwargs):
+        return self._request('embed', **kwargs)
+
+    def get_stats(self) -> dict[str, dict]:
+        """Get the statistics of each server of the pool.
+
+        Returns:
+            dict[str, dict]: by server URL, its finished requests, failures, timeouts, retries, outstanding requests,
+            busy time (in seconds), generated tokens, and whether it is ejected
+        """
+        with self._lock:
+            now = time.monotonic()
+            return {
+                host.url: {
+                    'requests': host.requests,
+                    'failures': host.failures,
+                    'timeouts': host.timeouts,
+                    'retries': host.retries,
+                    'outstanding': host.outstanding,
+                    'busy_time': host.busy_time,
+                    'eval_count': host.eval_count,
+                    'ejected': host.ejected_until is not None and host.ejected_until > now
+                }
+                for host in self.hosts
+            }
+
+    def _request(self, method: str, **kwargs):
+        tried = []
+        while True:
+            host = self._acquire(tried)
+            start = time.monotonic()
+            try:
+                response = getattr(host.client, method)(**kwargs)
+            except Exception as e:
+                if not is_ollama_error(e):
+                    # E.g. a bad argument, it would fail on any server
+                    self._discard(host)
+                    raise
+                host_failure = is_host_error(e)
+                self._release(host, start, failed=host_failure, timed_out=isinstance(e, TimeoutException))
+                tried.append(host)
+                if not host_failure or len(tried) > self.max_retries:
+                    raise
+                with self._lock:
+                    host.retries += 1
+                logger.warning(f'Ollama request to {host.url} failed, retrying ({len(tried)}/{self.max_retries}): '
+                               f'{str(e) or type(e).__name__}')
+                continue
+            self._release(host, start, eval_count=response.get('eval_count') or 0)
+            return response
+
+    def _acquire(self, excluded: list[OllamaHost]) -> OllamaHost:
+        """Select the server of a request (among the servers not excluded, if any) and count the request as
+        outstanding."""
+        if len(excluded) >= len(self.hosts):
+            excluded = []
+        with self._lock:
+            now = time.monotonic()
+            due = [host for host in self.hosts
+                   if host not in excluded and host.ejected_until is not None and host.ejected_until <= now]
+            for host in due:
+                # Keep the server ejected while it is checked, so the other requests do not check it too
+                host.ejected_until = now + self.ejection_time
+        for host in due:
+            self._health_check(host)
+        with self._lock:
+            now = time.monotonic()
+            candidates = [host for host in self.hosts if host not in excluded]
+            available = [host for host in candidates if host.ejected_until is None or host.ejected_until <= now]
+            if available:
+                host = min(available, key=lambda h: (h.outstanding, h.requests))
+            else:
+                host = min(candidates, key=lambda h: h.ejected_until)
+            host.outstanding += 1
+            return host
+
+    def _release(self, host: OllamaHost, start: float, failed: bool = False, timed_out: bool = False,
+                 eval_count: int = 0) -> None:
+        with self._lock:
+            host.outstanding -= 1
+            host.requests += 1
+            host.busy_time += time.monotonic() - start
+            host.eval_count += eval_count
+            if not failed:
+                host.consecutive_failures = 0
+                host.ejected_until = None
+                return
+            host.failures += 1
+            host.timeouts += timed_out
+            host.consecutive_failures += 1
+            if host.consecutive_failures >= self.max_failures and host.ejected_until is None:
+                host.ejected_until = time.monotonic() + self.ejection_time
+                logger.warning(f'Ollama host {host.url} ejected from the pool for {self.ejection_time} s '
+                               f'after {host.consecutive_failures} consecutive failures')
+
+    def _discard(self, host: OllamaHost) -> None:
+        """Release a request that did not reach the server, without counting it."""
+        with self._lock:
+            host.outstanding -= 1
+
+    def _health_check(self, host: OllamaHost) -> None:
+        try:
+            Client(host=host.url, timeout=self.health_check_timeout).ps()
+        except Exception as e:
+            logger.warning(f'Ollama host {host.url} health check failed: {e}')
+            return
+        with self._lock:
+            host.ejected_until = None
+            host.consecutive_failures = 0
+        logger.info(f'Ollama host {host.url} is back in the pool')
@@ -0,0 +1,85 @@
+import itertools
+import json
+import threading
+import time
+
+from besser.agent.core.session import Session
+
+from app.vars import *
+
+# Sequence numbers are shared by all the reporters of the process, so they always increase from one job to the next
+_sequence = itertools.count(1)
+
+
+class ProgressReporter:
+    """Sends progress updates of a long task to the user, coalescing them to at most ``max_rate`` per second.
+
+    Every progress update becomes a websocket message and a rerun of the UI, so sending one per processed item
+    slows down both sides. The reporter sends an update right away if enough time passed since the previous one;
+    otherwise it keeps it and sends the latest pending update when the interval expires (intermediate ones are
+    dropped). The final update is always sent. Each sent update carries a monotonically increasing sequence number
+    (``SEQUENCE``), so that the UI can discard out-of-order updates.
+
+    The reporter is thread-safe.
+
+    Args:
+        session (Session): the user session
+        max_rate (float): maximum number of updates per second (if <= 0, all updates are sent)
+
+    Attributes:
+        sent_updates (int): number of updates sent
+        dropped_updates (int): number of updates coalesced into later ones
+    """
+
+    def __init__(self, session: Session, max_rate: float = 2):
+        self.session: Session = session
+        self.interval: float = 1 / max_rate if max_rate > 0 else 0
+        self.sent_updates: int = 0
+        self.dropped_updates: int = 0
+        self._lock = threading.Lock()
+        self._last_sent: float = None
+        self._pending: dict = None
+        self._timer: threading.Timer = None
+        self._finished: bool = False
+
+    def update(self, progress: dict) -> None:
+        """Report the current progress of the task (the FINISHED flag is set to False)."""
+        with self._lock:
+            if self._finished:
+                return
+            progress = {**progress, FINISHED: False}
+            now = time.monotonic()
+            if self._last_sent is None or now - self._last_sent >= self.interval:
+                self._send(progress)
+                return
+            if self._pending is not None:
+                self.dropped_updates += 1
+            self._pending = progress
+            if self._timer is None:
+                self._timer = threading.Timer(self.interval - (now - self._last_sent), self._send_pending)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def finish(self, progress: dict) -> None:
+        """Report the final progress of the task (the FINISHED flag is set to True). It is always sent."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._pending is not None:
+                self.dropped_updates += 1
+                self._pending = None
+            self._finished = True
+            self._send({**progress, FINISHED: True})
+
+    def _send_pending(self) -> None:
+        with self._lock:
+            self._timer = None
+            if self._pending is not None and not self._finished:
+                self._send(self._pending)
+
+    def _send(self, progress: dict) -> None:
+        self._pending = None
+        self._last_sent = time.monotonic()
+        self.sent_updates += 1
+        self.session.reply(json.dumps({**progress, SEQUENCE: next(_sequence)}))
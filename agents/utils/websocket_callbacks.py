@@ -39,16 +39,28 @@ def on_message(agent_name: str):
         if payload.action == PayloadAction.AGENT_REPLY_STR.value:
             try:
                 content = json.loads(payload.message)
-                # Get data for progress bar in data labeling agent
-                if UPDATED_DOCS in content and IGNORED_DOCS in content and TOTAL_DOCS in content:
-                    if PROGRESS_DATA_LABELING not in streamlit_session._session_state:
-                        content[INITIAL_TIME] = datetime.now()
-                    else:
-                        content[INITIAL_TIME] = streamlit_session._session_state[PROGRESS_DATA_LABELING][INITIAL_TIME]
-                    streamlit_session._session_state[PROGRESS_DATA_LABELING] = content
+                # Get data for the job list in data labeling agent (job status changes and job progress updates)
+                if JOB_ID in content:
+                    if JOBS not in streamlit_session._session_state:
+                        streamlit_session._session_state[JOBS] = {}
+                    jobs = streamlit_session._session_state[JOBS]
+                    previous = jobs.get(content[JOB_ID])
+                    if UPDATED_DOCS in content and IGNORED_DOCS in content and TOTAL_DOCS in content:
+                        if is_outdated_progress(content, previous):
+                            return
+                        if previous is None or INITIAL_TIME not in previous:
+                            content[INITIAL_TIME] = datetime.now()
+                    jobs[content[JOB_ID]] = {**previous, **content} if previous else content
+                    streamlit_session._handle_rerun_script_request()
+                # Get the query plan of the filters in data labeling agent
+                if QUERY_PLAN in content:
+                    streamlit_session._session_state[QUERY_PLAN] = content
                     streamlit_session._handle_rerun_script_request()
                 # Get data for progress bar in chat files agent
                 if TOTAL_MESSAGES in content and PROCESSED_MESSAGES in content:
+                    previous = streamlit_session._session_state[PROGRESS_CHAT_FILES] if PROGRESS_CHAT_FILES in streamlit_session._session_state else None
+                    if is_outdated_progress(content, previous):
+                        return
                     streamlit_session._session_state[PROGRESS_CHAT_FILES] = content
                     streamlit_session._handle_rerun_script_request()
                 # Add entry to chat files notebook
@@ -109,6 +121,11 @@ def on_message(agent_name: str):
     return on_message_with_agent_name
 
 
+def is_outdated_progress(content: dict, previous: dict) -> bool:
+    """Check whether a progress update is older than the last one received (by its sequence number)."""
+    return previous is not None and SEQUENCE in content and SEQUENCE in previous and content[SEQUENCE] <= previous[SEQUENCE]
+
+
 def on_error(ws, error):
     pass
 
@@ -30,12 +30,12 @@ ELASTICSEARCH = 'elasticsearch'
 INSTRUCTIONS = 'instructions'
 INSTRUCTIONS_CHECKBOXES = 'instructions_checkboxes'
 FILTERS_CHECKBOXES = 'filters_checkboxes'
-PROGRESS_DATA_LABELING = 'progress_data_labeling'
 PROGRESS_CHAT_FILES = 'progress_chat_files'
 INITIAL_TIME = 'initial_time'
 
 # Progress bar
 FINISHED = 'finished'
+SEQUENCE = 'seq'
 TIME = 'time'
 # Data labeling progress bar
 UPDATED_DOCS = 'updated_docs'
@@ -80,6 +80,48 @@ INDEX = 'index'
 QUERY = 'query'
 REQUEST = 'request'
 YES_TO_ALL = 'yes_to_all'
+AWAITING_CONFIRMATION = 'awaiting_confirmation'
+RESUME = 'resume'
+
+# Labeling job checkpoint
+PIT_ID = 'pit_id'
+SLICES = 'slices'
+CURSORS = 'cursors'
+PROCESSED_IDS = 'processed_ids'
+LABELED_DOCS = 'labeled_docs'
+
+# Query plan
+QUERY_PLAN = 'query_plan'
+PLAN_FILTERS = 'plan_filters'
+PLAN_REWRITES = 'plan_rewrites'
+PLAN_WARNINGS = 'plan_warnings'
+PLAN_TOOK = 'plan_took'
+
+# Labeling jobs
+JOBS = 'jobs'
+JOB_ID = 'job_id'
+JOB_STATUS = 'job_status'
+JOB_ERROR = 'job_error'
+JOB_ACTION = 'job_action'
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_PAUSED = 'paused'
+JOB_CANCELLING = 'cancelling'
+JOB_CANCELLED = 'cancelled'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+PAUSE_JOB = 'pause'
+UNPAUSE_JOB = 'unpause'
+CANCEL_JOB = 'cancel'
+job_status_dict = {
+    JOB_QUEUED: '🕒 Queued',
+    JOB_RUNNING: '⚙️ Running',
+    JOB_PAUSED: '⏸️ Paused',
+    JOB_CANCELLING: '🚫 Cancelling...',
+    JOB_CANCELLED: '🚫 Cancelled',
+    JOB_COMPLETED: '✅ Completed',
+    JOB_FAILED: '❌ Failed'
+}
 ELASTICSEARCH_CONNECTION_ERROR = 'elasticsearch_connection_error'
 
 
@@ -103,6 +145,51 @@ DATE_FORMAT = '%Y-%m-%d'
 ELASTICSEARCH_HOST = Property('elasticsearch', 'elasticsearch.host', str, None)
 ELASTICSEARCH_PORT = Property('elasticsearch', 'elasticsearch.port', int, None)
 ELASTICSEARCH_INDEX = Property('elasticsearch', 'elasticsearch.index', str, None)
+ELASTICSEARCH_CONNECTIONS_PER_NODE = Property('elasticsearch', 'elasticsearch.connections_per_node', int, 10)
+ELASTICSEARCH_REQUEST_TIMEOUT = Property('elasticsearch', 'elasticsearch.request_timeout', float, 30.0)
+ELASTICSEARCH_MAX_RETRIES = Property('elasticsearch', 'elasticsearch.max_retries', int, 3)
+ELASTICSEARCH_RETRY_BACKOFF = Property('elasticsearch', 'elasticsearch.retry_backoff', float, 0.5)
+ELASTICSEARCH_HEALTH_CHECK_INTERVAL = Property('elasticsearch', 'elasticsearch.health_check_interval', float, 5.0)
+
+# Maximum number of progress updates per second sent by the agents to the UI
+PROGRESS_MAX_RATE = Property('progress', 'progress.max_updates_per_second', float, 2.0)
+
+# Data labeling pipeline (fetch -> classify -> write back)
+PIPELINE_PAGE_SIZE = Property('data_labeling', 'data_labeling.pipeline.page_size', int, 50)
+PIPELINE_LLM_WORKERS = Property('data_labeling', 'data_labeling.pipeline.llm_workers', int, 4)
+PIPELINE_PREFETCH_PAGES = Property('data_labeling', 'data_labeling.pipeline.prefetch_pages', int, 2)
+PIPELINE_WRITE_QUEUE_SIZE = Property('data_labeling', 'data_labeling.pipeline.write_queue_size', int, 100)
+PIPELINE_SLICES = Property('data_labeling', 'data_labeling.pipeline.slices', int, 1)
+PIPELINE_KEEP_ALIVE = Property('data_labeling', 'data_labeling.pipeline.keep_alive', str, '1m')
+BULK_MAX_ACTIONS = Property('data_labeling', 'data_labeling.bulk.max_actions', int, 500)
+BULK_FLUSH_INTERVAL = Property('data_labeling', 'data_labeling.bulk.flush_interval', float, 5.0)
+BULK_MAX_RETRIES = Property('data_labeling', 'data_labeling.bulk.max_retries', int, 3)
+BATCH_MAX_DOCS = Property('data_labeling', 'data_labeling.batch.max_docs', int, 1)
+CACHE_PATH = Property('data_labeling', 'data_labeling.cache.path', str, 'data/data_labeling_agent/verdict_cache.db')
+CACHE_MAX_ENTRIES = Property('data_labeling', 'data_labeling.cache.max_entries', int, 1000000)
+CHECKPOINT_DIRECTORY = Property('data_labeling', 'data_labeling.checkpoint.directory', str, 'data/data_labeling_agent/checkpoints')
+CHECKPOINT_INTERVAL = Property('data_labeling', 'data_labeling.checkpoint.interval', float, 60.0)
+PREPROCESSING_HTML_TO_TEXT = Property('data_labeling', 'data_labeling.preprocessing.html_to_text', bool, True)
+PREPROCESSING_STRIP_QUOTES = Property('data_labeling', 'data_labeling.preprocessing.strip_quotes', bool, True)
+PREPROCESSING_STRIP_SIGNATURES = Property('data_labeling', 'data_labeling.preprocessing.strip_signatures', bool, True)
+PREPROCESSING_COLLAPSE_WHITESPACE = Property('data_labeling', 'data_labeling.preprocessing.collapse_whitespace', bool, True)
+PREPROCESSING_MAX_DOC_TOKENS = Property('data_labeling', 'data_labeling.preprocessing.max_doc_tokens', int, 0)
+CHUNKING_COMBINE = Property('data_labeling', 'data_labeling.chunking.combine', str, 'any')
+CHUNKING_OVERLAP_TOKENS = Property('data_labeling', 'data_labeling.chunking.overlap_tokens', int, 100)
+PREFILTER_MODEL = Property('data_labeling', 'data_labeling.prefilter.model', str, None)
+PREFILTER_THRESHOLD = Property('data_labeling', 'data_labeling.prefilter.threshold', float, 0.3)
+PREFILTER_STORE_PATH = Property('data_labeling', 'data_labeling.prefilter.store_path', str, 'data/data_labeling_agent/embeddings.db')
+PREFILTER_STORE_MAX_ENTRIES = Property('data_labeling', 'data_labeling.prefilter.store_max_entries', int, 1000000)
+CASCADE_SMALL_MODEL = Property('data_labeling', 'data_labeling.cascade.small_model', str, None)
+CASCADE_MIN_CONFIDENCE = Property('data_labeling', 'data_labeling.cascade.min_confidence', float, 0.8)
+ESTIMATION_SAMPLE_SIZE = Property('data_labeling', 'data_labeling.estimation.sample_size', int, 20)
+QUERY_PLANNER_PROFILE_TIMEOUT = Property('data_labeling', 'data_labeling.query_planner.profile_timeout', str, '2s')
+QUERY_PLANNER_SLOW_QUERY_TIME = Property('data_labeling', 'data_labeling.query_planner.slow_query_time', float, 1.0)
+QUERY_CACHE_MAX_ENTRIES = Property('data_labeling', 'data_labeling.query_cache.max_entries', int, 1000)
+QUERY_CACHE_TTL = Property('data_labeling', 'data_labeling.query_cache.ttl', float, 300.0)
+UPDATE_BY_QUERY_POLL_INTERVAL = Property('data_labeling', 'data_labeling.update_by_query.poll_interval', float, 1.0)
+JOBS_MAX_CONCURRENT = Property('data_labeling', 'data_labeling.jobs.max_concurrent', int, 1)
+JOBS_MAX_FINISHED = Property('data_labeling', 'data_labeling.jobs.max_finished', int, 100)
 
 
 # Pages
@@ -0,0 +1,66 @@
+import unittest
+from unittest import mock
+
+from agents.elasticsearch.bulk_writer import BulkWriter
+from app.vars import DOCUMENT_RELEVANCE
+
+
+class FakeElasticsearch:
+    """An Elasticsearch client whose ``bulk`` calls raise or answer with the given item statuses, in order."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.indices = mock.Mock()
+
+    def bulk(self, operations: list[dict], refresh: bool) -> dict:
+        doc_ids = [operation['update']['_id'] for operation in operations[::2]]
+        self.requests.append(doc_ids)
+        response = self.responses.pop(0) if self.responses else {}
+        if isinstance(response, Exception):
+            raise response
+        items = [{'update': {'status': response[doc_id], 'error': 'error'}} if doc_id in response
+                 else {'update': {'status': 200}} for doc_id in doc_ids]
+        return {'errors': bool(response), 'items': items}
+
+
+def bulk_writer(es_client: FakeElasticsearch) -> BulkWriter:
+    return BulkWriter(es_client, 'emails', DOCUMENT_RELEVANCE, 5, max_actions=10, max_retries=1)
+
+
+class TestBulkWriter(unittest.TestCase):
+
+    def test_flush_sends_the_buffer(self):
+        es_client = FakeElasticsearch()
+        writer = bulk_writer(es_client)
+        writer.add('a')
+        writer.add('b')
+        writer.flush()
+        self.assertEqual(es_client.requests, [['a', 'b']])
+        self.assertEqual(writer.written_docs, 2)
+
+    def test_failed_bulk_request_keeps_the_buffer(self):
+        es_client = FakeElasticsearch(ConnectionError('cluster down'))
+        writer = bulk_writer(es_client)
+        writer.add('a')
+        writer.add('b')
+        with self.assertRaises(ConnectionError):
+            writer.flush()
+        self.assertEqual(writer.written_docs, 0)
+        writer.add('c')
+        writer.flush_all()
+        self.assertEqual(es_client.requests, [['a', 'b'], ['a', 'b', 'c']])
+        self.assertEqual(writer.written_docs, 3)
+        self.assertEqual(writer.failed_ids, [])
+
+    @mock.patch('agents.elasticsearch.bulk_writer.time.sleep')
+    def test_retryable_items_are_sent_again(self, sleep):
+        es_client = FakeElasticsearch({'a': 429, 'b': 400}, {'a': 503})
+        writer = bulk_writer(es_client)
+        writer.add('a')
+        writer.add('b')
+        writer.add('c')
+        writer.flush_all()
+        self.assertEqual(es_client.requests, [['a', 'b', 'c'], ['a']])
+        self.assertEqual(writer.written_docs, 1)
+        self.assertEqual(writer.failed_ids, ['b', 'a'])
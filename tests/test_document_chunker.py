@@ -0,0 +1,65 @@
+import unittest
+
+from agents.data_labeling_agent.document_chunker import split_text
+
+
+class WordTokenizer:
+    """A tokenizer with one token per word, so that the token counts of the tests are easy to follow."""
+
+    def encode(self, text: str, add_special_tokens: bool = True) -> list[str]:
+        return text.split()
+
+    def decode(self, tokens: list[str]) -> str:
+        return ' '.join(tokens)
+
+
+def words(start: int, end: int) -> str:
+    return ' '.join(f'w{i}' for i in range(start, end))
+
+
+class TestSplitText(unittest.TestCase):
+
+    def setUp(self):
+        self.tokenizer = WordTokenizer()
+
+    def test_text_shorter_than_a_chunk(self):
+        self.assertEqual(split_text(words(0, 3), self.tokenizer, 4), [words(0, 3)])
+
+    def test_text_of_exactly_one_chunk(self):
+        self.assertEqual(split_text(words(0, 4), self.tokenizer, 4, overlap=1), [words(0, 4)])
+
+    def test_empty_text(self):
+        self.assertEqual(split_text('', self.tokenizer, 4), [''])
+
+    def test_chunks_without_overlap(self):
+        self.assertEqual(split_text(words(0, 10), self.tokenizer, 4), [words(0, 4), words(4, 8), words(8, 10)])
+
+    def test_chunks_with_overlap(self):
+        self.assertEqual(split_text(words(0, 10), self.tokenizer, 4, overlap=1),
+                         [words(0, 4), words(3, 7), words(6, 10)])
+
+    def test_last_chunk_is_not_only_overlap(self):
+        # The last 2 tokens are already at the end of the second chunk
+        self.assertEqual(split_text(words(0, 6), self.tokenizer, 4, overlap=2), [words(0, 4), words(2, 6)])
+
+    def test_every_token_is_in_a_chunk_of_at_most_max_tokens(self):
+        for length in range(1, 30):
+            for max_tokens in range(1, 8):
+                for overlap in range(max_tokens):
+                    with self.subTest(length=length, max_tokens=max_tokens, overlap=overlap):
+                        chunks = [chunk.split() for chunk in split_text(words(0, length), self.tokenizer, max_tokens,
+                                                                        overlap)]
+                        self.assertTrue(all(len(chunk) <= max_tokens for chunk in chunks))
+                        self.assertEqual(chunks[0][0], 'w0')
+                        self.assertEqual(chunks[-1][-1], f'w{length - 1}')
+                        for previous, chunk in zip(chunks, chunks[1:]):
+                            # Each chunk repeats the overlap of the previous one and continues after it
+                            self.assertEqual(chunk[:overlap], previous[len(previous) - overlap:])
+
+    def test_overlap_as_large_as_the_chunk(self):
+        # The overlap is reduced so that the chunks advance at least 1 token
+        self.assertEqual(split_text(words(0, 4), self.tokenizer, 2, overlap=2), [words(0, 2), words(1, 3), words(2, 4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import types
+import unittest
+
+from agents.elasticsearch.elasticsearch_query import parse_verdict, constrained_parameters, VERDICT_SCHEMA, \
+    build_batch_prompt, parse_batch_verdicts
+
+
+class TestParseVerdict(unittest.TestCase):
+
+    def test_json_answers(self):
+        self.assertIs(parse_verdict('{"result": true}'), True)
+        self.assertIs(parse_verdict('{"result": false}'), False)
+
+    def test_answer_cut_by_num_predict(self):
+        self.assertIs(parse_verdict('{"result": true, "conf'), True)
+        self.assertIs(parse_verdict('{"RESULT" : False'), False)
+
+    def test_answers_without_result(self):
+        self.assertIsNone(parse_verdict('{"result": "yes"}'))
+        self.assertIsNone(parse_verdict('The document is true to the filters'))
+        self.assertIsNone(parse_verdict(''))
+
+
+class TestConstrainedParameters(unittest.TestCase):
+
+    def test_adds_the_format_and_num_predict(self):
+        llm = types.SimpleNamespace(parameters={'keep_alive': '30m', 'options': {'temperature': 0}})
+        parameters = constrained_parameters(llm, VERDICT_SCHEMA, 16)
+        self.assertEqual(parameters, {'keep_alive': '30m', 'format': VERDICT_SCHEMA,
+                                      'options': {'temperature': 0, 'num_predict': 16}})
+        # The LLM parameters are not modified
+        self.assertEqual(llm.parameters, {'keep_alive': '30m', 'options': {'temperature': 0}})
+
+    def test_without_options(self):
+        llm = types.SimpleNamespace(parameters={})
+        self.assertEqual(constrained_parameters(llm, VERDICT_SCHEMA, 16),
+                         {'format': VERDICT_SCHEMA, 'options': {'num_predict': 16}})
+
+
+
+class TestBuildBatchPrompt(unittest.TestCase):
+
+    def test_numbers_the_documents_after_the_filters(self):
+        prompt = build_batch_prompt('Filters:\n- is about gas\n', [{'SUBJECT': 'a'}, {'SUBJECT': 'b'}])
+        self.assertEqual(prompt, "Filters:\n- is about gas\nDocument 1:\n{'SUBJECT': 'a'}\nDocument 2:\n{'SUBJECT': 'b'}\n")
+
+
+class TestParseBatchVerdicts(unittest.TestCase):
+
+    def test_verdicts_by_position(self):
+        answer = '{"results": [{"id": 1, "result": true}, {"id": 2, "result": false}, {"id": 3, "result": true}]}'
+        self.assertEqual(parse_batch_verdicts(answer, 3), {0: True, 1: False, 2: True})
+
+    def test_bare_list(self):
+        self.assertEqual(parse_batch_verdicts('[{"id": 2, "result": true}]', 2), {1: True})
+
+    def test_ignores_malformed_entries(self):
+        answer = ('{"results": [{"id": 1, "result": "yes"}, {"id": 0, "result": true}, {"id": 4, "result": true}, '
+                  '{"id": "2", "result": true}, 7, {"id": 3, "result": false}]}')
+        self.assertEqual(parse_batch_verdicts(answer, 3), {2: False})
+
+    def test_malformed_answers(self):
+        self.assertEqual(parse_batch_verdicts('{"results": [{"id": 1, "res', 3), {})
+        self.assertEqual(parse_batch_verdicts('{"results": "all true"}', 3), {})
+        self.assertEqual(parse_batch_verdicts('"true"', 3), {})
+
+    def test_minimum_confidence(self):
+        answer = ('{"results": [{"id": 1, "result": true, "confidence": 0.9}, {"id": 2, "result": true, "confidence": 0.5}, '
+                  '{"id": 3, "result": false}, {"id": 4, "result": false, "confidence": true}]}')
+        self.assertEqual(parse_batch_verdicts(answer, 4, min_confidence=0.8), {0: True})
+        self.assertEqual(parse_batch_verdicts(answer, 4), {0: True, 1: True, 2: False, 3: False})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+
+from agents.data_labeling_agent.email_preprocessor import EmailPreprocessor, strip_quoted_replies, strip_signatures, \
+    TRUNCATION_MARK
+
+
+class WordTokenizer:
+    """A tokenizer with one token per word, so that the token counts of the tests are easy to follow."""
+
+    def encode(self, text: str, add_special_tokens: bool = True) -> list[str]:
+        return text.split()
+
+    def decode(self, tokens: list[str]) -> str:
+        return ' '.join(tokens)
+
+
+class TestStripQuotedReplies(unittest.TestCase):
+
+    def test_removes_everything_after_the_original_message_header(self):
+        text = 'Please check the numbers.\n\n-----Original Message-----\nFrom: Bob\nThe numbers are attached.'
+        self.assertEqual(strip_quoted_replies(text).strip(), 'Please check the numbers.')
+
+    def test_removes_everything_after_the_wrote_header(self):
+        text = 'Agreed.\n\nOn Mon, 3 Jan 2000 at 10:00, Bob wrote:\nShall we sign?'
+        self.assertEqual(strip_quoted_replies(text).strip(), 'Agreed.')
+
+    def test_removes_the_outlook_header(self):
+        text = 'See below.\n\nFrom: Bob\nSent: Monday\nTo: Alice\nSubject: Deal\n\nOld text'
+        self.assertEqual(strip_quoted_replies(text).strip(), 'See below.')
+
+    def test_removes_the_quoted_lines(self):
+        text = 'My answer\n> the question\n  > more question\nThe end'
+        self.assertEqual(strip_quoted_replies(text), 'My answer\nThe end')
+
+    def test_keeps_an_email_that_is_only_a_quote(self):
+        text = '-----Original Message-----\nFrom: Bob\nThe numbers are attached.'
+        self.assertEqual(strip_quoted_replies(text), text)
+
+    def test_keeps_an_email_without_quotes(self):
+        text = 'On second thought, the meeting is on Friday.\nRegards'
+        self.assertEqual(strip_quoted_replies(text), text)
+
+    def test_keeps_prose_that_mentions_someone_who_wrote(self):
+        text = 'Good news.\nOn Friday, after the call, Dynegy wrote: we will keep the price at 40.\nPlease confirm.'
+        self.assertEqual(strip_quoted_replies(text), text)
+
+    def test_removes_the_gmail_header_with_an_address(self):
+        text = 'Agreed.\n\nOn Mon, Bob <bob@enron.com> wrote:\nShall we sign?'
+        self.assertEqual(strip_quoted_replies(text).strip(), 'Agreed.')
+
+    def test_keeps_a_forwarded_message(self):
+        text = ('FYI, see the offer below.\n\n---------- Forwarded message ---------\nFrom: Bob <bob@enron.com>\n'
+                'Date: Mon, Jan 3, 2000 at 10:00 AM\nSubject: Offer\nTo: Alice <alice@enron.com>\n\n'
+                'We will keep the price at 40.')
+        self.assertEqual(strip_quoted_replies(text), text)
+
+    def test_keeps_an_outlook_forwarded_message(self):
+        text = 'FYI.\n\nFrom: Bob\nSent: Monday\nTo: Alice\nSubject: FW: Offer\n\nWe will keep the price at 40.'
+        self.assertEqual(strip_quoted_replies(text), text)
+
+    def test_removes_the_reply_inside_a_forwarded_message(self):
+        text = ('FYI.\n\n---------- Forwarded message ---------\nFrom: Bob\nDate: Monday\nTo: Alice\n\n'
+                'The price is 40.\n\n-----Original Message-----\nFrom: Alice\nWhat is the price?')
+        self.assertEqual(strip_quoted_replies(text).strip(), text[:text.index('\n\n-----Original')])
+
+
+class TestStripSignatures(unittest.TestCase):
+
+    def test_removes_everything_after_the_signature_delimiter(self):
+        text = 'The contract is signed.\n-- \nAlice\nCEO'
+        self.assertEqual(strip_signatures(text).strip(), 'The contract is signed.')
+
+    def test_removes_the_trailing_disclaimers(self):
+        text = ('The contract is signed.\n\n'
+                'This email is intended solely for the use of the addressee. If you have received this email in error, '
+                'please notify the sender.\n\n'
+                'Sent from my iPhone')
+        self.assertEqual(strip_signatures(text), 'The contract is signed.')
+
+    def test_keeps_content_that_mentions_the_email(self):
+        texts = [
+            'This email contains the signed contract for the Q3 acquisition.',
+            'this message is confidential: we will move the funds to the offshore account on Monday.',
+            'Hi Bob,\n\nThis communication is confidential and must not reach the auditors.',
+            'Hi Bob,\n\nPlease send the confidentiality notice to the vendor before Friday.'
+        ]
+        for text in texts:
+            with self.subTest(text=text):
+                self.assertEqual(strip_signatures(text), text)
+
+    def test_keeps_disclaimers_before_the_content(self):
+        text = ('If you have received this message in error, please delete it.\n\n'
+                'The funds were moved on Monday.')
+        self.assertEqual(strip_signatures(text), text)
+
+    def test_keeps_the_first_paragraph(self):
+        text = 'Sent from my iPhone'
+        self.assertEqual(strip_signatures(text), text)
+
+
+class TestTruncate(unittest.TestCase):
+
+    def setUp(self):
+        self.preprocessor = EmailPreprocessor(max_doc_tokens=10, tokenizer=WordTokenizer())
+
+    def test_keeps_the_documents_within_the_budget(self):
+        doc = {'SUBJECT': 'one two', 'CONTENT': 'a b c d e f g h'}
+        self.assertEqual(self.preprocessor.process(doc), doc)
+
+    def test_keeps_the_short_fields_whole(self):
+        doc = {'SUBJECT': 'one two', 'CONTENT': ' '.join(['word'] * 20)}
+        processed = self.preprocessor.process(doc)
+        self.assertEqual(processed['SUBJECT'], 'one two')
+        self.assertEqual(processed['CONTENT'], ' '.join(['word'] * 8) + TRUNCATION_MARK)
+
+    def test_shares_the_budget_among_the_long_fields(self):
+        doc = {'SUBJECT': 'x', 'FROM': ' '.join(['from'] * 12), 'CONTENT': ' '.join(['word'] * 20)}
+        processed = self.preprocessor.process(doc)
+        self.assertEqual(processed['SUBJECT'], 'x')
+        # 9 tokens left for the 2 long fields: 4 for the shorter one and the rest for the longer one
+        self.assertEqual(processed['FROM'], ' '.join(['from'] * 4) + TRUNCATION_MARK)
+        self.assertEqual(processed['CONTENT'], ' '.join(['word'] * 5) + TRUNCATION_MARK)
+
+    def test_ignores_the_fields_that_are_not_strings(self):
+        doc = {'TO': ['alice', 'bob'], 'CONTENT': ' '.join(['word'] * 20)}
+        processed = self.preprocessor.process(doc)
+        self.assertEqual(processed['TO'], ['alice', 'bob'])
+        self.assertEqual(processed['CONTENT'], ' '.join(['word'] * 10) + TRUNCATION_MARK)
+
+    def test_does_not_truncate_without_tokenizer(self):
+        doc = {'CONTENT': ' '.join(['word'] * 20)}
+        self.assertEqual(EmailPreprocessor(max_doc_tokens=10).process(doc), doc)
+
+
+if __name__ == '__main__':
+    unittest.main()
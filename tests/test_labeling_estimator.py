@@ -0,0 +1,58 @@
+import unittest
+
+from agents.data_labeling_agent.labeling_estimator import wilson_interval, format_duration
+
+
+class TestWilsonInterval(unittest.TestCase):
+
+    def test_known_interval(self):
+        low, high = wilson_interval(5, 10)
+        self.assertAlmostEqual(low, 0.2366, places=4)
+        self.assertAlmostEqual(high, 0.7634, places=4)
+
+    def test_no_matches(self):
+        low, high = wilson_interval(0, 20)
+        self.assertEqual(low, 0.0)
+        self.assertAlmostEqual(high, 0.1611, places=4)
+
+    def test_all_matches(self):
+        low, high = wilson_interval(20, 20)
+        self.assertAlmostEqual(low, 0.8389, places=4)
+        self.assertEqual(high, 1.0)
+
+    def test_empty_sample(self):
+        self.assertEqual(wilson_interval(0, 0), (0.0, 1.0))
+
+    def test_contains_the_sample_proportion_and_is_symmetric(self):
+        for n in [1, 2, 7, 20, 100]:
+            for matches in range(n + 1):
+                with self.subTest(matches=matches, n=n):
+                    low, high = wilson_interval(matches, n)
+                    self.assertTrue(0.0 <= low <= matches / n <= high <= 1.0)
+                    mirrored_low, mirrored_high = wilson_interval(n - matches, n)
+                    self.assertAlmostEqual(low, 1 - mirrored_high)
+                    self.assertAlmostEqual(high, 1 - mirrored_low)
+
+    def test_narrows_with_the_sample_size(self):
+        low_small, high_small = wilson_interval(5, 20)
+        low_large, high_large = wilson_interval(50, 200)
+        self.assertLess(high_large - low_large, high_small - low_small)
+
+    def test_wider_with_a_higher_confidence(self):
+        low_95, high_95 = wilson_interval(5, 20)
+        low_99, high_99 = wilson_interval(5, 20, z=2.576)
+        self.assertLess(low_99, low_95)
+        self.assertGreater(high_99, high_95)
+
+
+class TestFormatDuration(unittest.TestCase):
+
+    def test_formats_the_2_most_significant_units(self):
+        self.assertEqual(format_duration(0), '0 s')
+        self.assertEqual(format_duration(59.6), '1 min')
+        self.assertEqual(format_duration(725), '12 min 5 s')
+        self.assertEqual(format_duration(3 * 86400 + 4 * 3600 + 5), '3 d 4 h')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+from agents.data_labeling_agent.model_cascade import ModelCascade
+from agents.elasticsearch.elasticsearch_query import parse_confident_verdict
+
+
+class FakeLLM:
+    """An LLM that always gives the same answer, and records the prompts it receives."""
+
+    def __init__(self, name: str, answer: str):
+        self.name: str = name
+        self.parameters: dict = {}
+        self.answer: str = answer
+        self.prompts: list[str] = []
+
+    def predict(self, message: str, parameters: dict = None, session=None, system_message: str = None) -> str:
+        self.prompts.append(message)
+        return self.answer
+
+
+class TestParseConfidentVerdict(unittest.TestCase):
+
+    def test_verdict_and_confidence(self):
+        self.assertEqual(parse_confident_verdict('{"result": true, "confidence": 0.85}'), (True, 0.85))
+        self.assertEqual(parse_confident_verdict('{"result": false, "confidence": 1}'), (False, 1.0))
+
+    def test_confidence_is_clamped(self):
+        self.assertEqual(parse_confident_verdict('{"result": true, "confidence": 7}'), (True, 1.0))
+        self.assertEqual(parse_confident_verdict('{"result": true, "confidence": -1}'), (True, 0.0))
+
+    def test_missing_or_malformed_confidence(self):
+        self.assertEqual(parse_confident_verdict('{"result": true}'), (True, 0.0))
+        self.assertEqual(parse_confident_verdict('{"result": true, "confidence": "high"}'), (True, 0.0))
+        self.assertEqual(parse_confident_verdict('{"result": true, "confidence": true}'), (True, 0.0))
+
+    def test_malformed_answers(self):
+        self.assertEqual(parse_confident_verdict('{"result": "yes", "confidence": 0.9}'), (None, 0.0))
+        self.assertEqual(parse_confident_verdict('{"result": true, "confid'), (None, 0.0))
+        self.assertEqual(parse_confident_verdict('[true]'), (None, 0.0))
+
+
+class TestModelCascade(unittest.TestCase):
+
+    def test_keeps_the_confident_verdicts_of_the_small_model(self):
+        small = FakeLLM('small', '{"result": true, "confidence": 0.9}')
+        large = FakeLLM('large', '{"result": false}')
+        self.assertEqual(ModelCascade(small, large, min_confidence=0.8).classify('prompt'), (True, False))
+        self.assertEqual(large.prompts, [])
+
+    def test_escalates_the_unsure_verdicts(self):
+        small = FakeLLM('small', '{"result": true, "confidence": 0.5}')
+        large = FakeLLM('large', '{"result": false}')
+        self.assertEqual(ModelCascade(small, large, min_confidence=0.8).classify('prompt'), (False, True))
+        self.assertEqual(large.prompts, ['prompt'])
+
+    def test_escalates_the_malformed_answers(self):
+        small = FakeLLM('small', 'I think it is relevant')
+        large = FakeLLM('large', '{"result": true}')
+        self.assertEqual(ModelCascade(small, large, min_confidence=0).classify('prompt'), (True, True))
+
+    def test_name_identifies_the_models_and_threshold(self):
+        cascade = ModelCascade(FakeLLM('gemma3:1b', ''), FakeLLM('gemma3:12b', ''), min_confidence=0.8)
+        self.assertEqual(cascade.name, 'gemma3:1b>gemma3:12b@0.8')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+
+import httpx
+from ollama import ResponseError
+
+from agents.utils.ollama_pool import OllamaPool, is_host_error, parse_hosts
+
+
+class FakeClient:
+    """An Ollama client that raises the given errors, in order, and then answers."""
+
+    def __init__(self, *errors: Exception):
+        self.errors: list[Exception] = list(errors)
+        self.calls: int = 0
+
+    def chat(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {'message': {'content': '{"result": true}'}, 'eval_count': 5}
+
+
+class TestParseHosts(unittest.TestCase):
+
+    def test_adds_the_default_port(self):
+        self.assertEqual(parse_hosts('box1:11435, box2,, http://box3', 11434),
+                         ['box1:11435', 'box2:11434', 'http://box3:11434'])
+
+
+class TestIsHostError(unittest.TestCase):
+
+    def test_server_errors(self):
+        self.assertTrue(is_host_error(ConnectionError('Failed to connect to Ollama')))
+        self.assertTrue(is_host_error(httpx.ReadTimeout('timed out')))
+        self.assertTrue(is_host_error(httpx.RemoteProtocolError('disconnected')))
+        self.assertTrue(is_host_error(ResponseError('overloaded', 503)))
+
+    def test_request_errors(self):
+        self.assertFalse(is_host_error(ResponseError('model not found', 404)))
+        self.assertFalse(is_host_error(ResponseError('streamed error')))
+
+    def test_programming_errors(self):
+        self.assertFalse(is_host_error(TypeError("chat() got an unexpected keyword argument 'foo'")))
+        self.assertFalse(is_host_error(KeyError('message')))
+
+
+class TestOllamaPool(unittest.TestCase):
+
+    def pool(self, *clients: FakeClient, **kwargs) -> OllamaPool:
+        pool = OllamaPool([f'box{i}:11434' for i in range(len(clients))], **kwargs)
+        for host, client in zip(pool.hosts, clients):
+            host.client = client
+        return pool
+
+    def test_retries_a_server_error_on_another_host(self):
+        failing, healthy = FakeClient(httpx.ReadTimeout('timed out')), FakeClient()
+        pool = self.pool(failing, healthy)
+        pool.hosts[1].requests = 1  # The first request goes to the failing host
+        self.assertEqual(pool.chat(model='m')['eval_count'], 5)
+        self.assertEqual((failing.calls, healthy.calls), (1, 1))
+        stats = pool.get_stats()
+        self.assertEqual(stats['box0:11434']['timeouts'], 1)
+        self.assertEqual(stats['box0:11434']['retries'], 1)
+
+    def test_gives_up_after_max_retries(self):
+        client = FakeClient(*[ConnectionError('down')] * 5)
+        pool = self.pool(client, max_retries=2)
+        with self.assertRaises(ConnectionError):
+            pool.chat(model='m')
+        self.assertEqual(client.calls, 3)
+
+    def test_does_not_retry_request_errors(self):
+        client = FakeClient(ResponseError('model not found', 404))
+        pool = self.pool(client, FakeClient())
+        pool.hosts[1].requests = 1
+        with self.assertRaises(ResponseError):
+            pool.chat(model='m')
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(pool.get_stats()['box0:11434']['failures'], 0)
+
+    def test_programming_errors_do_not_affect_the_hosts(self):
+        clients = [FakeClient(*[TypeError('bad argument')] * 3) for _ in range(3)]
+        pool = self.pool(*clients, max_failures=1)
+        for _ in range(3):
+            with self.assertRaises(TypeError):
+                pool.chat(model='m')
+        self.assertEqual(sum(client.calls for client in clients), 3)
+        for stats in pool.get_stats().values():
+            self.assertEqual((stats['requests'], stats['failures'], stats['outstanding']), (0, 0, 0))
+            self.assertFalse(stats['ejected'])
+
+    def test_ejects_a_host_after_max_failures(self):
+        failing, healthy = FakeClient(*[ConnectionError('down')] * 2), FakeClient()
+        pool = self.pool(failing, healthy, max_failures=2, max_retries=0)
+        pool.hosts[1].requests = 10  # The requests go to the failing host while it is in the pool
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                pool.chat(model='m')
+        self.assertTrue(pool.get_stats()['box0:11434']['ejected'])
+        pool.chat(model='m')
+        self.assertEqual(healthy.calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+
+from agents.elasticsearch.query_planner import plan_filter, plan_filters, CHEAP, MODERATE, EXPENSIVE
+from app.vars import *
+
+MAPPINGS = {
+    SUBJECT: {'type': 'text'},
+    CONTENT: {'type': 'text', 'index_prefixes': {}},
+    FROM: {'type': 'keyword'},
+    TO: {'type': 'text', 'fields': {'keyword': {'type': 'keyword'}, 'wildcard': {'type': 'wildcard'}}},
+    'CODE': {'type': 'wildcard'}
+}
+
+
+def request_filter(field: str, operator: str, value: str) -> dict:
+    return {FIELD: field, OPERATOR: operator, VALUE: value}
+
+
+class TestPlanFilter(unittest.TestCase):
+
+    def test_equals_on_a_keyword_field_is_a_term_query(self):
+        planned = plan_filter(request_filter(FROM, EQUALS, 'alice@enron.com'), MAPPINGS)
+        self.assertEqual(planned.clause, {'term': {FROM: 'alice@enron.com'}})
+        self.assertFalse(planned.negated)
+        self.assertIsNotNone(planned.rewrite)
+
+    def test_equals_on_a_text_field_is_a_phrase_query(self):
+        planned = plan_filter(request_filter(SUBJECT, EQUALS, 'quarterly report'), MAPPINGS)
+        self.assertEqual(planned.clause, {'match_phrase': {SUBJECT: 'quarterly report'}})
+        self.assertIsNone(planned.rewrite)
+
+    def test_different_is_negated(self):
+        planned = plan_filter(request_filter(FROM, DIFFERENT, 'alice@enron.com'), MAPPINGS)
+        self.assertEqual(planned.clause, {'term': {FROM: 'alice@enron.com'}})
+        self.assertTrue(planned.negated)
+
+    def test_contains_on_a_wildcard_field(self):
+        planned = plan_filter(request_filter('CODE', CONTAINS, 'x1'), MAPPINGS)
+        self.assertEqual(planned.clause, {'wildcard': {'CODE': '*x1*'}})
+        self.assertEqual(planned.cost, MODERATE)
+
+    def test_contains_uses_the_wildcard_subfield(self):
+        planned = plan_filter(request_filter(TO, CONTAINS, 'enron'), MAPPINGS)
+        self.assertEqual(planned.clause, {'wildcard': {f'{TO}.wildcard': '*enron*'}})
+        self.assertEqual(planned.cost, MODERATE)
+        self.assertIn(f'{TO}.wildcard', planned.rewrite)
+
+    def test_contains_several_words_on_a_text_field_is_a_phrase_query(self):
+        planned = plan_filter(request_filter(SUBJECT, CONTAINS, 'gas deal'), MAPPINGS)
+        self.assertEqual(planned.clause, {'match_phrase': {SUBJECT: 'gas deal'}})
+        self.assertEqual(planned.cost, CHEAP)
+        self.assertIsNotNone(planned.rewrite)
+
+    def test_contains_one_word_is_an_expensive_leading_wildcard(self):
+        planned = plan_filter(request_filter(SUBJECT, CONTAINS, 'gas'), MAPPINGS)
+        self.assertEqual(planned.clause, {'wildcard': {SUBJECT: '*gas*'}})
+        self.assertEqual(planned.cost, EXPENSIVE)
+        self.assertIsNotNone(planned.warning)
+
+    def test_starts_with_on_indexed_prefixes_is_cheap(self):
+        planned = plan_filter(request_filter(CONTENT, STARTS_WITH, 'urg'), MAPPINGS)
+        self.assertEqual(planned.clause, {'prefix': {CONTENT: 'urg'}})
+        self.assertEqual(planned.cost, CHEAP)
+        self.assertIsNotNone(planned.rewrite)
+
+    def test_starts_with_without_indexed_prefixes(self):
+        planned = plan_filter(request_filter(SUBJECT, STARTS_WITH, 'urg'), MAPPINGS)
+        self.assertEqual(planned.clause, {'prefix': {SUBJECT: 'urg'}})
+        self.assertEqual(planned.cost, MODERATE)
+        self.assertIsNone(planned.rewrite)
+
+    def test_regexp_is_expensive(self):
+        planned = plan_filter(request_filter(SUBJECT, REGEXP, '.*gas'), MAPPINGS)
+        self.assertEqual(planned.clause, {'regexp': {SUBJECT: '.*gas'}})
+        self.assertEqual(planned.cost, EXPENSIVE)
+        self.assertIn('starts with a wildcard', planned.warning)
+
+    def test_fuzzy(self):
+        planned = plan_filter(request_filter(SUBJECT, FUZZY, 'enron'), MAPPINGS)
+        self.assertEqual(planned.clause, {'fuzzy': {SUBJECT: {'value': 'enron', 'fuzziness': 'AUTO'}}})
+        self.assertEqual(planned.cost, MODERATE)
+
+    def test_without_mappings_the_filter_is_translated_directly(self):
+        planned = plan_filter(request_filter(FROM, EQUALS, 'alice@enron.com'), {})
+        self.assertEqual(planned.clause, {'match_phrase': {FROM: 'alice@enron.com'}})
+        planned = plan_filter(request_filter(SUBJECT, CONTAINS, 'gas deal'), {})
+        self.assertEqual(planned.clause, {'wildcard': {SUBJECT: '*gas deal*'}})
+        self.assertEqual(planned.cost, EXPENSIVE)
+
+    def test_unknown_operator(self):
+        with self.assertRaises(ValueError):
+            plan_filter(request_filter(SUBJECT, 'sounds like', 'gas'), MAPPINGS)
+
+
+class TestPlanFilters(unittest.TestCase):
+
+    def test_orders_the_filters_from_the_cheapest(self):
+        filters = [
+            request_filter(SUBJECT, REGEXP, 'g.s'),
+            request_filter(SUBJECT, FUZZY, 'enron'),
+            request_filter(FROM, EQUALS, 'alice@enron.com'),
+            request_filter(SUBJECT, CONTAINS, 'gas'),
+            request_filter(TO, EQUALS, 'bob')
+        ]
+        planned = plan_filters(filters, MAPPINGS)
+        self.assertEqual([p.cost for p in planned], [CHEAP, CHEAP, MODERATE, EXPENSIVE, EXPENSIVE])
+        # Filters of the same cost keep their order
+        self.assertEqual([p.value for p in planned], ['alice@enron.com', 'bob', 'enron', 'g.s', 'gas'])
+
+
+if __name__ == '__main__':
+    unittest.main()